@@ -0,0 +1,230 @@
+"""
+AppCDS (class data sharing) archive builder
+
+Loading classes is a large part of a cold start. This runs a training start of the server with
+-XX:ArchiveClassesAtExit, which saves the classes it loaded into server.jsa, and adds -XX:SharedArchiveFile to the
+start command so later starts map them instead of loading them again.
+The archive is made again when the server jar, the mods or Java change (checked by hash).
+On Java 19+ -XX:+AutoCreateSharedArchive is added too, so an archive that was removed because it was outdated is
+made again by the next normal start. Java 13+ is needed.
+
+Only classes from the JDK and the server jar's class path can be archived. Fabric loads Minecraft and the mods with
+its own class loader, so those are still loaded normally. Use --measure to see what the archive saves on your server.
+
+Usage: python AppCDS.py [server directory] [--force] [--measure N]
+--force makes the archive even if it is up to date
+--measure N times N starts without and with the archive
+The start command is read from the MASS config (mass-config.json) if it has one, otherwise from start.sh/start.bat.
+MASS (adaptive-start.py) removes an outdated archive before it starts the server if this file is next to it
+"""
+
+import os, re, sys, json, time, shutil, hashlib, subprocess
+import MCDownloader, JVMFlags
+
+ARCHIVE = "server.jsa"
+STAMP = ARCHIVE + ".json" # Fingerprint of what the archive was made from
+MASS_CONFIG = "mass-config.json"
+START_FILES = ("start.sh", "start.bat")
+STARTUP_TIMES = "startup_times.json" # Written by MASS
+
+JAVA = re.compile(r"^(\s*(?:exec\s+)?(\S*java(?:\.exe)?))(?=\s)", re.MULTILINE | re.IGNORECASE)
+CDS_FLAGS = re.compile(r"\s+-XX:(?:SharedArchiveFile|ArchiveClassesAtExit)=\S+|\s+-XX:[+-]AutoCreateSharedArchive")
+DONE = re.compile(r"\]: Done \(") # [Server thread/INFO]: Done (12.345s)! For help, type "help"
+
+
+def load_command(directory: str = ".", command: str | None = None) -> tuple[str | None, str]:
+    """
+    Returns the file the java command is in and the command
+
+    @param command: The command used to start the server (e.g. MASS's start_command). Found in directory if None.
+    A command that runs a start file (bash start.sh) is replaced with the contents of the file
+    """
+    if command is None:
+        path = os.path.join(directory, MASS_CONFIG)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                command = json.load(f).get("start_command")
+            if command and JAVA.search(command):
+                return path, command
+
+    for name in START_FILES:
+        path = os.path.join(directory, name)
+        if (command is None or name in command) and os.path.exists(path):
+            with open(path, "r") as f:
+                return path, f.read()
+
+    if command is None or JAVA.search(command) is None:
+        raise FileNotFoundError(f"No java start command found in {os.path.abspath(directory)}")
+    return None, command
+
+def save_command(path: str, command: str):
+    """Writes a command back to where load_command found it"""
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            config = json.load(f)
+        config["start_command"] = command
+        with open(path, "w") as f:
+            json.dump(config, f, indent=2)
+    else:
+        with open(path, "w") as f:
+            f.write(command)
+
+def add_flags(command: str, flags: list[str]) -> str:
+    """Returns command with its class data sharing flags replaced with flags"""
+    command = CDS_FLAGS.sub("", command)
+    return JAVA.sub(lambda m: " ".join([m.group(1)] + flags), command, count=1)
+
+def _java(command: str) -> str:
+    return JAVA.search(command).group(2)
+
+def fingerprint(directory: str, command: str) -> str:
+    """Hash of Java, the server jar and the mods. The archive has to be made again if it changes"""
+    digest = hashlib.sha256()
+
+    # Java is identified by its binary instead of running java -version, which would slow down every MASS start
+    java = shutil.which(_java(command))
+    if java is not None:
+        java = os.path.realpath(java)
+        stat = os.stat(java)
+        digest.update(f"{java}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+
+    jar = re.search(r"-jar\s+(\S+)", command)
+    if jar is not None and os.path.exists(os.path.join(directory, jar.group(1))):
+        digest.update(MCDownloader.file_hash(os.path.join(directory, jar.group(1))).encode())
+
+    mods = os.path.join(directory, "mods")
+    if os.path.isdir(mods):
+        with MCDownloader.Downloader(progress=False, verbose=False) as downloader:
+            for name, sha512 in sorted(downloader.hash_jars(mods).items()):
+                digest.update(f"{name}:{sha512}\n".encode())
+    return digest.hexdigest()
+
+def read_stamp(directory: str = ".") -> dict:
+    try:
+        with open(os.path.join(directory, STAMP), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_stamp(directory: str, stamp: dict):
+    with open(os.path.join(directory, STAMP), "w") as f:
+        json.dump(stamp, f, indent=2)
+
+def invalidate(directory: str = ".", command: str | None = None) -> bool:
+    """Removes the archive if the jar, mods or Java changed since it was made. Returns True if it was removed"""
+    if not os.path.exists(os.path.join(directory, ARCHIVE)):
+        return False
+    _, command = load_command(directory, command)
+    stamp = read_stamp(directory)
+    current = fingerprint(directory, command)
+    if stamp.get("fingerprint") == current:
+        return False
+
+    os.remove(os.path.join(directory, ARCHIVE))
+    # On Java 19+ the next start makes the archive again from the current files
+    write_stamp(directory, stamp | {"fingerprint": current, "created": time.time()})
+    return True
+
+def timed_start(directory: str, command: str, timeout: int = 600) -> float | None:
+    """
+    Starts the server, stops it once it is done loading and returns how long the start took.
+    Returns None if it did not start
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command.strip(), shell=True, cwd=directory, text=True,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    took = None
+    for line in process.stdout:
+        if DONE.search(line):
+            took = time.perf_counter() - start
+            break
+        if time.perf_counter() - start > timeout:
+            break
+
+    try:
+        process.stdin.write("stop\n")
+        process.stdin.flush()
+        process.stdout.read()
+        process.wait(timeout)
+    except (BrokenPipeError, subprocess.TimeoutExpired):
+        process.kill()
+    return took
+
+def startup_average(directory: str = ".") -> float | None:
+    """Average wake time recorded by MASS"""
+    try:
+        with open(os.path.join(directory, STARTUP_TIMES), "r") as f:
+            times = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return sum(times) / len(times) if times else None
+
+def build(directory: str = ".", command: str | None = None, force: bool = False) -> bool:
+    """
+    Makes the archive with a training start (if it is outdated) and adds it to the start command.
+    The server must be stopped while this runs.
+    Returns False if the archive could not be made
+    """
+    path, command = load_command(directory, command)
+    java = JVMFlags.java_version(_java(command))
+    if java is None or java < 13:
+        print(f"AppCDS archives need Java 13+ (found {java or 'no Java'})")
+        return False
+
+    stamp = read_stamp(directory)
+    current = fingerprint(directory, command)
+    if force or not os.path.exists(os.path.join(directory, ARCHIVE)) or stamp.get("fingerprint") != current:
+        print("Making the AppCDS archive with a training start...")
+        if os.path.exists(os.path.join(directory, ARCHIVE)): os.remove(os.path.join(directory, ARCHIVE))
+        took = timed_start(directory, add_flags(command, [f"-XX:ArchiveClassesAtExit={ARCHIVE}"]))
+        if took is None or not os.path.exists(os.path.join(directory, ARCHIVE)):
+            print("The training start failed, so no archive was made")
+            return False
+        print(f"Made {ARCHIVE} ({os.path.getsize(os.path.join(directory, ARCHIVE)) / 1024 ** 2:.1f} MB, the training start took {took:.1f}s)")
+
+        # The wake time before the first archive is kept to compare with
+        baseline = stamp.get("baseline", startup_average(directory))
+        write_stamp(directory, {"fingerprint": current, "java": java, "created": time.time(), "baseline": baseline})
+    else:
+        print(f"{ARCHIVE} is up to date")
+
+    flags = [f"-XX:SharedArchiveFile={ARCHIVE}"]
+    if java >= 19: flags.insert(0, "-XX:+AutoCreateSharedArchive")
+    wired = add_flags(command, flags)
+    if wired != command:
+        if path is None:
+            print(f"Start command with the archive: {wired.strip()}")
+        else:
+            save_command(path, wired)
+            print(f"Added the archive to {os.path.basename(path)}")
+    return True
+
+def measure(directory: str = ".", runs: int = 3, command: str | None = None):
+    """Prints the average start time without and with the archive"""
+    _, command = load_command(directory, command)
+    plain = add_flags(command, [])
+    shared = add_flags(command, [f"-XX:SharedArchiveFile={ARCHIVE}"])
+
+    for name, run in (("Without the archive", plain), ("With the archive", shared)):
+        times = [timed_start(directory, run) for _ in range(runs)]
+        times = [took for took in times if took is not None]
+        print(f"{name}: {sum(times) / len(times):.2f}s" if times else f"{name}: the server did not start")
+
+    stamp = read_stamp(directory)
+    now = startup_average(directory)
+    if stamp.get("baseline") is not None and now is not None:
+        print(f"MASS wake time: {stamp['baseline']:.1f}s before the archive, {now:.1f}s now")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    force = "--force" in args
+    if force: args.remove("--force")
+    runs = 0
+    if "--measure" in args:
+        runs = int(args.pop(args.index("--measure") + 1))
+        args.remove("--measure")
+    directory = args[0] if args else "."
+
+    if build(directory, force=force) and runs:
+        measure(directory, runs)
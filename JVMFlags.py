@@ -0,0 +1,239 @@
+"""
+Hardware-aware JVM flags for Minecraft servers
+
+Looks at the RAM, CPUs, cgroup (container) limits, Java version and transparent huge pages of this machine
+and chooses a heap size and GC flags (Aikar's G1 flags, or generational ZGC for big heaps on Java 21+).
+
+Usage: python JVMFlags.py [heap, e.g. 6G] [--jar fabric.jar] [--explain]
+--explain prints why each flag was chosen
+"""
+
+import os, re, sys, math, subprocess
+
+GB = 1024 ** 3
+# Available memory left over by a generated heap, so MASS's ram_required check still passes when a little more is in use
+HEADROOM = GB
+
+# Memory a JVM needs besides the heap (metaspace, threads, GC structures, direct buffers).
+# adaptive-start.py (MASS) uses the same rule for ram_required
+def memory_required(heap: int) -> float:
+    """Returns the GB of RAM a server with a heap of <heap> bytes needs"""
+    heapGB = heap / GB
+    return round(heapGB + max(0.5, heapGB * 0.125), 2)
+
+def parse_size(size: str) -> int:
+    """'4G', '4096M', '4g' -> bytes"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMGT]?)B?", size.strip().upper())
+    if match is None:
+        raise ValueError(f"Invalid size {size}")
+    return int(float(match.group(1)) * 1024 ** " KMGT".index(match.group(2) or " "))
+
+def format_size(size: int) -> str:
+    """Bytes -> the JVM size syntax (G if it is a whole number of GB, M otherwise)"""
+    return f"{size // GB}G" if size % GB == 0 else f"{size // 1024 ** 2}M"
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _cgroup_limits() -> tuple[int | None, float | None]:
+    """Returns the memory (bytes) and CPU limits of the cgroup this process is in, if any"""
+    memory = cpus = None
+
+    # cgroup v2. The path of the cgroup is in /proc/self/cgroup as 0::<path>
+    path = "/"
+    for line in (_read("/proc/self/cgroup") or "").splitlines():
+        if line.startswith("0::"): path = line[3:]
+    base = "/sys/fs/cgroup" + path.rstrip("/")
+
+    value = _read(base + "/memory.max") or _read("/sys/fs/cgroup/memory.max")
+    if value is not None:
+        if value != "max": memory = int(value)
+    else:
+        # cgroup v1. No limit is shown as a huge number
+        value = _read("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+        if value is not None and int(value) < 1 << 60: memory = int(value)
+
+    value = _read(base + "/cpu.max") or _read("/sys/fs/cgroup/cpu.max")
+    if value is not None:
+        quota, period = value.split()
+        if quota != "max": cpus = int(quota) / int(period)
+    else:
+        quota, period = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota is not None and period is not None and int(quota) > 0: cpus = int(quota) / int(period)
+
+    return memory, cpus
+
+def java_version(java: str = "java") -> int | None:
+    """Returns the major version of java (8, 17, 21...) or None if it cannot be run"""
+    try:
+        output = subprocess.run([java, "-version"], capture_output=True, text=True, timeout=15).stderr
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if match is None:
+        return None
+    major = int(match.group(1))
+    return int(match.group(2)) if major == 1 else major # 1.8 is Java 8
+
+def detect(java: str = "java") -> dict:
+    """Returns the hardware (and Java) the flags are chosen for"""
+    total = available = None
+    try:
+        import psutil
+        memory = psutil.virtual_memory()
+        total, available = memory.total, memory.available
+    except ImportError:
+        info = dict(line.split(":", 1) for line in (_read("/proc/meminfo") or "").splitlines() if ":" in line)
+        if "MemTotal" in info:
+            total = int(info["MemTotal"].split()[0]) * 1024
+            available = int(info.get("MemAvailable", info["MemTotal"]).split()[0]) * 1024
+        elif hasattr(os, "sysconf"):
+            total = available = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+    cgroupMemory, cgroupCPUs = _cgroup_limits()
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+    thp = _read("/sys/kernel/mm/transparent_hugepage/enabled")
+    thp = re.search(r"\[(\w+)\]", thp).group(1) if thp else None
+
+    return {
+        "memory": total,
+        "available": available,
+        "cgroup_memory": cgroupMemory,
+        "cpus": cpus or 1,
+        "cgroup_cpus": cgroupCPUs,
+        "java": java_version(java),
+        "thp": thp
+    }
+
+def generate(heap: int | None = None, hardware: dict | None = None) -> list[tuple[str, str]]:
+    """
+    Returns the JVM flags as [(flag, why it was chosen)]
+
+    @param heap: Heap size in bytes. Chosen from the memory of the machine if None
+    @param hardware: From detect(). Detected if None
+    """
+    hw = hardware or detect()
+    flags = []
+
+    # Memory that can be used: the smaller of the machine and the cgroup
+    usable = min(m for m in (hw["memory"], hw["cgroup_memory"]) if m) if hw["memory"] or hw["cgroup_memory"] else None
+    limitName = "cgroup limit" if hw["cgroup_memory"] and (not hw["memory"] or hw["cgroup_memory"] < hw["memory"]) else "RAM"
+    # MASS only starts the server if ram_required fits in the available RAM, so the heap has to fit in it too
+    available = min(m for m in (hw["available"], usable) if m) if hw["available"] or usable else None
+    availableName = "cgroup limit" if available is not None and available == hw["cgroup_memory"] else "available RAM"
+
+    if heap is None:
+        if available is None:
+            heap = 4 * GB
+            reason = "memory could not be detected, so the default of 4G is used"
+        else:
+            # memory_required(heap) plus the headroom has to fit. Leave 1.5G of the total for the OS,
+            # and stay under 31G so compressed pointers still work
+            budget = min(available - HEADROOM, usable - 1.5 * GB)
+            heap = max(GB, min(31 * GB, int(min(budget / 1.125, budget - 0.5 * GB))) // (256 * 1024 ** 2) * (256 * 1024 ** 2))
+            reason = f"{format_size(heap)} needs {memory_required(heap)}G, which fits in the {available / GB:.1f}G {availableName} (what MASS's ram_required is checked against) with room to spare"
+            if memory_required(heap) > available / GB:
+                reason += f" (WARNING: even the smallest heap does not fit in the {available / GB:.1f}G {availableName})"
+    else:
+        reason = "heap size was given"
+        if available is not None and memory_required(heap) > available / GB:
+            reason += f" (WARNING: it needs about {memory_required(heap)}G but only {available / GB:.1f}G is free, so MASS will not start it)"
+    flags.append((f"-Xms{format_size(heap)}", "the heap is allocated once at its full size, so it never has to grow while players are online"))
+    flags.append((f"-Xmx{format_size(heap)}", reason))
+
+    java = hw["java"]
+    cpus = hw["cpus"]
+    if hw["cgroup_cpus"] is not None and hw["cgroup_cpus"] < cpus:
+        cpus = max(1, math.ceil(hw["cgroup_cpus"]))
+        flags.append((f"-XX:ActiveProcessorCount={cpus}", f"the cgroup allows {hw['cgroup_cpus']:g} CPUs of the {hw['cpus']} on the machine, so GC and JIT thread counts are sized for {cpus}"))
+
+    if java is not None and java >= 21 and heap >= 16 * GB and cpus >= 8:
+        flags.append(("-XX:+UseZGC", f"the heap is big ({format_size(heap)}) and there are {cpus} CPUs for concurrent GC work, so ZGC keeps pauses under a millisecond"))
+        if java < 23:
+            flags.append(("-XX:+ZGenerational", f"generational ZGC collects young objects (most of what a server makes) cheaply. It is the default from Java 23, but not on Java {java}"))
+    else:
+        if java is None:
+            why = "Java could not be run to check its version"
+        elif java < 21:
+            why = f"ZGC needs Java 21+ to be generational and this is Java {java}"
+        else:
+            why = f"ZGC only pays off with a heap of 16G+ and 8+ CPUs ({format_size(heap)}, {cpus} CPUs here)"
+        flags.append(("-XX:+UseG1GC", f"G1 with Aikar's flags is tuned for Minecraft's short-lived allocations; {why}"))
+
+        big = heap >= 12 * GB
+        flags += [
+            ("-XX:+ParallelRefProcEnabled", "references are processed with several threads"),
+            ("-XX:MaxGCPauseMillis=200", "pauses are kept to a few ticks (50ms each) without collecting too often"),
+            ("-XX:+UnlockExperimentalVMOptions", "needed for the G1NewSizePercent flags"),
+            ("-XX:+DisableExplicitGC", "mods calling System.gc() cannot cause full collections"),
+            (f"-XX:G1NewSizePercent={40 if big else 30}", "a large young generation, since most objects die within a tick" + (" (higher for heaps of 12G+)" if big else "")),
+            (f"-XX:G1MaxNewSizePercent={50 if big else 40}", "upper bound of the young generation"),
+            (f"-XX:G1HeapRegionSize={16 if big else 8}M", "larger regions so chunk data is not treated as humongous objects"),
+            (f"-XX:G1ReservePercent={15 if big else 20}", "free space kept so evacuation never fails"),
+            ("-XX:G1HeapWastePercent=5", "mixed collections stop early instead of chasing the last few percent"),
+            ("-XX:G1MixedGCCountTarget=4", "old regions are cleaned in few, short mixed collections"),
+            (f"-XX:InitiatingHeapOccupancyPercent={20 if big else 15}", "old generation collection starts early, before it gets urgent"),
+            ("-XX:G1MixedGCLiveThresholdPercent=90", "regions that are mostly live are left alone"),
+            ("-XX:G1RSetUpdatingPauseTimePercent=5", "less pause time spent on remembered sets"),
+            ("-XX:SurvivorRatio=32", "small survivor spaces, since objects either die young or live for long"),
+            ("-XX:MaxTenuringThreshold=1", "objects that survive one collection are promoted right away instead of being copied again"),
+        ]
+
+    flags.append(("-XX:+PerfDisableSharedMem", "no hsperfdata file in /tmp, which can stall GC on slow disks"))
+
+    if available is not None and memory_required(heap) <= (available - HEADROOM) / GB:
+        flags.append(("-XX:+AlwaysPreTouch", f"the {memory_required(heap)}G the server needs fits in the {available / GB:.1f}G {availableName} with room to spare, so the heap is touched at start instead of page faulting during play"))
+
+    if sys.platform.startswith("linux"):
+        if hw["thp"] in ("always", "madvise"):
+            flags.append(("-XX:+UseTransparentHugePages", f"transparent huge pages are enabled ({hw['thp']}), so the heap uses 2M pages and fewer TLB misses"))
+    return flags
+
+def explain(flags: list[tuple[str, str]], hardware: dict | None = None) -> str:
+    """Returns a readable explanation of the flags"""
+    lines = []
+    if hardware is not None:
+        lines.append(f"RAM: {hardware['memory'] / GB:.1f}G ({hardware['available'] / GB:.1f}G available)" if hardware["memory"] else "RAM: unknown")
+        if hardware["cgroup_memory"]: lines.append(f"cgroup memory limit: {hardware['cgroup_memory'] / GB:.1f}G")
+        lines.append(f"CPUs: {hardware['cpus']}" + (f" (cgroup limit {hardware['cgroup_cpus']:g})" if hardware["cgroup_cpus"] else ""))
+        lines.append(f"Java: {hardware['java'] or 'not found'}")
+        if hardware["thp"]:
+            lines.append(f"Transparent huge pages: {hardware['thp']}" + (" (enable them with 'echo madvise > /sys/kernel/mm/transparent_hugepage/enabled' for -XX:+UseTransparentHugePages)" if hardware["thp"] == "never" else ""))
+        lines.append("")
+
+    for flag, reason in flags:
+        lines.append(f"{flag}\n    {reason}")
+
+    heap = next(parse_size(flag[4:]) for flag, _ in flags if flag.startswith("-Xmx"))
+    lines.append(f"\nMASS ram_required: {memory_required(heap)} (heap plus JVM overhead)")
+    return "\n".join(lines)
+
+def start_command(heap: int | str | None = None, jar: str = "fabric.jar", hardware: dict | None = None) -> str:
+    """Returns the java command to start jar with"""
+    if isinstance(heap, str): heap = parse_size(heap)
+    flags = generate(heap, hardware)
+    return " ".join(["java"] + [flag for flag, _ in flags] + ["-jar", jar, "nogui"])
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    jar = "fabric.jar"
+    if "--jar" in args:
+        jar = args.pop(args.index("--jar") + 1)
+        args.remove("--jar")
+    showExplain = "--explain" in args
+    if showExplain: args.remove("--explain")
+
+    hw = detect()
+    heap = parse_size(args[0]) if args else None
+    flags = generate(heap, hw)
+    if showExplain:
+        print(explain(flags, hw))
+        print()
+    print(" ".join(["java"] + [flag for flag, _ in flags] + ["-jar", jar, "nogui"]))
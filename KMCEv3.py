@@ -1,7 +1,7 @@
 VERSION = '1.0'
 
-import os, time, re, requests, json, yaml
-from mcrcon import MCRcon
+import os, sys, time, re, json
+import socket, select, struct, threading, contextlib, atexit, heapq, collections
 
 def compareVersion(version1: str, version2: str) -> int:
     v1 = list(map(int, version1.split('.')))
@@ -17,11 +17,36 @@ def compareVersion(version1: str, version2: str) -> int:
             return True
     return False
 
-def updater(silent = False):
+# Its modification time is the time of the last update check
+UPDATE_CHECK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.KMCEv3-update-check')
+
+def updater(silent = False, interval: float = 86400):
+    """
+    Replaces this file with a newer version from the CDN sites, if there is one.
+
+    @param interval: Seconds to wait after the last check before checking again. Use 0 to always check
+    """
+    import requests
+
     def log(text: str):
         if not silent:
             print(text)
 
+    try:
+        lastCheck = os.stat(UPDATE_CHECK_FILE).st_mtime
+    except OSError:
+        lastCheck = 0
+
+    if time.time() - lastCheck < interval:
+        log("Skipping update check (checked recently)")
+        return
+
+    try:
+        with open(UPDATE_CHECK_FILE, 'w') as f:
+            f.write(str(time.time()))
+    except OSError:
+        pass
+
     log("Checking for updates...")
 
     # Sites that host, in order
@@ -58,9 +83,128 @@ def updater(silent = False):
     else:
         log("The updater did not update the file")
 
+def start_updater(silent = False, interval: float = 86400) -> threading.Thread:
+    """Runs the updater in a background thread so it does not delay anything"""
+    thread = threading.Thread(target=updater, args=(silent, interval), daemon=True)
+    thread.start()
+    return thread
+
 def getBetween(text: str, left: str, right: str):
     return text.split(left, 1)[1].split(right)[0]
 
+def parse_line(line: str) -> tuple[str, dict] | None:
+    """
+    Classifies a log line. Returns the event type and its values, or None if it is not an event.
+
+    Event types and values:
+    chat: player, message
+    command: player, command, args
+    entity_death: entity, coords, reason, uuid, level
+    advancement: player, advancement
+
+    Examples on a PaperMC server:
+
+    Running a command (Bukkit only):
+    [12:00:00] [Server thread/INFO]: Player issued server command: /command example
+
+    Saying a message:
+    [12:00:00] [Async Chat Thread - #1/INFO]: [Not Secure] <Player> .command example
+
+    Named entity died:
+    [12:00:00] [Server thread/INFO]: Named entity EntityZombie['Named Zombie'/19208, uuid='798c0dec-db2c-403b-a83e-70e675f539d0', l='ServerLevel[world]', x=0.00, y=0.00, z=0.00, cpos=[0, -7], tl=385, v=true] died: Named Zombie was killed by magic while trying to escape Player
+    """
+    try:
+        # Saying a message
+        if "<" in line and ">" in line:
+            # Get user and the message.
+            # User should be within < and >
+            player = getBetween(line, "<", ">")
+
+            # Message should be after >
+            message = line.split("> ", 1)[1]
+
+            return "chat", {"player": player, "message": message}
+
+        # Running a command.
+        # This only works on BUKKIT/PaperMC servers
+        # Notice for any below detections, player messages are expected not to work due to satisifying the if statement above
+        elif "issued server command" in line:
+            # Get user and the command.
+            player, command = line.split(" issued server command: ", 1)
+
+            # User cannot contain spaces and will remove the [INFO] and stuff
+            player = player.split(" ")[-1]
+
+            cmd, *args = command.split(' ')
+
+            return "command", {"player": player, "command": cmd, "args": args}
+
+        # Named entity 
+        elif "Named entity" in line:
+            # Get XYZ, Entity, death reason, name of entity, UUID and what dimension
+
+            # Get Entity. It is after Named entity and before [
+            # Entity contains a Entity<entity> so remove it if it exists
+            entity = getBetween(line, "Named entity", "[").replace("Entity", "").strip()
+
+            # Get the LIST object of the named entity
+            # First get NAMED ENTITY - [
+            # Then get ] before died
+            # Afterwards, split by ,
+            entityObj = line.split("Named entity", 1)[1].split("[", 1)[1] \
+                        .split("died")[0][:-2] # The :-2 removes the space and ] character at the end
+            
+            entityObj = entityObj.split(',')
+
+            # Get values
+            uuid = level = x = y = z = None
+            for v in entityObj:
+                v = v.strip()
+                if v.startswith("uuid="):
+                    uuid = getBetween(v, "'", "'")
+                elif v.startswith("l="):
+                    level = getBetween(v, "'", "'")
+                elif v.startswith("x="):
+                    x = v.split("=")[1]
+                elif v.startswith("y="):
+                    y = v.split("=")[1]
+                elif v.startswith("z="):
+                    z = v.split("=")[1]
+
+            try:
+                coords = (float(x), float(y), float(z))
+            except TypeError:
+                coords = None
+
+            # Get death reason
+            deathReason = line.split("died: ", 1)[1]
+
+            # Turn into dict
+            return "entity_death", {
+                "entity": entity,
+                "coords": coords,
+                "reason": deathReason,
+                "uuid": uuid,
+                "level": level
+            }
+
+        # Assuming vanilla mechanincs
+        elif " has made the advancement [" in line:
+            text = line.split(': ', 1)[1]
+
+            # Get the player and the advancement
+            player, advancement = text.split(' has made the advancement [', 1)
+
+            # Trim advancement (has a ] at the end)
+            advancement = advancement[:-1].strip()
+
+            return "advancement", {"player": player.strip(), "advancement": advancement}
+    except (IndexError, ValueError):
+        # Not formatted like an event after all
+        pass
+
+    return None
+
 def compact_JSON(data: dict | list):
     if isinstance(data, dict):
         data = [data]
@@ -89,33 +233,972 @@ def compact_JSON(data: dict | list):
 
     return final.replace('\n', '\\n')
 
+def join_components(rendered: list[str]) -> str:
+    """
+    Joins several compact_JSON results into one text component, putting each on a new line.
+    An empty root is used so that the first part's style is not inherited by the others.
+    """
+    if len(rendered) == 1:
+        return rendered[0]
+    return '[{text:""},' + ',{text:"\\n"},'.join(rendered) + ']'
+
+def split_tellraws(player: str, rendered: list[str]) -> list[str]:
+    """
+    Joins compact_JSON results into as few tellraw commands as possible,
+    keeping each one under the RCON request limit (RCON_MAX_PAYLOAD).
+    A single part that is too long on its own is still sent by itself
+    """
+    commands = []
+    group = []
+    for part in rendered:
+        if group and len(f"tellraw {player} {join_components(group + [part])}".encode('utf-8')) > RCON_MAX_PAYLOAD:
+            commands.append(f"tellraw {player} {join_components(group)}")
+            group = []
+        group.append(part)
+    if group:
+        commands.append(f"tellraw {player} {join_components(group)}")
+    return commands
+
+def read_nbt(data: bytes) -> dict:
+    """Parses uncompressed NBT data and returns the root compound as a dictionary"""
+    offset = 0
+
+    def unpack(fmt: str):
+        nonlocal offset
+        values = struct.unpack_from(fmt, data, offset)
+        offset += struct.calcsize(fmt)
+        return values[0] if len(values) == 1 else values
+
+    def read_string() -> str:
+        nonlocal offset
+        length = unpack('>H')
+        offset += length
+        return data[offset - length:offset].decode('utf-8', errors='replace')
+
+    def read_array(fmt: str) -> list:
+        length = unpack('>i')
+        return list(unpack(f'>{length}{fmt}')) if length else []
+
+    def read_tag(tagType: int):
+        match tagType:
+            case 1: return unpack('>b')
+            case 2: return unpack('>h')
+            case 3: return unpack('>i')
+            case 4: return unpack('>q')
+            case 5: return unpack('>f')
+            case 6: return unpack('>d')
+            case 7: return read_array('b')
+            case 8: return read_string()
+            case 9:
+                itemType, length = unpack('>bi')
+                return [read_tag(itemType) for _ in range(length)]
+            case 10:
+                compound = {}
+                while (childType := unpack('>b')) != 0:
+                    name = read_string()
+                    compound[name] = read_tag(childType)
+                return compound
+            case 11: return read_array('i')
+            case 12: return read_array('q')
+        raise ValueError(f"Unknown NBT tag type {tagType}")
+
+    rootType = unpack('>b')
+    read_string()
+    return read_tag(rootType)
+
+class RCONError(Exception):
+    """Raised when a RCON command cannot be sent or answered"""
+
+# The vanilla server reads a packet with a single 1460 byte read, so longer requests are dropped
+RCON_MAX_PAYLOAD = 1446
+# and splits responses into packets of 4096 characters
+RCON_RESPONSE_SPLIT = 4096
+
+def _pack_rcon(requestID: int, packetType: int, payload: str) -> bytes:
+    body = struct.pack('<ii', requestID, packetType) + payload.encode('utf-8') + b'\x00\x00'
+    return struct.pack('<i', len(body)) + body
+
+class RCONConnection:
+    """
+    A single authenticated RCON connection.
+    It is not thread-safe by itself, so it should be checked out from a RCONPool.
+
+    The vanilla (and Fabric) server only handles one packet per read and closes the connection otherwise,
+    so packets are sent one at a time unless `pipeline` is set for a server that accepts several in one write.
+    """
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = 5, pipeline: bool = False):
+        self.HOST = host
+        self.PORT = port
+        self.PASSWORD = password
+        self.TIMEOUT = timeout
+        self.PIPELINE = pipeline
+
+        self.sock = None
+        self.requestID = 0
+        self.lastUsed = 0
+
+    def _next_id(self) -> int:
+        self.requestID = self.requestID % 0x7FFFFFFF + 1
+        return self.requestID
+
+    def _read_exactly(self, length: int) -> bytes:
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("RCON connection was closed by the server")
+            data += chunk
+        return bytes(data)
+
+    def _read_packet(self) -> tuple[int, int, str]:
+        length = struct.unpack('<i', self._read_exactly(4))[0]
+        data = self._read_exactly(length)
+        requestID, packetType = struct.unpack('<ii', data[:8])
+        return requestID, packetType, data[8:-2].decode('utf-8', errors='replace')
+
+    def connect(self):
+        """Opens the socket and authenticates"""
+        try:
+            self.sock = socket.create_connection((self.HOST, self.PORT), self.TIMEOUT)
+            self.sock.sendall(_pack_rcon(self._next_id(), 3, self.PASSWORD))
+
+            # Some servers send an empty response value before the auth response
+            while True:
+                requestID, packetType, _ = self._read_packet()
+                if packetType == 2:
+                    break
+        except OSError as e:
+            self.close()
+            raise RCONError(e) from e
+
+        if requestID == -1:
+            self.close()
+            raise RCONError("RCON authentication failed (wrong password)")
+
+        self.lastUsed = time.monotonic()
+
+    def alive(self) -> bool:
+        """Cheap health check: the socket is open and the server has not closed it"""
+        if self.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable:
+                # Nothing should be pending between commands, so this is either EOF or garbage
+                return self.sock.recv(1, socket.MSG_PEEK) != b''
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def command(self, command: str, timeout: float | None = None) -> str:
+        """
+        Runs a command and returns the full (possibly multi-packet) response.
+
+        @param timeout: Seconds to wait for the response. Defaults to the connection timeout
+        """
+        return self.commands([command], timeout)[0]
+
+    def _read_until(self, endID: int, requestIDs: dict[int, int], responses: list[list[str]]):
+        """Reads responses into `responses` until the echo of the end marker `endID`"""
+        while True:
+            responseID, _, body = self._read_packet()
+            if responseID == endID:
+                return
+            if responseID in requestIDs:
+                responses[requestIDs[responseID]].append(body)
+
+    def commands(self, commands: list[str], timeout: float | None = None) -> list[str]:
+        """
+        Runs several commands and returns their responses in order.
+        Each command is sent once the previous one is answered. With `pipeline`, they are all sent in a single write.
+
+        @param timeout: Seconds to wait for the responses. Defaults to the connection timeout
+        """
+        if self.sock is None:
+            raise RCONError("RCON connection is not open")
+        for command in commands:
+            if len(command.encode('utf-8')) > RCON_MAX_PAYLOAD:
+                raise RCONError(f"RCON command is longer than {RCON_MAX_PAYLOAD} bytes: {command[:50]}...")
+
+        try:
+            self.sock.settimeout(timeout or self.TIMEOUT)
+            responses = [[] for _ in commands]
+
+            if self.PIPELINE:
+                requestIDs = {}
+                data = bytearray()
+                for i, command in enumerate(commands):
+                    requestID = self._next_id()
+                    requestIDs[requestID] = i
+                    data += _pack_rcon(requestID, 2, command)
+
+                # The server answers an unknown packet type with the same ID,
+                # so it marks the end of responses that were split into several packets
+                endID = self._next_id()
+                data += _pack_rcon(endID, 0, '')
+                self.sock.sendall(data)
+                self._read_until(endID, requestIDs, responses)
+            else:
+                for i, command in enumerate(commands):
+                    requestID = self._next_id()
+                    self.sock.sendall(_pack_rcon(requestID, 2, command))
+                    while True:
+                        responseID, _, body = self._read_packet()
+                        if responseID == requestID:
+                            responses[i].append(body)
+                            break
+
+                    # A full packet may be followed by the rest of the response.
+                    # The command has finished once it is answered, so the end marker can be sent on its own now
+                    if len(body.encode('utf-16-le')) // 2 >= RCON_RESPONSE_SPLIT:
+                        endID = self._next_id()
+                        self.sock.sendall(_pack_rcon(endID, 0, ''))
+                        self._read_until(endID, {requestID: i}, responses)
+        except OSError as e:
+            # The stream is in an unknown state after a timeout, so it cannot be reused
+            self.close()
+            raise RCONError(e) from e
+
+        self.lastUsed = time.monotonic()
+        return [''.join(response) for response in responses]
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+class RCONPool:
+    """
+    A thread-safe pool of authenticated RCON connections.
+
+    Connections are opened lazily up to `size`, health checked before they are reused,
+    and reopened with an exponential backoff while the server is unreachable (e.g. restarting).
+    """
+
+    def __init__(self, host: str, port: int, password: str, size: int = 4, timeout: float = 5, max_backoff: float = 30, pipeline: bool = False):
+        self.HOST = host
+        self.PORT = port
+        self.PASSWORD = password
+        self.SIZE = size
+        self.TIMEOUT = timeout
+        self.MAX_BACKOFF = max_backoff
+        self.PIPELINE = pipeline
+
+        self.idle = []
+        self.opened = 0
+        self.backoff = 0
+        self.retryAt = 0
+        self.cond = threading.Condition()
+
+    def _open(self) -> RCONConnection:
+        with self.cond:
+            wait = self.retryAt - time.monotonic()
+        if wait > 0:
+            raise RCONError(f"RCON is unavailable, retrying in {wait:.1f}s")
+
+        conn = RCONConnection(self.HOST, self.PORT, self.PASSWORD, self.TIMEOUT, self.PIPELINE)
+        try:
+            conn.connect()
+        except RCONError:
+            with self.cond:
+                self.backoff = min(self.MAX_BACKOFF, self.backoff * 2 or 0.5)
+                self.retryAt = time.monotonic() + self.backoff
+            raise
+
+        with self.cond:
+            self.backoff = 0
+            self.retryAt = 0
+        return conn
+
+    def acquire(self, timeout: float | None = None) -> RCONConnection:
+        """
+        Checks out a connection, opening a new one if the pool is not full.
+
+        @param timeout: Seconds to wait for a free connection. None waits forever
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            while True:
+                while self.idle:
+                    conn = self.idle.pop()
+                    if conn.alive():
+                        return conn
+                    conn.close()
+                    self.opened -= 1
+
+                if self.opened < self.SIZE:
+                    self.opened += 1
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise RCONError("Timed out waiting for a free RCON connection")
+                self.cond.wait(remaining)
+
+        try:
+            return self._open()
+        except BaseException:
+            with self.cond:
+                self.opened -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, conn: RCONConnection, broken: bool = False):
+        """Returns a connection to the pool. Broken connections are closed instead"""
+        with self.cond:
+            if broken or conn.sock is None:
+                conn.close()
+                self.opened -= 1
+            else:
+                self.idle.append(conn)
+            self.cond.notify()
+
+    def connect(self):
+        """Opens one connection right away to check that RCON works"""
+        self.release(self.acquire())
+
+    def command(self, command: str, timeout: float | None = None) -> str:
+        """Runs a command on a pooled connection"""
+        return self.commands([command], timeout)[0]
+
+    def commands(self, commands: list[str], timeout: float | None = None) -> list[str]:
+        """Runs several commands on one pooled connection (in a single write if the pool pipelines)"""
+        conn = self.acquire(timeout)
+        try:
+            result = conn.commands(commands, timeout)
+        except BaseException:
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+        return result
+
+    def close(self):
+        with self.cond:
+            for conn in self.idle:
+                conn.close()
+                self.opened -= 1
+            self.idle.clear()
+
+class Scoreboard:
+    """
+    An in-memory table of scoreboard values, so reads do not need a RCON command each.
+
+    A player's scores are fetched all at once with `scoreboard players list <player>`,
+    and offline players are loaded from the world's data/scoreboard.dat file.
+    Values older than `max_age` seconds are fetched again when read.
+    """
+
+    def __init__(self, kmce: 'KMCE', max_age: float = 1):
+        self.KMCE = kmce
+        self.MAX_AGE = max_age
+
+        self.table = {}         # objective -> {player: score}
+        self.fetched = {}       # player -> time their scores were fetched
+        self.displayNames = {}  # objective display name -> objective name
+        self.fileStat = None
+        self.refreshed = 0
+        self.lock = threading.RLock()
+
+    def _file(self) -> str:
+        return os.path.join(self.KMCE.DIRECTORY, getattr(self.KMCE, 'LEVEL', 'world'), 'data', 'scoreboard.dat')
+
+    def load_file(self):
+        """Loads every score from scoreboard.dat if it changed since the last load"""
+        path = self._file()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) == self.fileStat:
+            return
+
+        import gzip
+        with gzip.open(path, 'rb') as f:
+            data = read_nbt(f.read()).get('data', {})
+
+        with self.lock:
+            for objective in data.get('Objectives', []):
+                displayName = objective.get('DisplayName', objective['Name'])
+                if isinstance(displayName, str):
+                    try:
+                        displayName = json.loads(displayName)
+                    except json.JSONDecodeError:
+                        pass
+                if isinstance(displayName, dict):
+                    displayName = displayName.get('text', objective['Name'])
+                self.displayNames[str(displayName)] = objective['Name']
+
+            for score in data.get('PlayerScores', []):
+                # Scores fetched with RCON are newer than the saved file
+                if score['Name'] not in self.fetched:
+                    self.table.setdefault(score['Objective'], {})[score['Name']] = score['Score']
+
+            self.fileStat = (stat.st_mtime_ns, stat.st_size)
+
+    def _parse(self, player: str, result: str):
+        """Stores the output of `scoreboard players list <player>`"""
+        scores = {}
+        for displayName, value in re.findall(r'\[([^\]]*)\]: (-?\d+)', result.split(player, 1)[-1]):
+            scores[self.displayNames.get(displayName, displayName)] = int(value)
+
+        with self.lock:
+            for objective, values in self.table.items():
+                if objective not in scores:
+                    values.pop(player, None)
+            for objective, value in scores.items():
+                self.table.setdefault(objective, {})[player] = value
+            self.fetched[player] = time.monotonic()
+
+    def fetch(self, *players: str):
+        """Fetches all scores of the players, in one RCON write"""
+        # The saved file maps the objectives' display names (used in the output) to their names
+        self.load_file()
+
+        results = self.KMCE.run_many([f"scoreboard players list {player}" for player in players])
+        for player, result in zip(players, results):
+            if result:
+                self._parse(player, result)
+
+    def refresh(self):
+        """Reloads the saved file if it changed and fetches the scores of every online player"""
+        self.load_file()
+
+        result = self.KMCE.run("list")
+        online = [name.strip() for name in result.split(':', 1)[-1].split(',') if name.strip()] if ':' in result else []
+        if online:
+            self.fetch(*online)
+
+        self.refreshed = time.monotonic()
+
+    def fetch_score(self, player: str, objective: str) -> int:
+        """Fetches one score with `scoreboard players get`, which names the objective exactly. Returns 0 if there is none"""
+        result = self.KMCE.run(f"scoreboard players get {player} {objective}")
+        match = re.search(r'has (-?\d+) \[([^\]]*)\]', result)
+        with self.lock:
+            if match is None:
+                self.table.get(objective, {}).pop(player, None)
+                return 0
+
+            # The output shows the display name, so `scoreboard players list` can be read correctly from now on
+            self.displayNames[match.group(2)] = objective
+            value = int(match.group(1))
+            self.table.setdefault(objective, {})[player] = value
+            return value
+
+    def get(self, player: str, objective: str, max_age: float | None = None) -> int:
+        """
+        Returns the score of a player, or 0 if there is none.
+
+        @param max_age: Seconds a cached value can be used for. Defaults to the table's max age, and 0 always fetches it
+        """
+        maxAge = self.MAX_AGE if max_age is None else max_age
+        if maxAge == 0:
+            return self.fetch_score(player, objective)
+
+        if time.monotonic() - self.fetched.get(player, -maxAge - 1) > maxAge:
+            self.fetch(player)
+
+        with self.lock:
+            value = self.table.get(objective, {}).get(player)
+        if value is None:
+            # `scoreboard players list` shows display names. One that is not in scoreboard.dat yet (a new objective,
+            # no saved file or a styled name) is stored under the display name, so it is asked for by name
+            return self.fetch_score(player, objective)
+        return value
+
+    def set(self, player: str, objective: str, value: int) -> str:
+        """Sets a score through RCON and in the table"""
+        result = self.KMCE.run(f"scoreboard players set {player} {objective} {value}")
+        with self.lock:
+            self.table.setdefault(objective, {})[player] = value
+        return result
+
+    def add(self, player: str, objective: str, amount: int) -> str:
+        """Adds to a score through RCON and in the table"""
+        result = self.KMCE.run(f"scoreboard players add {player} {objective} {amount}")
+        with self.lock:
+            values = self.table.setdefault(objective, {})
+            values[player] = values.get(player, 0) + amount
+        return result
+
+    def top(self, objective: str, n: int = 10) -> list[tuple[str, int]]:
+        """Returns the `n` highest (player, score) pairs of an objective, refreshing the table if it is old"""
+        if time.monotonic() - self.refreshed > self.MAX_AGE:
+            self.refresh()
+
+        with self.lock:
+            return heapq.nlargest(n, self.table.get(objective, {}).items(), key=lambda item: item[1])
+
+def _index_archive(path: str) -> dict:
+    """Classifies every line of a gzip log and returns its offsets by player and event type (run in a worker)"""
+    import gzip
+
+    players = {}
+    events = {}
+    offset = 0
+
+    with gzip.open(path, 'rb') as f:
+        for raw in f:
+            event = parse_line(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if event is not None:
+                eventType, values = event
+                events.setdefault(eventType, []).append(offset)
+                if values.get("player"):
+                    players.setdefault(values["player"], []).append(offset)
+            offset += len(raw)
+
+    def delta(offsets: list[int]) -> list[int]:
+        # Offsets are stored as differences to keep the index small
+        return [offsets[0]] + [b - a for a, b in zip(offsets, offsets[1:])]
+
+    return {
+        "players": {k: delta(v) for k, v in players.items()},
+        "events": {k: delta(v) for k, v in events.items()}
+    }
+
+class LogIndex:
+    """
+    An on-disk index of the rotated logs (logs/YYYY-MM-DD-N.log.gz), to query or replay history without a full rescan.
+
+    Archives never change once rotated, so each one is decompressed and classified (with parse_line) only once,
+    in parallel workers. The line offsets by player and by event type are saved in logs/kmce-index.json.
+    """
+
+    def __init__(self, directory: str = '', workers: int | None = None, processes: bool = False):
+        """
+        @param directory: The base directory of the server
+        @param workers: The amount of workers. Defaults to the amount of CPUs
+        @param processes: Use worker processes instead of threads, which is faster for many archives.
+        Threads are the default because on Windows and macOS each worker process imports the main script again,
+        and a KMCE script that calls start() at the top level would then start in every worker and never return.
+        Only use this if the script runs KMCE inside an `if __name__ == "__main__":` block
+        """
+        self.LOGS = os.path.join(directory, "logs")
+        self.FILE = os.path.join(self.LOGS, "kmce-index.json")
+        self.WORKERS = workers
+        self.PROCESSES = processes
+
+        self.archives = {}
+
+        if os.path.exists(self.FILE):
+            try:
+                with open(self.FILE, 'r') as f:
+                    self.archives = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                print("The log index is unreadable and will be rebuilt")
+
+    def list_archives(self) -> list[str]:
+        """Returns the names of the rotated logs, oldest first"""
+        names = []
+        for name in os.listdir(self.LOGS):
+            match = re.fullmatch(r'(\d{4}-\d{2}-\d{2})-(\d+)\.log\.gz', name)
+            if match:
+                names.append((match.group(1), int(match.group(2)), name))
+        return [name for *_, name in sorted(names)]
+
+    def build(self) -> int:
+        """Indexes the archives that are new or changed. Returns how many were indexed"""
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        todo = {}
+        for name in self.list_archives():
+            stat = os.stat(os.path.join(self.LOGS, name))
+            cached = self.archives.get(name)
+            if cached is None or (cached["size"], cached["mtime"]) != (stat.st_size, stat.st_mtime_ns):
+                todo[name] = stat
+
+        if todo:
+            executor = ProcessPoolExecutor if self.PROCESSES else ThreadPoolExecutor
+            with executor(self.WORKERS) as pool:
+                results = pool.map(_index_archive, [os.path.join(self.LOGS, name) for name in todo], chunksize=4)
+                for (name, stat), result in zip(todo.items(), results):
+                    self.archives[name] = {"size": stat.st_size, "mtime": stat.st_mtime_ns} | result
+
+            # Forget archives that were deleted
+            existing = set(self.list_archives())
+            self.archives = {k: v for k, v in self.archives.items() if k in existing}
+
+            temp = self.FILE + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump(self.archives, f, separators=(',', ':'))
+            os.replace(temp, self.FILE)
+
+        return len(todo)
+
+    def offsets(self, name: str, player: str | None = None, event: str | None = None) -> list[int] | None:
+        """Returns the sorted line offsets of an archive that match, or None if the archive has to be scanned"""
+        archive = self.archives.get(name)
+        if archive is None or (player is None and event is None):
+            return None
+
+        def expand(deltas: list[int]) -> set[int]:
+            offsets, total = set(), 0
+            for d in deltas:
+                total += d
+                offsets.add(total)
+            return offsets
+
+        matches = None
+        if player is not None:
+            matches = expand(archive["players"].get(player, []))
+        if event is not None:
+            eventMatches = expand(archive["events"].get(event, []))
+            matches = eventMatches if matches is None else matches & eventMatches
+        return sorted(matches)
+
+    def query(self, player: str | None = None, event: str | None = None):
+        """
+        Yields (archive name, line) of every line that matches, oldest first.
+        Archives without a match are not opened.
+        Call build() first so new archives are included.
+
+        @param player: Only lines of this player
+        @param event: Only lines of this event type (see parse_line)
+        """
+        import gzip
+
+        for name in self.list_archives():
+            offsets = self.offsets(name, player, event)
+            if offsets is not None and not offsets:
+                continue
+
+            with gzip.open(os.path.join(self.LOGS, name), 'rb') as f:
+                if offsets is None:
+                    # Not indexed (or no filter), so every line is read
+                    for raw in f:
+                        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+                        if player is None and event is None:
+                            yield name, line
+                            continue
+
+                        parsed = parse_line(line)
+                        if parsed is not None and (event is None or parsed[0] == event) \
+                                and (player is None or parsed[1].get("player") == player):
+                            yield name, line
+                    continue
+
+                # Only moving forwards, so the archive is decompressed at most once
+                for offset in offsets:
+                    f.seek(offset)
+                    yield name, f.readline().decode('utf-8', errors='replace').rstrip('\r\n')
+
+class LogCheckpoint:
+    """
+    The saved position of the log tailer, so a restart continues where it stopped.
+
+    The position belongs to one log file, which is recognized by its inode and a hash of its first bytes.
+    This way a rotated latest.log is not mistaken for the old one, and the old one can be found in the archives.
+    """
+
+    FINGERPRINT_SIZE = 1024
+
+    def __init__(self, path: str, logfile: str, flush_interval: float = 1):
+        """
+        @param path: Where the position is saved
+        @param logfile: The log file the position is in
+        @param flush_interval: Seconds between saves of positions that are only advanced
+        """
+        self.PATH = path
+        self.LOGFILE = logfile
+        self.FLUSH_INTERVAL = flush_interval
+
+        self.inode = None
+        self.fingerprint = None
+        self.fingerprintSize = 0
+        self.offset = 0
+        self.savedOffset = None
+        self.lastFlush = time.monotonic()
+
+        self.saved = None
+        try:
+            with open(self.PATH, 'r') as f:
+                self.saved = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _hash(data: bytes) -> str:
+        import hashlib
+        return hashlib.sha1(data).hexdigest()
+
+    def resume(self) -> int | None:
+        """Returns the saved offset if it belongs to the current log file, or None"""
+        if self.saved is None:
+            return None
+
+        try:
+            with open(self.LOGFILE, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                head = f.read(self.saved["size"])
+        except OSError:
+            return None
+
+        if stat.st_ino != self.saved["inode"] or self._hash(head) != self.saved["fingerprint"] \
+                or self.saved["offset"] > stat.st_size:
+            return None
+
+        self.inode = stat.st_ino
+        self.fingerprint = self.saved["fingerprint"]
+        self.fingerprintSize = self.saved["size"]
+        self.offset = self.savedOffset = self.saved["offset"]
+        return self.offset
+
+    def find_archive(self) -> str | None:
+        """Returns the rotated log (of the latest three) that the saved position belongs to, or None"""
+        import gzip
+
+        logs = os.path.dirname(self.LOGFILE)
+        archives = sorted((name for name in os.listdir(logs) if name.endswith('.log.gz')),
+                          key=lambda name: os.stat(os.path.join(logs, name)).st_mtime, reverse=True)
+
+        for name in archives[:3]:
+            path = os.path.join(logs, name)
+            try:
+                with gzip.open(path, 'rb') as f:
+                    if self._hash(f.read(self.saved["size"])) == self.saved["fingerprint"]:
+                        return path
+            except (OSError, EOFError):
+                continue
+        return None
+
+    def follow_archive(self) -> int:
+        """Keeps the saved position while the rest of its rotated log (see find_archive) is handled. Returns its offset"""
+        self.inode = self.saved["inode"]
+        self.fingerprint = self.saved["fingerprint"]
+        self.fingerprintSize = self.saved["size"]
+        self.offset = self.savedOffset = self.saved["offset"]
+        return self.offset
+
+    def track(self, f):
+        """Remembers which file the offsets belong to. Called with the open log file"""
+        inode = os.fstat(f.fileno()).st_ino
+        if inode == self.inode and self.fingerprintSize >= self.FINGERPRINT_SIZE:
+            return
+
+        if inode != self.inode:
+            self.offset = 0
+
+        f.seek(0)
+        head = f.read(self.FINGERPRINT_SIZE)
+        self.inode = inode
+        self.fingerprint = self._hash(head)
+        self.fingerprintSize = len(head)
+
+    def advance(self, offset: int):
+        """Moves the position. It is saved once the flush interval has passed"""
+        self.offset = offset
+        if time.monotonic() - self.lastFlush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def save(self, offset: int):
+        """Moves the position and saves it right away"""
+        self.offset = offset
+        self.flush()
+
+    def flush(self):
+        self.lastFlush = time.monotonic()
+        if self.fingerprint is None or self.offset == self.savedOffset:
+            return
+
+        temp = self.PATH + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({"inode": self.inode, "fingerprint": self.fingerprint, "size": self.fingerprintSize, "offset": self.offset}, f)
+        os.replace(temp, self.PATH)
+        self.savedOffset = self.offset
+
+class RateLimiter:
+    """
+    Token buckets per key (e.g. a command and a player), for cooldowns and rate limits.
+
+    A bucket holds up to `burst` tokens, refills at `rate` tokens per second, and each allowed call takes a token.
+    A full bucket is the same as no bucket, so buckets are dropped once they are full again. They are found
+    with a heap of the times they become full, so memory is bounded by the recently active players.
+    Keys are spread over striped locks, so concurrent handlers rarely wait on each other.
+    """
+
+    def __init__(self, stripes: int = 16):
+        # Each stripe is (lock, {key: [tokens, updated, rate, burst]}, heap of (full time, key))
+        self.stripes = [(threading.Lock(), {}, []) for _ in range(stripes)]
+
+    @staticmethod
+    def _prune(buckets: dict, heap: list, now: float):
+        """Drops the buckets of a stripe that are full again. The stripe's lock must be held"""
+        while heap and heap[0][0] <= now:
+            _, oldKey = heapq.heappop(heap)
+            bucket = buckets[oldKey]
+            fullAt = bucket[1] + (bucket[3] - bucket[0]) / bucket[2]
+            if fullAt <= now:
+                del buckets[oldKey]
+            else:
+                heapq.heappush(heap, (fullAt, oldKey))
+
+    def allow(self, key, rate: float, burst: int = 1) -> bool:
+        """Takes a token from the key's bucket. Returns False if it is empty"""
+        now = time.monotonic()
+        lock, buckets, heap = self.stripes[hash(key) % len(self.stripes)]
+
+        with lock:
+            self._prune(buckets, heap, now)
+
+            bucket = buckets.get(key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+
+            if tokens < 1:
+                return False
+
+            if bucket is None:
+                buckets[key] = [tokens - 1, now, rate, burst]
+                heapq.heappush(heap, (now + 1 / rate, key))
+            else:
+                bucket[:] = [tokens - 1, now, rate, burst]
+            return True
+
+    def __len__(self) -> int:
+        """The number of buckets that are not full"""
+        now = time.monotonic()
+        count = 0
+        for lock, buckets, heap in self.stripes:
+            with lock:
+                self._prune(buckets, heap, now)
+                count += len(buckets)
+        return count
+
+class Stats:
+    """
+    Counters and latency histograms of KMCE, returned by KMCE.stats().
+    Recording is a few dictionary operations, so it is always on.
+    """
+
+    # Upper bounds (in seconds) of the histogram buckets. The last bucket has no bound
+    BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1, 10)
+
+    def __init__(self, sample_every: int = 16, slow_handler: float = 0.5):
+        """
+        @param sample_every: Only one line out of this many has its parse time measured
+        @param slow_handler: Handlers that take longer than this (in seconds) are logged
+        """
+        self.SAMPLE_EVERY = sample_every
+        self.SLOW_HANDLER = slow_handler
+
+        self.histograms = {}    # group -> name -> [count, total, max, *buckets]
+        self.counters = {}      # group -> name -> count
+        self.tail = {"bytes_behind": 0, "seconds_behind": None}
+        self.lines = 0
+        self.lock = threading.Lock()
+
+    def sample(self) -> bool:
+        """Returns True once every `sample_every` calls"""
+        self.lines += 1
+        return self.lines % self.SAMPLE_EVERY == 0
+
+    def record(self, group: str, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.setdefault(group, {}).get(name)
+            if histogram is None:
+                histogram = self.histograms[group][name] = [0, 0.0, 0.0] + [0] * (len(self.BUCKETS) + 1)
+
+            histogram[0] += 1
+            histogram[1] += seconds
+            histogram[2] = max(histogram[2], seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                i = len(self.BUCKETS)
+            histogram[3 + i] += 1
+
+    def count(self, group: str, name: str, amount: int = 1):
+        with self.lock:
+            counters = self.counters.setdefault(group, {})
+            counters[name] = counters.get(name, 0) + amount
+
+    def tail_lag(self, bytesBehind: int):
+        """Stores how many bytes of the log are not handled yet"""
+        self.tail["bytes_behind"] = bytesBehind
+
+    def line_lag(self, line: bytes):
+        """Stores how long ago the line being handled was logged, using its [HH:MM:SS] time"""
+        match = re.match(rb'\[(\d\d):(\d\d):(\d\d)', line)
+        if match:
+            now = time.localtime()
+            lineSeconds = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+            # The log only has the time of day, so midnight has to wrap around
+            self.tail["seconds_behind"] = (now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec - lineSeconds) % 86400
+
+    def snapshot(self) -> dict:
+        labels = [f"<={bound}" for bound in self.BUCKETS] + [f">{self.BUCKETS[-1]}"]
+
+        with self.lock:
+            result = {"tail": dict(self.tail), "lines": self.lines}
+            for group, histograms in self.histograms.items():
+                result[group] = {
+                    name: {"count": h[0], "total": h[1], "max": h[2], "histogram": dict(zip(labels, h[3:]))}
+                    for name, h in histograms.items()
+                }
+            for group, counters in self.counters.items():
+                result.setdefault(group, {}).update(counters)
+        return result
+
 class KMCE:
-    def __init__(self, directory: str = ''):
+    def __init__(self, directory: str = '', rcon_connections: int = 4, rcon_pipeline: bool = False):
         """
         Creates a connection to KMCE with a base server directory.
 
         @param directory: The base directory of the server, where the logs folder is contained and the server.properties file
+        @param rcon_connections: The maximum amount of RCON connections used by concurrent handlers
+        @param rcon_pipeline: Send batches of commands in one RCON write. Vanilla and Fabric servers do not support this
         """
 
         self.DIRECTORY = directory
+        self.RCON_CONNECTIONS = rcon_connections
+        self.RCON_PIPELINE = rcon_pipeline
 
         self.chatCommands = {}
         self.chatExpressions = {}
         self.advancementEvents = []
         self.lineEvents = []
-        self.playerCmdTimes = {}
+        self.limiter = RateLimiter()
+        self.STATS = Stats()
+        # command -> (rate, burst) declared with chat_command
+        self.commandLimits = {}
 
         self.entityDeaths = []
         self.serverCommands = {}
 
+        # Pending tellraw messages of the thread's current batch()
+        self.batches = threading.local()
+        # name -> (key, value) of rendered static content
+        self.renderCache = {}
+
+        self.SCOREBOARD = Scoreboard(self)
+
+        # Handlers that may run twice for the same line after a restart. Only these are run by replay()
+        self.idempotentHandlers = set()
+        # Whether the current thread is in replay()
+        self.replaying = threading.local()
+        # Set by start() while it runs
+        self.checkpoint = None
+        self.lineEnd = None
+
         self.store_config()
         
-    def command(self, command: str): 
+    def command(self, command: str, idempotent: bool = False): 
         """
         A decorator that runs when the player runs a command.
         This only works on bukkit servers and will not work on Fabric or the vanilla loader.
 
         @param command: The command the user runs (make sure to contain /)
+        @param idempotent: Whether running it twice for the same line is harmless (see start and replay)
 
         The function needs these parameters:
         
@@ -124,15 +1207,19 @@ class KMCE:
         """
         def wrapper(func): 
             self.serverCommands[command] = func 
+            if idempotent: self.idempotentHandlers.add(func)
         return wrapper
 
 
 
-    def chat_command(self, command: str): 
+    def chat_command(self, command: str, idempotent: bool = False, cooldown: float = 0, burst: int = 1): 
         """
         A decorator that runs when the user inputs a chat command.
 
         @param command: The command the user runs
+        @param idempotent: Whether running it twice for the same line is harmless (see start and replay)
+        @param cooldown: Seconds a player has to wait between uses of this command. 0 means no limit
+        @param burst: Amount of uses a player can make in a row before the cooldown applies
 
         The function needs these parameters:
         
@@ -141,12 +1228,16 @@ class KMCE:
         """
         def wrapper(func): 
             self.chatCommands[command] = func 
+            if idempotent: self.idempotentHandlers.add(func)
+            if cooldown > 0: self.commandLimits[command] = (1 / cooldown, burst)
         return wrapper
 
-    def expression(self, expression: str): 
+    def expression(self, expression: str, idempotent: bool = False): 
         """
         A decorator that runs when the playe's chat matches a regex expression.
 
+        @param idempotent: Whether running it twice for the same line is harmless (see start and replay)
+
         The function needs these parameters:
         
         player: The player executing the command
@@ -154,12 +1245,15 @@ class KMCE:
         """
         def wrapper(func): 
             self.chatExpressions[expression] = func 
+            if idempotent: self.idempotentHandlers.add(func)
         return wrapper
 
-    def advancement(self): 
+    def advancement(self, idempotent: bool = False): 
         """
         A decorator that runs when the player achieves an advancement.
 
+        @param idempotent: Whether running it twice for the same line is harmless (see start and replay)
+
         The function needs these parameters:
         
         player: The player executing the command
@@ -167,31 +1261,39 @@ class KMCE:
         """
         def wrapper(func): 
             self.advancementEvents.append(func)
+            if idempotent: self.idempotentHandlers.add(func)
         return wrapper
 
-    def line(self): 
+    def line(self, idempotent: bool = True): 
         """
         A decorator that runs when the log is updated.
 
+        @param idempotent: Whether running it twice for the same line is harmless (see start and replay).
+                           Line handlers run for every line, so they are assumed to be by default
+
         The function needs these parameters:
         
         line: The text of the line
         """
         def wrapper(func): 
             self.lineEvents.append(func)
+            if idempotent: self.idempotentHandlers.add(func)
         return wrapper
 
 
     def chat(self, expression: str):
         return self.chat(expression)
 
-    def entity_death(self):
+    def entity_death(self, idempotent: bool = False):
         """
         A decorator that registers the function to be called when a named entity dies.
         It will give a dictionary as an argument.
+
+        @param idempotent: Whether running it twice for the same line is harmless (see start and replay)
         """
         def wrapper(func):
             self.entityDeaths.append(func)
+            if idempotent: self.idempotentHandlers.add(func)
         return wrapper
 
 
@@ -209,15 +1311,17 @@ class KMCE:
             for property in properties:
                 if property.startswith('#'): continue
 
-                key, value = property.split('=')
+                key, value = property.rstrip('\n').split('=', 1)
 
                 match key:
                     case "rcon.port":
                         self.PORT = int(value)
                     case "rcon.password":
                         self.PASSWORD = value
+                    case "level-name":
+                        self.LEVEL = value
 
-            self.RCON = MCRcon('0.0.0.0', self.PASSWORD, self.PORT)
+            self.RCON = RCONPool('0.0.0.0', self.PORT, self.PASSWORD, self.RCON_CONNECTIONS, pipeline=self.RCON_PIPELINE)
         except FileNotFoundError:
             print("Unable to fetch the server.properties file from the current directory")
         except AttributeError:
@@ -229,152 +1333,132 @@ class KMCE:
     def cooldown(self, player: str, cooldown: float = 0.05) -> bool:
         """
         Returns a boolean value representing whether the player is on CD or not.
+        True means the player is not on cooldown, and the cooldown starts again.
         """
-        if player in self.playerCmdTimes:
-            cmdTimeDiff = time.time() - self.playerCmdTimes[player]
-        else:
-            cmdTimeDiff = cooldown 
-        
-        if cmdTimeDiff >= cooldown:
-            self.playerCmdTimes[player] = time.time()
+        if cooldown <= 0:
             return True
-        else:
-            return False
+        return self.limiter.allow(('', player), 1 / cooldown)
 
-    def run_line(self, line: str):
-        """Does magic from a MC line"""
-        
+    def run_line(self, line: str, cooldown: bool = True):
         """
-        Examples on a PaperMC server:
-
-        Running a command (Bukkit only):
-        [12:00:00] [Server thread/INFO]: Player issued server command: /command example
-
-        Saying a message:
-        [12:00:00] [Async Chat Thread - #1/INFO]: [Not Secure] <Player> .command example
+        Does magic from a MC line
 
-        Named entity died:
-        [12:00:00] [Server thread/INFO]: Named entity EntityZombie['Named Zombie'/19208, uuid='798c0dec-db2c-403b-a83e-70e675f539d0', l='ServerLevel[world]', x=0.00, y=0.00, z=0.00, cpos=[0, -7], tl=385, v=true] died: Named Zombie was killed by magic while trying to escape Player
+        @param cooldown: Whether player events are subject to the player cooldown
         """
+        # Only some lines are timed, so the timing costs close to nothing
+        if self.STATS.sample():
+            start = time.perf_counter()
+            event = parse_line(line)
+            self.STATS.record("parse", event[0] if event is not None else "other", time.perf_counter() - start)
+        else:
+            event = parse_line(line)
 
-        # First determine of which type
-        # Then, parse the line
-        
-        # Saying a message
-        if "<" in line and ">" in line:
-            # Get user and the message.
-            # User should be within < and >
-            player = getBetween(line, "<", ">")
-
-            # Message should be after >
-            message = line.split("> ", 1)[1]
-
-            if self.cooldown(player):
-                # Get command
-                cmd, *args = message.split(' ')
-
-                if cmd in self.chatCommands:
-                    func = self.chatCommands[cmd]
-                    func(player, args)
-                
-                # Expressions
-                for expression, func in self.chatExpressions.items():
-                    if re.search(expression, message):
-                        func(player, message)
-
-        # Running a command.
-        # This only works on BUKKIT/PaperMC servers
-        # Notice for any below detections, player messages are expected not to work due to satisifying the if statement above
-        elif "issued server command" in line:
-            # Get user and the command.
-            player, command = line.split(" issued server command: ")
-
-            # User cannot contain spaces and will remove the [INFO] and stuff
-            player = player.split(" ")[-1]
-
-            cmd, *args = command.split(' ')
-
-            if self.cooldown(player) and cmd in self.serverCommands:
-                func = self.serverCommands[args[0]]
-                func(player, args)
-
-        # Named entity 
-        elif "Named entity" in line:
-            # Get XYZ, Entity, death reason, name of entity, UUID and what dimension
-
-            # Get Entity. It is after Named entity and before [
-            # Entity contains a Entity<entity> so remove it if it exists
-            entity = getBetween(line, "Named entity", "[").replace("Entity", "")
-
-            # Get the LIST object of the named entity
-            # First get NAMED ENTITY - [
-            # Then get ] before died
-            # Afterwards, split by ,
-            entityObj = line.split("Named entity", 1)[1].split("[", 1)[1] \
-                        .split("died")[0][:2] # The :2 removes the space and ] character at the end
-            
-            entityObj = entityObj.split(',')
+        if event is not None:
+            self.dispatch(*event, cooldown=cooldown)
 
-            # Get name. It should be in quotes
-            # Get values
-            for v in entityObj:
-                if v.startswith("uuid="):
-                    uuid = getBetween(v, "'", "'")
-                elif v.startswith("l="):
-                    level = getBetween(v, "'", "'")
-                elif v.startswith("x="):
-                    x = v.split("=")[1]
-                elif v.startswith("y="):
-                    y = v.split("=")[1]
-                elif v.startswith("z="):
-                    z = v.split("=")[1]
-
-            try:
-                coords = (float(x), float(y), float(z))
-            except NameError:
-                coords = None
+        # Run line for generic line events
+        for func in self.lineEvents:
+            self._call(func.__qualname__, func, line)
 
-            # Get death reason
-            deathReason = line.split("died: ", 1)[1]
+    def _call(self, name: str, func, *args):
+        # Old lines must not charge, save or load again
+        if getattr(self.replaying, 'active', False) and func not in self.idempotentHandlers:
+            return
 
-            # Turn into dict
-            values = {
-                "entity": entity,
-                "coords": coords,
-                "reason": deathReason,
-                "uuid": uuid,
-                "level": level
-            }
+        # A handler that must not run twice only runs once the position after its line is saved
+        if self.checkpoint is not None and self.lineEnd is not None and func not in self.idempotentHandlers:
+            self.checkpoint.save(self.lineEnd)
 
-            for func in self.entityDeaths:
-                func(values)
+        start = time.perf_counter()
+        try:
+            func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.STATS.record("handlers", name, elapsed)
+            if elapsed > self.STATS.SLOW_HANDLER:
+                print(f"Slow handler {name} took {elapsed:.3f}s with the arguments {args}")
+
+    def dispatch(self, eventType: str, values: dict, cooldown: bool = True):
+        """
+        Calls the handlers registered for an event returned by parse_line.
 
-        # Assuming vanilla mechanincs
-        elif " has made the advancement [":
-            text = line.split(': ', 1)[1]
+        @param cooldown: Whether player events are subject to the player cooldown
+        """
+        match eventType:
+            case "chat":
+                player, message = values["player"], values["message"]
+
+                if not cooldown or self.cooldown(player):
+                    # Get command
+                    cmd, *args = message.split(' ')
+
+                    if cmd in self.chatCommands and (not cooldown or cmd not in self.commandLimits
+                                                     or self.limiter.allow((cmd, player), *self.commandLimits[cmd])):
+                        func = self.chatCommands[cmd]
+                        self._call(cmd, func, player, args)
+                    
+                    # Expressions
+                    for expression, func in self.chatExpressions.items():
+                        if re.search(expression, message):
+                            self._call(f"expression {expression}", func, player, message)
+
+            case "command":
+                player, cmd, args = values["player"], values["command"], values["args"]
+
+                if (not cooldown or self.cooldown(player)) and cmd in self.serverCommands:
+                    func = self.serverCommands[cmd]
+                    self._call(cmd, func, player, args)
+
+            case "entity_death":
+                for func in self.entityDeaths:
+                    self._call(func.__qualname__, func, values)
+
+            case "advancement":
+                for func in self.advancementEvents:
+                    self._call(func.__qualname__, func, values["player"], values["advancement"])
+
+    def replay(self, index: 'LogIndex | None' = None, player: str | None = None, event: str | None = None):
+        """
+        Runs the idempotent handlers over the rotated logs (logs/*.log.gz), e.g. to rebuild stats after downtime.
+        Other handlers (and the preset commands, like .buy and .save) are skipped, since they would act on old lines again.
+        The player cooldown does not apply.
 
-            # Get the player and the advancement
-            player, advancement = text.split(' has made the advancement [', 1)
+        @param index: The index to use. A LogIndex of this server is built (or updated) if not given
+        @param player: Only replay the lines of this player
+        @param event: Only replay this event type (see parse_line)
+        """
+        if index is None:
+            index = LogIndex(self.DIRECTORY)
+            index.build()
 
-            # Trim advancement (has a ] at the end)
-            advancement = advancement[:-1].strip()
+        self.replaying.active = True
+        try:
+            for _, line in index.query(player, event):
+                self.run_line(line, cooldown=False)
+        finally:
+            self.replaying.active = False
 
-            for func in self.advancementEvents:
-                func(player.strip(), advancement)
+    def start(self, update: bool = True, checkpoint: str | None = ''):
+        """
+        Starts watching the log file forever.
 
-        # Run line for generic line events
-        for func in self.lineEvents:
-            func(line)
+        The position in latest.log is saved in logs/<checkpoint>.checkpoint.json, so a restart continues
+        where it stopped (including the end of a log that was rotated while stopped).
+        Idempotent handlers are run at least once: the position is saved in batches, so they can run again
+        for the last lines after a crash. Other handlers are run at most once: the position after their line
+        is saved before they run. Without a saved position, only new lines are handled.
 
-    def start(self):
-        lastMod = 0
-        seek = 0
+        @param update: Whether to check for a KMCE update in the background
+        @param checkpoint: The name of the saved position. Defaults to the script name, and None disables it
+        """
+        if update:
+            start_updater()
 
         try:
             self.RCON.connect()
             print("RCON connected.")
-        except ConnectionError:
-            print("Unable to connect to RCON. Commands will be disabled.")
+        except RCONError:
+            print("Unable to connect to RCON. Commands will fail until the server is reachable.")
         except AttributeError:
             print("No RCON is set up, so commands will not work.")
 
@@ -382,67 +1466,545 @@ class KMCE:
             print(f"The log file ({self.LOGFILE}) cannot be found and this program cannot further continue.")
             exit()
 
+        seek = 0
+        if checkpoint is not None:
+            name = checkpoint or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'kmce'
+            self.checkpoint = LogCheckpoint(os.path.join(os.path.dirname(self.LOGFILE), f"{name}.checkpoint.json"), self.LOGFILE)
+
+            resumed = self.checkpoint.resume()
+            if resumed is not None:
+                seek = resumed
+                print(f"Continuing from the saved position ({seek} bytes).")
+            elif self.checkpoint.saved is not None:
+                archive = self.checkpoint.find_archive()
+                if archive is not None:
+                    print(f"The log was rotated, handling the rest of {os.path.basename(archive)} first...")
+                    self._run_archive(archive, self.checkpoint.follow_archive())
+            else:
+                seek = os.stat(self.LOGFILE).st_size
+                print("No saved position, so only new lines will be handled.")
+
         print("Starting watcher...")
 
-        while True:
-            mod = os.stat(self.LOGFILE).st_size
+        inode = None
+        try:
+            while True:
+                try:
+                    stat = os.stat(self.LOGFILE)
+                except FileNotFoundError:
+                    time.sleep(0.1)
+                    continue
+
+                # In case the file is rotated or rewritten with less data
+                if inode is not None and (stat.st_ino != inode or stat.st_size < seek):
+                    seek = 0
+                inode = stat.st_ino
+
+                if stat.st_size > seek:
+                    # Seek to last pos
+                    with open(self.LOGFILE, 'rb') as f:
+                        if self.checkpoint is not None:
+                            self.checkpoint.track(f)
+                        f.seek(seek)
+                        data = f.read()
+
+                    # A line that is still being written is read next time
+                    data = data[:data.rfind(b'\n') + 1]
+
+                    for raw in data.splitlines(keepends=True):
+                        seek += len(raw)
+                        self.lineEnd = seek
+                        self.STATS.line_lag(raw)
+                        self.run_line(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+                    self.lineEnd = None
+
+                    # The log grows while the handlers run, so what is left is measured after them
+                    try:
+                        self.STATS.tail_lag(max(os.stat(self.LOGFILE).st_size - seek, 0))
+                    except FileNotFoundError:
+                        pass
+
+                    if self.checkpoint is not None:
+                        self.checkpoint.advance(seek)
+
+                time.sleep(0.1)
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.flush()
+
+    def _run_archive(self, path: str, offset: int):
+        """Handles the lines of a rotated log from an offset. The position is saved like in latest.log"""
+        import gzip
 
-            # In case file is rewritten with less data
-            if mod < lastMod:
-                seek = mod
+        try:
+            with gzip.open(path, 'rb') as f:
+                f.seek(offset)
+                for raw in f:
+                    offset += len(raw)
+                    self.lineEnd = offset
+                    self.STATS.line_lag(raw)
+                    self.run_line(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+                    if self.checkpoint is not None:
+                        self.checkpoint.advance(offset)
+        finally:
+            self.lineEnd = None
+            if self.checkpoint is not None:
+                self.checkpoint.flush()
+
+    def stats(self) -> dict:
+        """
+        Returns the collected statistics:
+        handlers: call count and latency histogram of each handler
+        parse: parse time histogram of each event type (sampled)
+        rcon: round-trip time histogram and error count
+        tail: how far the watcher is behind the end of the log, in bytes and seconds
+        """
+        return self.STATS.snapshot()
 
-            if mod != lastMod:
-                # Seek to last pos
-                with open(self.LOGFILE, 'rb') as f:
-                    f.seek(seek)
-                    data = f.read()
+    def serve_stats(self, port: int = 9225, host: str = '127.0.0.1'):
+        """Serves stats() as JSON on http://host:port/ from a background thread"""
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
-                seek += len(data)
-                lines = data.decode()
+        kmce = self
 
-                for line in lines.splitlines():
-                    self.run_line(line.rstrip('\n'))
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(kmce.stats()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
 
-                lastMod = mod
+            def log_message(self, *args):
+                pass
 
-            time.sleep(0.1)
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving stats on http://{host}:{server.server_port}/")
+        return server
 
-    def run(self, command: str) -> str:
+    def run(self, command: str, timeout: float | None = None) -> str:
         """
         Runs a command to the Minecraft server.
         Only works if RCON is enabled.
+        Safe to call from several handler threads at once.
 
         @param command: The command to run
+        @param timeout: Seconds to wait for the response. Defaults to the connection timeout
         """
 
-        return self.RCON.command(command)
+        start = time.perf_counter()
+        try:
+            return self.RCON.command(command, timeout)
+        except RCONError as e:
+            self.STATS.count("rcon", "errors")
+            print(f"Unable to run command ({command}): {e}")
+            return ''
+        finally:
+            self.STATS.record("rcon", "round_trip", time.perf_counter() - start)
+
+    def run_many(self, commands: list[str], timeout: float | None = None) -> list[str]:
+        """
+        Runs several commands to the Minecraft server on one RCON connection
+        (in one write if rcon_pipeline is enabled, one after another otherwise).
+        Only works if RCON is enabled.
 
-    def tellraw(self, player: str, components: dict) -> str:
+        @param commands: The commands to run, in order
+        @param timeout: Seconds to wait for the responses. Defaults to the connection timeout
+        """
+        if not commands:
+            return []
+
+        start = time.perf_counter()
+        try:
+            return self.RCON.commands(commands, timeout)
+        except RCONError as e:
+            self.STATS.count("rcon", "errors")
+            print(f"Unable to run {len(commands)} commands: {e}")
+            return [''] * len(commands)
+        finally:
+            self.STATS.record("rcon", "round_trip", time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Collects every tellraw sent by the current thread and sends them when the block exits.
+        Messages for the same player are joined into as few tellraws as fit in a RCON request, and all of them are sent with run_many.
+
+        Usage:
+        with kmce.batch():
+            kmce.tellraw(player, ...)
+        """
+        if getattr(self.batches, 'pending', None) is not None:
+            # Nested batches are flushed by the outermost one
+            yield
+            return
+
+        pending = self.batches.pending = {}
+        try:
+            yield
+        finally:
+            self.batches.pending = None
+            self.run_many([command for player, parts in pending.items() for command in split_tellraws(player, parts)])
+
+    def cached(self, name: str, key, build):
+        """
+        Returns the cached value of `name`, calling `build()` again only when `key` has changed.
+        Used to avoid re-rendering static content (help text, shop pages, etc.).
+        """
+        cached = self.renderCache.get(name)
+        if cached is None or cached[0] != key:
+            cached = self.renderCache[name] = (key, build())
+        return cached[1]
+
+    def tellraw(self, player: str, components: dict | list | str) -> str:
         """
         Runs the tellraw command to the Minecraft server.
         Only works if RCON is enabled.
+        Inside a batch(), the message is queued and an empty string is returned.
 
-        @param command: The command to run
+        @param player: The player (or selector) to send the message to
+        @param components: The text components, or an already rendered compact_JSON string
         """
-        return self.run(f"tellraw {player} {compact_JSON(components)}")
+        rendered = components if isinstance(components, str) else compact_JSON(components)
 
-    def get_scoreboard(self, player: str, objective: str) -> int:
-        """Function to obtain a scoreboard value of a player"""
+        pending = getattr(self.batches, 'pending', None)
+        if pending is not None:
+            pending.setdefault(player, []).append(rendered)
+            return ''
 
-        result = self.run(f"scoreboard players get {player} {objective}")
+        return self.run(f"tellraw {player} {rendered}")
+
+    def get_scoreboard(self, player: str, objective: str, max_age: float | None = None) -> int:
+        """
+        Function to obtain a scoreboard value of a player.
+        Values are cached for a short time (see Scoreboard), so reading several objectives of a player costs one command.
+
+        @param max_age: Seconds a cached value can be used for. Use 0 when the exact current value is needed
+        """
+        return self.SCOREBOARD.get(player, objective, max_age)
+
+    def set_scoreboard(self, player: str, objective: str, value: int) -> str:
+        """Sets a scoreboard value of a player"""
+        return self.SCOREBOARD.set(player, objective, value)
+
+    def add_scoreboard(self, player: str, objective: str, amount: int) -> str:
+        """Adds to a scoreboard value of a player"""
+        return self.SCOREBOARD.add(player, objective, amount)
+
+    def top_scoreboard(self, objective: str, n: int = 10) -> list[tuple[str, int]]:
+        """Returns the `n` players with the highest values of an objective, as (player, score) pairs"""
+        return self.SCOREBOARD.top(objective, n)
+
+_serverCache = {"address": None, "expires": 0}
+
+def get_server(ttl: float = 300) -> str:
+    """
+    Gets the server address of the KCash Account System.
+    The DNS lookup is cached for `ttl` seconds, and the last address is kept if a refresh fails.
+    """
+    if _serverCache["address"] is None or time.monotonic() >= _serverCache["expires"]:
+        import dns.resolver
+        try:
+            _serverCache["address"] = dns.resolver.resolve("kcmcserver.kcservers.ca", "TXT")[0].to_text()[1:-1]
+        except Exception:
+            if _serverCache["address"] is None:
+                raise
+        _serverCache["expires"] = time.monotonic() + ttl
+    return _serverCache["address"]
+
+class AccountClient:
+    """
+    Client for the KCash Account System.
+
+    Requests share one keep-alive HTTP session. Balances are cached for a short time
+    (and forgotten as soon as the account is changed), and identical reads that run at the
+    same time are merged into one request.
+    """
+
+    def __init__(self, timeout: float = 5, balance_ttl: float = 5, connections: int = 8):
+        """
+        @param timeout: Seconds to wait for the account server
+        @param balance_ttl: Seconds a fetched balance is reused for
+        @param connections: Maximum amount of kept-alive connections
+        """
+        import requests
+
+        self.TIMEOUT = timeout
+        self.BALANCE_TTL = balance_ttl
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.balances = {}      # player -> (expires, balance)
+        self.generations = {}   # player -> times the cached balance was invalidated
+        self.inflight = {}      # request -> Future of a read that is running
+        self.lock = threading.Lock()
+
+        # Resolve the server once now instead of on the first command
+        get_server()
+
+    def request(self, arg: str) -> dict:
+        """
+        Runs a command on the account server.
+        Errors are returned as an unsuccessful response instead of being raised.
+        """
+        import requests
 
-        if "Can't get value of" in result: 
-            return 0
-        
         try:
-            return int(re.search(r'\d+', result.replace(player,"")).group())
-        except:
-            return 0
+            r = self.session.get(f"http://{get_server()}/cmd/{arg}", timeout=self.TIMEOUT)
+            return r.json()
+        except (requests.RequestException, ValueError) as e:
+            return {"success": False, "reason": str(e)}
+
+    def read(self, arg: str) -> dict:
+        """Runs a read-only command, sharing the response with identical reads that are already running"""
+        from concurrent.futures import Future
 
-def get_server():
-    """Gets the server address of the KCash Account System"""
-    import dns.resolver
-    return dns.resolver.resolve("kcmcserver.kcservers.ca", "TXT")[0].to_text()[1:-1]
+        with self.lock:
+            future = self.inflight.get(arg)
+            leader = future is None
+            if leader:
+                future = self.inflight[arg] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = self.request(arg)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[arg]
+
+    def balance(self, player: str) -> int | None:
+        """Returns the global balance of a player, or None if the account server could not be reached"""
+        now = time.monotonic()
+        with self.lock:
+            cached = self.balances.get(player)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+            generation = self.generations.get(player, 0)
+
+        r = self.read(f"READ bal FOR {player}")
+        if not r.get("success"):
+            # Not cached, so the balance is read again as soon as the server is back
+            return None
+        bal = int(r.get("output", 0))
+
+        with self.lock:
+            # Do not cache a value read before the account was changed
+            if self.generations.get(player, 0) == generation:
+                self.balances[player] = (now + self.BALANCE_TTL, bal)
+        return bal
+
+    def invalidate(self, player: str):
+        """Forgets the cached balance of a player"""
+        with self.lock:
+            self.balances.pop(player, None)
+            self.generations[player] = self.generations.get(player, 0) + 1
+
+    def add(self, amount: int, player: str) -> dict:
+        """Adds (or removes, if negative) KCash to the global account of a player"""
+        try:
+            return self.request(f"ADD {amount} FOR {player}")
+        finally:
+            self.invalidate(player)
+
+    def transfer(self, player: str) -> dict:
+        """Empties the global account of a player, returning the amount in the output"""
+        try:
+            return self.request(f"TRANSFER FOR {player}")
+        finally:
+            self.invalidate(player)
+
+    async def request_async(self, arg: str) -> dict:
+        import asyncio
+        return await asyncio.to_thread(self.request, arg)
+
+    async def balance_async(self, player: str) -> int | None:
+        import asyncio
+        return await asyncio.to_thread(self.balance, player)
+
+    async def add_async(self, amount: int, player: str) -> dict:
+        import asyncio
+        return await asyncio.to_thread(self.add, amount, player)
+
+    async def transfer_async(self, player: str) -> dict:
+        import asyncio
+        return await asyncio.to_thread(self.transfer, player)
+
+    def close(self):
+        self.session.close()
+
+class ShopCatalog:
+    """
+    The items of a shop.yml file, kept in memory.
+
+    The file is reloaded when it is changed on disk (by its mtime, size and inode).
+    Stock changes are serialized through a lock and appended to a journal file right away,
+    while the full file is rewritten later (write-behind) with an atomic replace.
+    """
+
+    def __init__(self, path: str = 'shop.yml', flush_delay: float = 1):
+        """
+        @param path: The location of the shop file
+        @param flush_delay: Seconds to wait after a stock change before rewriting the shop file
+        """
+        self.PATH = path
+        self.JOURNAL = path + '.journal'
+        self.FLUSH_DELAY = flush_delay
+
+        self.items = {}
+        self.order = []
+        self.deltas = {}    # Stock changes that are not in the shop file yet
+        self.stat = None
+        self.version = 0
+        self.timer = None
+        self.lock = threading.RLock()
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _identity(stat: os.stat_result) -> tuple[int, int, int]:
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _refresh(self):
+        """Reloads the file if it was changed by something else"""
+        try:
+            stat = self._identity(os.stat(self.PATH))
+        except FileNotFoundError:
+            stat = None
+
+        if stat == self.stat:
+            return
+
+        if stat is None:
+            items = {}
+        else:
+            import yaml
+            with open(self.PATH, 'r') as f:
+                items = yaml.safe_load(f) or {}
+
+            # Journal entries made against this exact file were not written into it yet (e.g. after a crash)
+            if os.path.exists(self.JOURNAL):
+                with open(self.JOURNAL, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if tuple(entry['base']) == stat:
+                            self.deltas[entry['item']] = self.deltas.get(entry['item'], 0) + entry['stock']
+
+        # Pending changes are kept on top of an externally edited file
+        for itemID, delta in self.deltas.items():
+            if itemID in items:
+                items[itemID]['Stock'] += delta
+
+        self.items = items
+        self.order = list(items)
+        self.stat = stat
+        self.version += 1
+
+    def exists(self) -> bool:
+        return os.path.exists(self.PATH)
+
+    def get_version(self) -> int:
+        """A number that changes whenever the items change, for caching rendered pages"""
+        with self.lock:
+            self._refresh()
+            return self.version
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._refresh()
+            return len(self.order)
+
+    def get(self, itemID: str) -> dict | None:
+        """Returns a copy of the item, or None if it does not exist"""
+        with self.lock:
+            self._refresh()
+            item = self.items.get(itemID)
+            return None if item is None else dict(item)
+
+    def page(self, page: int, per_page: int) -> list[tuple[str, dict]]:
+        """Returns the (ID, item) pairs of a page, starting at page 1"""
+        with self.lock:
+            self._refresh()
+            start = (page - 1) * per_page
+            return [(itemID, dict(self.items[itemID])) for itemID in self.order[start:start + per_page]]
+
+    def take(self, itemID: str, amount: int = 1) -> bool:
+        """
+        Removes stock from an item if there is enough of it.
+        Returns False if the item does not exist or there is not enough stock.
+        """
+        with self.lock:
+            self._refresh()
+            item = self.items.get(itemID)
+            if item is None or item['Stock'] < amount:
+                return False
+            self._change(itemID, -amount)
+            return True
+
+    def restock(self, itemID: str, amount: int = 1):
+        """Adds stock back to an item (e.g. when a purchase fails)"""
+        with self.lock:
+            self._refresh()
+            if itemID in self.items:
+                self._change(itemID, amount)
+
+    def _change(self, itemID: str, delta: int):
+        self.items[itemID]['Stock'] += delta
+        self.deltas[itemID] = self.deltas.get(itemID, 0) + delta
+        self.version += 1
+
+        with open(self.JOURNAL, 'a') as f:
+            f.write(json.dumps({"base": self.stat, "item": itemID, "stock": delta}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self.timer is None:
+            self.timer = threading.Timer(self.FLUSH_DELAY, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Writes pending stock changes into the shop file"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if not self.deltas:
+                return
+
+            self._refresh()
+
+            import yaml
+
+            temp = self.PATH + '.tmp'
+            with open(temp, 'w') as f:
+                yaml.safe_dump(self.items, f, sort_keys=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.PATH)
+
+            # The journal only applies to the old file, so it can go
+            self.stat = self._identity(os.stat(self.PATH))
+            self.deltas.clear()
+            try:
+                os.remove(self.JOURNAL)
+            except FileNotFoundError:
+                pass
 
 class KCKMCE(KMCE):
     """
@@ -453,34 +2015,41 @@ class KCKMCE(KMCE):
 
     def __init__(self, directory: str = ''):
         super().__init__(directory)
+        self.SHOP = ShopCatalog('shop.yml')
         self.setup_preset_cmds()
 
     def setup_preset_cmds(self):
-        # Get KCMC server
-        server = get_server()
-
-        def request(arg: str) -> dict:
-            return requests.get(f"http://{server}/cmd/{arg}").json()
+        # Connect to the KCMC server
+        if getattr(self, 'ACCOUNTS', None) is None:
+            self.ACCOUNTS = AccountClient()
+        accounts = self.ACCOUNTS
 
         # Basic .help
         def func(player: str, args: tuple[str]):
             """Shows a list of commands available on this server"""
-            for cmd, func in self.chatCommands.items():
-                if cmd.startswith('.'):
-                    self.tellraw(player, [
-                        {"text": f"{cmd}: {func.__doc__}", "color": "light_purple"},
-                    ])
+            # Rendered again only when the registered commands change
+            commands = tuple(self.chatCommands.items())
+            lines = self.cached('help', commands, lambda: [
+                compact_JSON({"text": f"{cmd}: {func.__doc__}", "color": "light_purple"})
+                for cmd, func in commands if cmd.startswith('.')
+            ])
+
+            # Sent in as few tellraws as fit in a RCON request
+            with self.batch():
+                for line in lines:
+                    self.tellraw(player, line)
 
         self.chatCommands['.help'] = func
 
         # Basic .kcash or .bal viewer
         def func(player: str, args: tuple[str]):
             """Shows the views"""
-            bal = request(f"READ bal FOR {player}").get("output", 0)
+            bal = accounts.balance(player)
 
             self.tellraw(player, [
                 {"text": "\nYour KCash Balance:\nLocally (on this server): ", "color": "light_purple"}, {"score": {"name": player, "objective": "kcash"}, "color": "green"},
-                {"text": f"\nGlobally (on your account): ", "color": "light_purple"}, {"text": f"{bal}\n", "color": "green"},
+                {"text": f"\nGlobally (on your account): ", "color": "light_purple"},
+                {"text": f"{bal}\n", "color": "green"} if bal is not None else {"text": "unavailable right now\n", "color": "red"},
                 {"text": "Make sure to regularly .save!\n", "color": "gray", "italic": True}
             ])
 
@@ -489,10 +2058,10 @@ class KCKMCE(KMCE):
         # Basic .save 
         def func(player: str, args: tuple[str]):
             """Adds the current local KCash to the global KCash account"""
-            bal = self.get_scoreboard(player, "kcash")
-            r = request(f"ADD {bal} FOR {player}")
+            bal = self.get_scoreboard(player, "kcash", max_age=0)
+            r = accounts.add(bal, player)
             if r.get('success'):
-                self.run(f"scoreboard players set {player} kcash 0")
+                self.set_scoreboard(player, "kcash", 0)
                 self.tellraw(player, [
                     {"text": f"\nSuccessfully uploaded {bal} KCash to your global account!\n", "color": "green"}
                 ])
@@ -506,9 +2075,9 @@ class KCKMCE(KMCE):
         # Basic .load 
         def func(player: str, args: tuple[str]):
             """Transfers the global KCash into local"""
-            r = request(f"TRANSFER FOR {player}")
+            r = accounts.transfer(player)
             if r.get('success'):
-                self.run(f"scoreboard players add {player} kcash {r.get('output')}")
+                self.add_scoreboard(player, "kcash", int(r.get('output', 0)))
                 self.tellraw(player, [
                     {"text": f"\nSuccessfully loaded {r.get('output')} KCash to your local account!\n", "color": "green"}
                 ])
@@ -523,7 +2092,7 @@ class KCKMCE(KMCE):
         # Shop system 
         def func(player: str, args: tuple[str]):
             """Shows the list of items that can be purchased"""
-            bal = request(f"READ bal FOR {player}").get("output", 0)
+            bal = accounts.balance(player)
 
             # Get page number
             if len(args) > 0 and args[0].isdigit():
@@ -531,53 +2100,55 @@ class KCKMCE(KMCE):
             else:
                 page = 1
 
-            # Setup for loop
             ITEMS_PER_PAGE = 5
-            startI = (page - 1) * ITEMS_PER_PAGE
-            endI = startI + ITEMS_PER_PAGE
 
             # Check if it exists. If it doesn't, tell the player
-            if os.path.exists('shop.yml'):
-                with open('shop.yml', 'r') as f:
-                    items: dict = yaml.safe_load(f)
-            else:
+            if not self.SHOP.exists():
                 self.tellraw(player, {"text": "\nThere is no shop set up on this server!\n", "color": "red"})
-
-            # Send KCash shop heading
-            self.tellraw(player, {"text": "========= KCash Shop =========", "color": "light_purple"})
-            
-            itemKeys = list(items)
-            for i in range(startI, endI):
-                # See if it exists. Otherwise, break the for loop
-                try:
-                    itemID = itemKeys[i]
-                except IndexError:
-                    break
-
-                item = items[itemID]
-
+                return
+
+            def build() -> list[str]:
+                rows = []
+                for itemID, item in self.SHOP.page(page, ITEMS_PER_PAGE):
+                    rows.append(compact_JSON([
+                        {"text": item['Name'], "color": "aqua" if item['Stock'] > 0 else "red",
+                            "click_event":{"action":"suggest_command","command":f".buy {itemID}"},
+                            "hover_event":{"action":"show_text","value":[{"text": item['Description'], "color": "gray"},{"text":f"\nID: {itemID}\nCost: {item['Cost']} | Stock: {item['Stock']}", "color": "aqua"}]}
+                        },
+                        {"text": ": ", "color": "green"},
+                        {"text": f"{item['Cost']} KCash", "color": "yellow", 
+                            "click_event":{"action":"suggest_command","command":f".buy {itemID}"}, 
+                            "hover_event":{"action":"show_text","value":[{"text": "Click here to buy!", "color": "yellow"}]}
+                        }
+                    ]))
+
+                return rows
+
+            # Pages past the end show the last one, so there is one cache entry per existing page
+            pages = max(1, -(-len(self.SHOP) // ITEMS_PER_PAGE))
+            page = min(max(page, 1), pages)
+
+            # The item rows are only rendered again when the shop changes
+            rows = self.cached(f'shop {page}', self.SHOP.get_version(), build)
+
+            # Everything is sent in as few tellraws as fit in a RCON request
+            with self.batch():
+                # Send KCash shop heading
+                self.tellraw(player, {"text": "========= KCash Shop =========", "color": "light_purple"})
+
+                for row in rows:
+                    self.tellraw(player, row)
+
+                # Send ending message and page 
                 self.tellraw(player, [
-                    {"text": item['Name'], "color": "aqua" if item['Stock'] > 0 else "red",
-                        "click_event":{"action":"suggest_command","command":f".buy {itemID}"},
-                        "hover_event":{"action":"show_text","value":[{"text": item['Description'], "color": "gray"},{"text":f"\nID: {itemID}\nCost: {item['Cost']} | Stock: {item['Stock']}", "color": "aqua"}]}
-                    },
-                    {"text": ": ", "color": "green"},
-                    {"text": f"{item['Cost']} KCash", "color": "yellow", 
-                        "click_event":{"action":"suggest_command","command":f".buy {itemID}"}, 
-                        "hover_event":{"action":"show_text","value":[{"text": "Click here to buy!", "color": "yellow"}]}
-                    }
+                    {"text": f"You currently have {bal} KCash.\n", "color": "green"} if bal is not None else {"text": "Your balance is unavailable right now.\n", "color": "red"},
+                    {"text": "======", "color": "light_purple"},
+                    {"text": " << "} | ({"color": "yellow", "click_event":{"action":"suggest_command","command":f".shop {page - 1}"}} if page > 1 else {"color": "gray"}),
+                    {"text": f"Pg. {page} out of {pages}", "color": "light_purple"},
+                    {"text": " >> "} | ({"color": "yellow", "click_event":{"action":"suggest_command","command":f".shop {page + 1}"}} if page < pages else {"color": "gray"}),
+                    {"text": "======", "color": "light_purple"}
                 ])
 
-            # Send ending message and page 
-            self.tellraw(player, [
-                {"text": f"You currently have {bal} KCash.\n", "color": "green"},
-                {"text": "======", "color": "light_purple"},
-                {"text": " << "} | ({"color": "yellow", "click_event":{"action":"suggest_command","command":f".shop {page - 1}"}} if page > 1 else {"color": "gray"}),
-                {"text": f"Pg. {page} out of {len(items) // ITEMS_PER_PAGE + 1}", "color": "light_purple"},
-                {"text": " >> "} | ({"color": "yellow", "click_event":{"action":"suggest_command","command":f".shop {page + 1}"}} if page < len(items) // ITEMS_PER_PAGE + 1 else {"color": "gray"}),
-                {"text": "======", "color": "light_purple"}
-            ])
-
         self.chatCommands['.shop'] = func
 
         # Buy item 
@@ -586,55 +2157,161 @@ class KCKMCE(KMCE):
 
             if len(args) == 0:
                 self.tellraw(player, {"text": "\nNo Item ID specified!\n", "color": "red"})
+                return
 
-            bal = int(request(f"READ bal FOR {player}").get("output", 0))
             itemID = args[0]
 
             # Check if it exists. If it doesn't, tell the player
-            if os.path.exists('shop.yml'):
-                with open('shop.yml', 'r') as f:
-                    items: dict = yaml.safe_load(f)
-            else:
+            if not self.SHOP.exists():
                 self.tellraw(player, {"text": "\nThere is no shop set up on this server!\n", "color": "red"})
+                return
 
-            if itemID in items:
-                item = items[itemID]
-                # Check stock
-                if item['Stock'] <= 0:
-                    self.tellraw(player, {"text": f"\n{item['Name']} has ran out of stock!\n", "color": "red"})
+            item = self.SHOP.get(itemID)
+            if item is None:
+                self.tellraw(player, {"text": f"\n{itemID} does not exist!\n", "color": "red"})
+                return
 
-                # Check cost
-                elif bal < item['Cost']:
-                    self.tellraw(player, {"text": f"\nYou do not have enough KCash to purchase this item!\nYou need {item['Cost'] - bal} more KCash to buy this item!\n", "color": "red"})
+            bal = accounts.balance(player)
+
+            # Check stock
+            if item['Stock'] <= 0:
+                self.tellraw(player, {"text": f"\n{item['Name']} has ran out of stock!\n", "color": "red"})
+
+            elif bal is None:
+                self.tellraw(player, {"text": "\nYour balance is unavailable right now, so nothing was bought. Try again later!\n", "color": "red"})
+
+            # Check cost
+            elif bal < item['Cost']:
+                self.tellraw(player, {"text": f"\nYou do not have enough KCash to purchase this item!\nYou need {item['Cost'] - bal} more KCash to buy this item!\n", "color": "red"})
+
+            # Reserve the stock before paying, so concurrent buyers cannot both get the last one
+            elif not self.SHOP.take(itemID):
+                self.tellraw(player, {"text": f"\n{item['Name']} has ran out of stock!\n", "color": "red"})
 
-                else:
-                    r = request(f"ADD -{item['Cost']} FOR {player}")
-                    if r.get('success'):
-                        # Run command
-                        self.run(f"execute as {player} at @s run " + item['Command'])
-
-                        # Remove 1 from stock, and save it
-                        item['Stock'] -= 1
-                        with open('shop.yml', 'w') as f:
-                            yaml.safe_dump(items, f)
-
-                        self.tellraw(player, {"text": f"\nSuccessfully bought {item['Name']} for {item['Cost']} KCash!\n", "color": "green"})
-
-                    else:
-                        self.tellraw(player, [
-                            {"text": f"\nThere was an error when making the purchase: {r.get('reason')}!\n", "color": "red"}
-                        ])
             else:
-                self.tellraw(player, {"text": f"\n{itemID} does not exist!\n", "color": "red"})
+                r = accounts.add(-item['Cost'], player)
+                if r.get('success'):
+                    # Run command
+                    self.run(f"execute as {player} at @s run " + item['Command'])
+
+                    self.tellraw(player, {"text": f"\nSuccessfully bought {item['Name']} for {item['Cost']} KCash!\n", "color": "green"})
+
+                else:
+                    # Give the reserved stock back
+                    self.SHOP.restock(itemID)
+
+                    self.tellraw(player, [
+                        {"text": f"\nThere was an error when making the purchase: {r.get('reason')}!\n", "color": "red"}
+                    ])
         
         self.chatCommands['.buy'] = func
 
 
 
+class _NotifyingLock:
+    """
+    Wraps a bot's lock so a callback runs every time the lock is released.
+    The callback runs while the lock is still held.
+    """
+
+    def __init__(self, lock, callback):
+        self.lock = lock
+        self.callback = callback
+
+    def acquire(self, *args, **kwargs) -> bool:
+        return self.lock.acquire(*args, **kwargs)
+
+    def release(self):
+        try:
+            self.callback()
+        finally:
+            self.lock.release()
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class BotChannel:
+    """
+    Matches the responses of a bot to the commands it chatted.
+
+    The bot sets `bot.output` while holding `bot.lock`. The lock is wrapped so that each output
+    is taken (and cleared) as soon as the bot releases it, and given to the oldest command still
+    waiting for one. Several commands can be in flight at once, and waiting uses no CPU.
+
+    A command that timed out keeps its place for another timeout, so its late response is dropped
+    instead of being given to the command after it.
+    """
+
+    def __init__(self, bot, timeout: float = 5):
+        """
+        @param bot: An object with chat(), lock and output attributes
+        @param timeout: Seconds to wait for a response
+        """
+        self.BOT = bot
+        self.TIMEOUT = timeout
+
+        self.pending = collections.deque()  # Futures of the commands waiting for a response, oldest first
+        self.abandoned = {}                 # Future of a command that timed out -> when its late response is no longer expected
+        self.sendLock = threading.Lock()
+
+        bot.output = None
+        bot.lock = _NotifyingLock(bot.lock, self._on_release)
+
+    def _on_release(self):
+        output = self.BOT.output
+        if output is None:
+            return
+        self.BOT.output = None
+
+        # If nothing is waiting, the output is a late response and is dropped
+        while self.pending:
+            future = self.pending.popleft()
+            if future.set_running_or_notify_cancel():
+                future.set_result(output)
+                return
+
+            # A command that timed out. The output is its late response, unless that stopped being expected
+            if time.monotonic() < self.abandoned.pop(future, 0):
+                return
+
+    def send(self, command: str) -> 'Future':
+        """Chats a command and returns a Future of its response"""
+        from concurrent.futures import Future
+
+        future = Future()
+        with self.sendLock:
+            with self.BOT.lock:
+                self.pending.append(future)
+            self.BOT.chat(command)
+        return future
+
+    def wait(self, future: 'Future', timeout: float | None = None) -> str:
+        """Waits for a response. Returns an empty string if it does not come in time"""
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+
+        try:
+            return future.result(timeout or self.TIMEOUT)
+        except FutureTimeoutError:
+            # Cancelled while holding the bot's lock, so no output can be matched in between
+            with self.BOT.lock:
+                cancelled = future.cancel()
+                if cancelled:
+                    self.abandoned[future] = time.monotonic() + self.TIMEOUT
+
+            # The response may have come in right after the timeout
+            if not cancelled:
+                return future.result()
+            return ''
+
 class BotKMCE(KCKMCE):
     def __init__(self, bot):
         super().__init__('')
         self.BOT = bot
+        self.CHANNEL = BotChannel(bot)
         self.setup_preset_cmds()
 
         def func(player: str, args: tuple[str]):
@@ -647,23 +2324,19 @@ class BotKMCE(KCKMCE):
 
 
 
-    def run(self, command: str) -> str:
+    def run(self, command: str, timeout: float | None = None) -> str:
         """
         Runs a command to the Minecraft server.
 
         @param command: The command to run
+        @param timeout: Seconds to wait for the response. An empty string is returned after it
         """
-        print(command)
-        bot = self.BOT
-        
-        bot.chat(command)
-        while True:
-            with bot.lock:
-                if bot.output is not None:
-                    print("Command", bot.output)
-                    return bot.output
-            # small non-blocking sleep to yield CPU
-            time.sleep(0.001)
+        return self.CHANNEL.wait(self.CHANNEL.send(command), timeout)
 
-
-updater()
\ No newline at end of file
+    def run_many(self, commands: list[str], timeout: float | None = None) -> list[str]:
+        """
+        Runs several commands through the bot.
+        All of them are chatted before waiting, and the responses are matched in order.
+        """
+        futures = [self.CHANNEL.send(command) for command in commands]
+        return [self.CHANNEL.wait(future, timeout) for future in futures]
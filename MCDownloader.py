@@ -0,0 +1,694 @@
+"""
+Shared download engine for ServerSetupScript.py and OptimizationsDownloader.py
+
+Metadata lookups and downloads run in a bounded thread pool over one keep-alive session,
+with retries (exponential backoff) and per-file progress.
+Files are streamed into <name>.part (resumed with HTTP Range after a failure), hashed while they download
+and only renamed into place once they match the expected hashes.
+Downloaded jars are kept in a content-addressed cache (MCTOOLS_CACHE, ~/.cache/mctools by default)
+and linked into each server, so the same jar is only downloaded once.
+Mods are resolved with Modrinth's bulk endpoints (including required dependencies) and pinned in mods.lock.json,
+so later runs need no metadata requests. Other metadata is cached for a while, revalidated with ETag/Last-Modified
+and used from the cache when the server cannot be reached, so provisioning works offline after one run. update_mods replaces outdated jars in place, all at once or not at all.
+Set MCTOOLS_MODRINTH_API / MCTOOLS_FABRIC_META to use another server instead (e.g. a local stub)
+"""
+
+import os, time, random, threading, hashlib, shutil, contextlib, json
+from concurrent.futures import ThreadPoolExecutor
+import requests, urllib3
+from requests.adapters import HTTPAdapter
+
+MODRINTH_API = os.environ.get("MCTOOLS_MODRINTH_API", "https://api.modrinth.com").rstrip("/")
+FABRIC_META = os.environ.get("MCTOOLS_FABRIC_META", "https://meta.fabricmc.net").rstrip("/")
+USER_AGENT = "Kevcore25/MCTools"
+LOCKFILE = "mods.lock.json"
+HASH_CACHE = ".hashes.json" # In the mods directory. Fabric only loads .jar files
+CACHE_DIR = os.environ.get("MCTOOLS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mctools"))
+
+# Read sizes grow while reads are fast and shrink while they are slow
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+
+# Hashes computed while downloading. Modrinth publishes both
+HASHES = ("sha1", "sha512")
+
+# Status codes that are worth trying again
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+class DownloadError(Exception):
+    """Raised when a request still fails after all retries"""
+
+class _Retry(Exception):
+    """A failure that may work on the next attempt"""
+    def __init__(self, message, wait=None):
+        super().__init__(message)
+        self.wait = wait
+
+def file_hash(path: str, algorithm: str = "sha512") -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while chunk := f.read(MIN_CHUNK * 16):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _fsync_dir(path: str):
+    """Makes a rename in the directory of path durable. Not possible (or needed) on Windows"""
+    if os.name == "nt": return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _reflink(source: str, dest: str) -> bool:
+    """Copy-on-write clone (btrfs, XFS). Returns False where it is not supported"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    FICLONE = 0x40049409
+    try:
+        with open(source, "rb") as src, open(dest, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        with contextlib.suppress(OSError): os.remove(dest)
+        return False
+
+def read_lock(path: str = LOCKFILE) -> dict | None:
+    """Returns the lockfile written by Downloader.download_mods or None if there is none"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def write_lock(lock: dict, path: str = LOCKFILE):
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(lock, f, indent=4)
+    os.replace(temp, path)
+
+def _save_hashes(directory: str, hashes: dict[str, str]):
+    """Remembers the sha512 of jars in directory together with their size and modification time"""
+    cache = {}
+    for name, sha512 in hashes.items():
+        with contextlib.suppress(FileNotFoundError):
+            stat = os.stat(os.path.join(directory, name))
+            cache[name] = [stat.st_size, stat.st_mtime_ns, sha512]
+
+    path = os.path.join(directory, HASH_CACHE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(path + ".tmp", path)
+
+class ArtifactCache:
+    """
+    Content-addressed jar cache. Files are stored as <root>/sha512/<2 chars>/<rest of the hash>.
+    The modification time of <file>.used is when the file was last used, and the least recently used files are removed
+    above maxSize. The file itself is not touched, as it can be hardlinked into the mods folders of servers.
+
+    @param root: Cache directory
+    @param maxSize: Max size of the cache in bytes
+    """
+    def __init__(self, root: str = CACHE_DIR, maxSize: int = 2 * 1024 ** 3):
+        self.ROOT = root
+        self.MAX_SIZE = maxSize
+        self.lock = threading.Lock()
+
+    def path(self, sha512: str) -> str:
+        sha512 = sha512.lower()
+        return os.path.join(self.ROOT, "sha512", sha512[:2], sha512[2:])
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.ROOT, "url", hashlib.sha256(url.encode()).hexdigest())
+
+    @staticmethod
+    def _mark_used(path: str):
+        try:
+            os.utime(path + ".used")
+        except FileNotFoundError:
+            with open(path + ".used", "a"): pass
+
+    def get(self, sha512: str) -> str | None:
+        """Returns the cached file for a hash (and marks it as used) or None"""
+        path = self.path(sha512)
+        if not os.path.exists(path):
+            return None
+        with contextlib.suppress(FileNotFoundError): self._mark_used(path)
+        return path
+
+    def get_url(self, url: str) -> str | None:
+        """Returns the sha512 of the file last downloaded from an immutable url or None"""
+        try:
+            with open(self._url_path(url), "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def put(self, source: str, sha512: str | None = None, url: str | None = None, verified: bool = False) -> str:
+        """
+        Adds a file to the cache and returns its sha512
+
+        @param sha512: Expected hash. Raises ValueError if the file does not match it
+        @param url: Remember that url (which must never change) has this file
+        @param verified: sha512 is already known to be the hash of the file, so it is not read again
+        """
+        actual = sha512.lower() if verified and sha512 else file_hash(source)
+        if sha512 is not None and actual != sha512.lower():
+            raise ValueError(f"{os.path.basename(source)} does not match its sha512")
+
+        path = self.path(actual)
+        if self.get(actual) is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Another thread may add the same file, so each one writes its own temporary file
+            temp = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                os.link(source, temp)
+            except OSError:
+                shutil.copyfile(source, temp)
+            os.replace(temp, path)
+            self._mark_used(path)
+            self.evict()
+
+        if url is not None:
+            os.makedirs(os.path.join(self.ROOT, "url"), exist_ok=True)
+            temp = f"{self._url_path(url)}.{threading.get_ident()}.tmp"
+            with open(temp, "w") as f:
+                f.write(actual)
+            os.replace(temp, self._url_path(url))
+        return actual
+
+    def link(self, sha512: str, dest: str) -> bool:
+        """
+        Places a cached file at dest without copying the data if possible (reflink, then hardlink, then copy).
+        Returns False if the hash is not cached.
+        """
+        path = self.get(sha512)
+        if path is None:
+            return False
+
+        temp = f"{dest}.{threading.get_ident()}.tmp"
+        with contextlib.suppress(FileNotFoundError): os.remove(temp)
+        if not _reflink(path, temp):
+            try:
+                os.link(path, temp)
+            except OSError:
+                shutil.copyfile(path, temp)
+        os.replace(temp, dest)
+        return True
+
+    def evict(self):
+        """Removes the least recently used files until the cache is under maxSize"""
+        with self.lock:
+            files = []
+            for directory, _, names in os.walk(os.path.join(self.ROOT, "sha512")):
+                names = set(names)
+                for name in names:
+                    if name.endswith(".tmp"): continue
+                    path = os.path.join(directory, name)
+                    if name.endswith(".used"):
+                        # The file was removed without its time
+                        if name[:-5] not in names:
+                            with contextlib.suppress(FileNotFoundError): os.remove(path)
+                        continue
+
+                    with contextlib.suppress(FileNotFoundError):
+                        stat = os.stat(path)
+                        # Files cached before the times were kept separately use their own time
+                        try:
+                            used = os.stat(path + ".used").st_mtime
+                        except FileNotFoundError:
+                            used = stat.st_mtime
+                        files.append((used, stat.st_size, path))
+
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.MAX_SIZE: break
+                with contextlib.suppress(FileNotFoundError): os.remove(path)
+                with contextlib.suppress(FileNotFoundError): os.remove(path + ".used")
+                total -= size
+
+class Downloader:
+    """
+    @param workers: Max tasks (lookups and downloads) running at once
+    @param connections: Max HTTP connections open at once, over all threads
+    @param retries: Attempts after the first one fails
+    @param backoff: Seconds before the first retry. Doubles every retry
+    @param timeout: Connect and read timeout in seconds
+    @param progress: Print the progress of each file while it downloads
+    @param verbose: Print every file that was downloaded
+    @param cache: ArtifactCache to reuse downloaded files (and metadata) from. True uses the default cache and None disables it
+    @param metaTTL: Seconds cached metadata is used without asking the server if it changed
+    """
+    def __init__(self, workers: int = 8, connections: int = 8, retries: int = 4, backoff: float = 1, timeout: float = 30, progress: bool = True, verbose: bool = True, cache: ArtifactCache | bool | None = True, metaTTL: float = 3600):
+        self.WORKERS = workers
+        self.RETRIES = retries
+        self.BACKOFF = backoff
+        self.TIMEOUT = timeout
+        self.PROGRESS = progress
+        self.VERBOSE = verbose
+        self.META_TTL = metaTTL
+        self.cache = ArtifactCache() if cache is True else cache or None
+
+        self.connections = threading.BoundedSemaphore(connections)
+        self.pool = None
+        self.poolLock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=connections)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, func, *args, **kwargs):
+        """Runs func in the download pool and returns a Future"""
+        with self.poolLock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(self.WORKERS, thread_name_prefix="MCDownloader")
+        return self.pool.submit(func, *args, **kwargs)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.session.close()
+
+    def _retry(self, func, what: str, retries: int | None = None):
+        """Calls func until it succeeds, waiting longer after every failed attempt"""
+        retries = self.RETRIES if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                return func()
+            except (_Retry, requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError, ConnectionError) as e:
+                if attempt == retries:
+                    raise DownloadError(f"{what}: {e}") from e
+
+                wait = getattr(e, "wait", None)
+                if wait is None: wait = self.BACKOFF * 2 ** attempt * (1 + random.random() / 2)
+                print(f"{what} failed ({e}). Retrying in {wait:.1f}s")
+                time.sleep(wait)
+            except requests.RequestException as e:
+                raise DownloadError(f"{what}: {e}") from e
+
+    def _check(self, r: requests.Response):
+        if r.status_code in RETRY_STATUS:
+            # Retry-After may also be a date, which is treated as not given
+            wait = r.headers.get("Retry-After", "")
+            raise _Retry(f"HTTP {r.status_code}", float(wait) if wait.isdigit() else None)
+        r.raise_for_status()
+
+    def get_json(self, url: str, **params):
+        """GETs a JSON document"""
+        def get():
+            with self.connections:
+                r = self.session.get(url, params=params or None, timeout=self.TIMEOUT)
+                self._check(r)
+                return r.json()
+        return self._retry(get, url)
+
+    def get_meta(self, url: str, ttl: float | None = None, **params):
+        """
+        GETs a JSON document through the metadata cache.
+        A copy younger than ttl is used without a request. An older one is revalidated (304 Not Modified costs no body),
+        and it is used as it is if the server cannot be reached.
+
+        @param ttl: Defaults to metaTTL
+        """
+        if self.cache is None:
+            return self.get_json(url, **params)
+
+        ttl = self.META_TTL if ttl is None else ttl
+        url = requests.Request("GET", url, params=params or None).prepare().url
+        path = os.path.join(self.cache.ROOT, "meta", hashlib.sha256(url.encode()).hexdigest() + ".json")
+        try:
+            with open(path, "r") as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            snapshot = None
+
+        if snapshot is not None and time.time() - snapshot["fetched"] < ttl:
+            return snapshot["data"]
+
+        headers = {}
+        if snapshot is not None:
+            if snapshot["etag"]: headers["If-None-Match"] = snapshot["etag"]
+            if snapshot["last_modified"]: headers["If-Modified-Since"] = snapshot["last_modified"]
+
+        def get():
+            with self.connections:
+                r = self.session.get(url, headers=headers, timeout=self.TIMEOUT)
+                if r.status_code == 304: return r, snapshot["data"]
+                self._check(r)
+                return r, r.json()
+
+        try:
+            # There is no point in waiting for retries when there is a copy to fall back to
+            r, data = self._retry(get, url, 0 if snapshot is not None else None)
+        except DownloadError as e:
+            if snapshot is None: raise
+            print(f"Using the cached copy of {url} ({e})")
+            return snapshot["data"]
+
+        snapshot = {
+            "url": url,
+            "etag": r.headers.get("ETag") or (snapshot or {}).get("etag"),
+            "last_modified": r.headers.get("Last-Modified") or (snapshot or {}).get("last_modified"),
+            "fetched": time.time(),
+            "data": data
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(temp, path)
+        return data
+
+    def post_json(self, url: str, data):
+        """POSTs a JSON document and returns the JSON response"""
+        def post():
+            with self.connections:
+                r = self.session.post(url, json=data, timeout=self.TIMEOUT)
+                self._check(r)
+                return r.json()
+        return self._retry(post, url)
+
+    def _print_progress(self, name: str, done: int, total: int | None):
+        if total:
+            print(f"{name}: {done / total:.0%} ({done / 1e6:.1f}/{total / 1e6:.1f} MB)")
+        else:
+            print(f"{name}: {done / 1e6:.1f} MB")
+
+    def fetch(self, url: str, path: str, size: int | None = None, hashes: dict | None = None, immutable: bool = False) -> str:
+        """
+        Downloads url to path and returns path. The file is linked from the cache instead if it is there
+
+        @param size: Expected size in bytes, if known. Used for progress before the server sends Content-Length
+        @param hashes: Modrinth style hashes ({"sha512": ...}) of the file
+        @param immutable: The file at url never changes, so it can be cached without knowing its hash
+        """
+        name = os.path.basename(path)
+        part = path + ".part"
+        expected = {algorithm: value.lower() for algorithm, value in (hashes or {}).items() if algorithm in HASHES}
+
+        if self.cache is not None:
+            sha512 = expected.get("sha512")
+            if sha512 is None and immutable:
+                sha512 = self.cache.get_url(url)
+            if sha512 is not None and self.cache.link(sha512, path):
+                return path
+
+        def get():
+            digests = {algorithm: hashlib.new(algorithm) for algorithm in HASHES}
+
+            # Continue a previous attempt. Its data has to be hashed again because hash states cannot be saved
+            done = 0
+            if os.path.exists(part):
+                with open(part, "rb") as f:
+                    while data := f.read(MAX_CHUNK):
+                        for digest in digests.values(): digest.update(data)
+                        done += len(data)
+
+            # Compressed bodies cannot be resumed by byte offset, and jars are already compressed
+            headers = {"Accept-Encoding": "identity"}
+            if done: headers["Range"] = f"bytes={done}-"
+
+            with self.connections, self.session.get(url, headers=headers, stream=True, timeout=self.TIMEOUT) as r:
+                if r.status_code == 416:
+                    # The .part file is not a prefix of the file (it is longer), so start again
+                    os.remove(part)
+                    raise _Retry("Partial download does not match the file")
+                self._check(r)
+
+                if r.status_code != 206 or not r.headers.get("Content-Range", "").startswith(f"bytes {done}-"):
+                    # The server sent the whole file
+                    done = 0
+                    digests = {algorithm: hashlib.new(algorithm) for algorithm in HASHES}
+                length = int(r.headers.get("Content-Length", 0))
+                total = done + length if length else size
+
+                chunk = MIN_CHUNK
+                lastPrint = time.monotonic()
+                with open(part, "ab" if done else "wb") as f:
+                    while True:
+                        start = time.monotonic()
+                        data = r.raw.read(chunk, decode_content=True)
+                        if not data: break
+                        f.write(data)
+                        for digest in digests.values(): digest.update(data)
+                        done += len(data)
+
+                        elapsed = time.monotonic() - start
+                        if elapsed < 0.05 and chunk < MAX_CHUNK: chunk *= 2
+                        elif elapsed > 0.5 and chunk > MIN_CHUNK: chunk //= 2
+
+                        if self.PROGRESS and start - lastPrint >= 1:
+                            self._print_progress(name, done, total)
+                            lastPrint = start
+
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                if total and done < total:
+                    raise _Retry(f"Connection closed after {done} of {total} bytes")
+
+            actual = {algorithm: digest.hexdigest() for algorithm, digest in digests.items()}
+            for algorithm, value in expected.items():
+                if actual[algorithm] != value:
+                    os.remove(part)
+                    raise _Retry(f"{algorithm} mismatch (expected {value[:16]}..., got {actual[algorithm][:16]}...)")
+
+            os.replace(part, path)
+            _fsync_dir(path)
+
+            if self.cache is not None and (expected or immutable):
+                self.cache.put(path, actual["sha512"], url if immutable else None, verified=True)
+            return path
+
+        return self._retry(get, name)
+
+    def _versions(self, projectID: str, version: str, loader: str) -> list[dict]:
+        """Versions of a Modrinth project for version and loader, newest first"""
+        return self.get_meta(f"{MODRINTH_API}/v2/project/{projectID}/version", loaders=json.dumps([loader]), game_versions=json.dumps([version]))
+
+    def resolve_mods(self, projectIDs: list[str], version: str, loader: str = "fabric") -> dict:
+        """
+        Finds the newest version of each Modrinth project, and of every project they require, for version and loader.
+        Costs one request for the projects, then per round of dependencies one filtered request per project (in parallel)
+        and one request for all versions pinned by dependencies.
+        Returns the lockfile data
+        """
+        projects = self.get_meta(f"{MODRINTH_API}/v2/projects", ids=json.dumps(projectIDs))
+        byName = {p["slug"]: p for p in projects} | {p["id"]: p for p in projects}
+        names = {p["id"]: p["slug"] for p in projects}
+
+        missing = []
+        queue = [] # (project ID, pinned version ID, required by)
+        for projectID in projectIDs:
+            if projectID in byName:
+                queue.append((byName[projectID]["id"], None, None))
+            else:
+                missing.append(projectID)
+                print(f"Failed to locate {projectID} on Modrinth")
+
+        mods = {} # project ID: (version, required by)
+        seen = {projectID for projectID, _, _ in queue}
+        while queue:
+            futures = {projectID: self.submit(self._versions, projectID, version, loader) for projectID, versionID, _ in queue if versionID is None}
+            pinned = [versionID for _, versionID, _ in queue if versionID is not None]
+            found = {v["id"]: v for v in self.get_meta(f"{MODRINTH_API}/v2/versions", ids=json.dumps(pinned))} if pinned else {}
+
+            required = []
+            for projectID, versionID, requiredBy in queue:
+                if versionID is None:
+                    v = next(iter(futures[projectID].result()), None)
+                else:
+                    v = found.get(versionID)
+
+                if v is None:
+                    missing.append(names.get(projectID, projectID or versionID))
+                    print(f"Failed to locate a version for {missing[-1]}")
+                    continue
+                if v["project_id"] in mods: continue
+                mods[v["project_id"]] = (v, requiredBy)
+
+                for dependency in v.get("dependencies", []):
+                    dependsOn = dependency.get("project_id")
+                    if dependency["dependency_type"] != "required" or dependsOn in seen: continue
+                    if dependsOn is None and dependency.get("version_id") is None: continue
+                    if dependsOn is not None: seen.add(dependsOn)
+                    required.append((dependsOn, dependency.get("version_id"), v["project_id"]))
+            queue = required
+
+        # Names of the dependencies
+        unknown = [projectID for projectID in mods if projectID not in names]
+        if unknown:
+            names |= {p["id"]: p["slug"] for p in self.get_meta(f"{MODRINTH_API}/v2/projects", ids=json.dumps(unknown))}
+
+        lock = {"game_version": version, "loader": loader, "requested": sorted(projectIDs), "missing": missing, "mods": []}
+        for projectID, (v, requiredBy) in mods.items():
+            file = next((f for f in v["files"] if f.get("primary")), v["files"][0])
+            lock["mods"].append({
+                "project": names.get(projectID, projectID),
+                "project_id": projectID,
+                "version_id": v["id"],
+                "version": v["version_number"],
+                "filename": file["filename"],
+                "url": file["url"],
+                "size": file.get("size"),
+                "hashes": {algorithm: file["hashes"][algorithm] for algorithm in HASHES if algorithm in file.get("hashes", {})},
+                "required_by": names.get(requiredBy, requiredBy)
+            })
+        return lock
+
+    def install_mod(self, mod: dict, directory: str = "mods") -> str | None:
+        """Downloads a lockfile entry to directory and returns the path of the jar"""
+        try:
+            path = self.fetch(mod["url"], os.path.join(directory, mod["filename"]), mod.get("size"), mod.get("hashes"))
+        except DownloadError as e:
+            print(f"Failed to download {mod['project']}: {e}")
+            return None
+
+        # One write, so lines from several threads do not run into each other
+        if self.VERBOSE: print(f"Downloaded {mod['project']}\n", end="")
+        return path
+
+    def download_mods(self, projectIDs: list[str], version: str, directory: str = "mods", loader: str = "fabric", lockfile: str = LOCKFILE) -> dict[str, str | None]:
+        """
+        Downloads several Modrinth projects (and their required dependencies) at once.
+        The lockfile is used instead of the Modrinth API if it was made for the same projects, version and loader.
+        Returns {project: path or None if it failed}
+        """
+        lock = read_lock(lockfile)
+        if lock is None or (lock.get("game_version"), lock.get("loader"), lock.get("requested")) != (version, loader, sorted(projectIDs)):
+            lock = self.resolve_mods(projectIDs, version, loader)
+            write_lock(lock, lockfile)
+        elif self.VERBOSE:
+            for projectID in lock["missing"]:
+                print(f"Failed to locate a version for {projectID} (from {lockfile})")
+
+        os.makedirs(directory, exist_ok=True)
+        futures = {mod["project"]: self.submit(self.install_mod, mod, directory) for mod in lock["mods"]}
+        return {project: future.result() for project, future in futures.items()}
+
+    def hash_jars(self, directory: str = "mods") -> dict[str, str]:
+        """
+        Returns {filename: sha512} of the jars in directory.
+        Jars are hashed in parallel, and not again while their size and modification time stay the same
+        """
+        try:
+            with open(os.path.join(directory, HASH_CACHE), "r") as f:
+                cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            cache = {}
+
+        hashes = {}
+        futures = {}
+        for entry in os.scandir(directory):
+            if not entry.is_file() or not entry.name.endswith(".jar"): continue
+            stat = entry.stat()
+            cached = cache.get(entry.name)
+            if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+                hashes[entry.name] = cached[2]
+            else:
+                futures[entry.name] = self.submit(file_hash, entry.path)
+
+        hashes |= {name: future.result() for name, future in futures.items()}
+        if futures or len(hashes) != len(cache):
+            _save_hashes(directory, hashes)
+        return hashes
+
+    def update_mods(self, projectIDs: list[str], version: str, directory: str = "mods", loader: str = "fabric", lockfile: str = LOCKFILE) -> bool:
+        """
+        Updates directory to the newest versions of several Modrinth projects (and their required dependencies).
+        Installed jars are identified by hash with one /v2/version_files request. Only missing jars are downloaded,
+        and old versions of the projects (or of projects in the previous lockfile) are removed.
+        Everything is downloaded before anything is changed, and the changes are rolled back if one of them fails.
+        Returns False if directory was left as it was
+        """
+        staging = directory.rstrip("/\\") + ".update"
+        backup = directory.rstrip("/\\") + ".rollback"
+        os.makedirs(directory, exist_ok=True)
+
+        # An update that was interrupted is undone first
+        if os.path.isdir(backup):
+            for name in os.listdir(backup):
+                if not os.path.exists(os.path.join(directory, name)):
+                    os.replace(os.path.join(backup, name), os.path.join(directory, name))
+            shutil.rmtree(backup)
+
+        hashes = self.hash_jars(directory)
+        previous = read_lock(lockfile) or {}
+        try:
+            installed = self.post_json(f"{MODRINTH_API}/v2/version_files", {"hashes": sorted(set(hashes.values())), "algorithm": "sha512"}) if hashes else {}
+            lock = self.resolve_mods(projectIDs, version, loader)
+        except DownloadError as e:
+            print(f"Unable to reach Modrinth ({e}). No mods were changed")
+            return False
+
+        wanted = {mod["hashes"]["sha512"]: mod for mod in lock["mods"]}
+        managed = {mod["project_id"] for mod in lock["mods"] + previous.get("mods", [])}
+
+        keep = {} # sha512: filename
+        remove = []
+        for name, sha512 in sorted(hashes.items()):
+            if sha512 in wanted and sha512 not in keep:
+                keep[sha512] = name
+            elif sha512 in wanted or installed.get(sha512, {}).get("project_id") in managed:
+                # Another version of a managed project or a second copy
+                remove.append(name)
+        download = [mod for sha512, mod in wanted.items() if sha512 not in keep]
+
+        # Jars that are not managed but have the name of a new one are kept in the backup too
+        remove += [mod["filename"] for mod in download if mod["filename"] in hashes and mod["filename"] not in remove]
+
+        print(f"{len(keep)} mods are up to date, {len(download)} to download and {len(remove)} to remove")
+        if download or remove:
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            try:
+                futures = [self.submit(self.install_mod, mod, staging) for mod in download]
+                if not all([future.result() for future in futures]):
+                    print("Update failed. No mods were changed")
+                    return False
+
+                os.makedirs(backup)
+                moved, placed = [], []
+                try:
+                    for name in remove:
+                        os.replace(os.path.join(directory, name), os.path.join(backup, name))
+                        moved.append(name)
+                    for mod in download:
+                        os.replace(os.path.join(staging, mod["filename"]), os.path.join(directory, mod["filename"]))
+                        placed.append(mod["filename"])
+                except OSError as e:
+                    try:
+                        for name in placed:
+                            os.remove(os.path.join(directory, name))
+                        for name in moved:
+                            os.replace(os.path.join(backup, name), os.path.join(directory, name))
+                    except OSError as restoreError:
+                        # The backup is restored by the next update
+                        print(f"Update failed ({e}) and could not be rolled back ({restoreError}). The old mods are in {backup}")
+                        return False
+                    shutil.rmtree(backup, ignore_errors=True)
+                    print(f"Update failed ({e}). Rolled back")
+                    return False
+                # Only removed once the update is done, so the old mods cannot be lost
+                shutil.rmtree(backup, ignore_errors=True)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+            _fsync_dir(os.path.join(directory, HASH_CACHE))
+
+        # The new jars are already hashed
+        _save_hashes(directory, {name: sha512 for name, sha512 in hashes.items() if name not in remove} | {mod["filename"]: mod["hashes"]["sha512"] for mod in download})
+        write_lock(lock, lockfile)
+        return True
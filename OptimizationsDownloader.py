@@ -2,41 +2,29 @@
 Optimization mods downloader for Fabric MC
 
 This is a file that takes a part of the serversetup.py file to only download optimization mods
+Run it with --update to replace outdated mods instead of adding new files next to them.
+The Minecraft version of the last run is used then, so it can run before each server start
 """
 
-import requests, os
+import sys
+import MCDownloader
 
-# Get all the minecraft versions and ask the user which Minecraft version to downloiad
-versionsapi = requests.get(f"https://meta.fabricmc.net/v2/versions/game").json()
+downloader = MCDownloader.Downloader()
 
-# Convert list into dictionary
-versions = []
-for version in versionsapi:
-    versions.append(version['version'])
+update = "--update" in sys.argv
+lock = MCDownloader.read_lock() if update else None
 
-while True:
-    version = input("Minecraft version: ")
-    if version in versions: break
-    else:
-        print("Try again! Not a valid version!")
-
-def downloadMod(projectID: str):
-    versions = requests.get(f"https://api.modrinth.com/v2/project/{projectID}/version").json()
-    for v in versions:
-        if version in v["game_versions"] and "fabric" in v["loaders"]:
-            downloadLink = v["files"][0]
-            with requests.get(downloadLink["url"], stream=True) as r:
-                with open(os.path.join("mods", downloadLink["filename"]), 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192): 
-                        f.write(chunk)
-            return print(f"Downloaded {projectID}")
-    else:
-        return print(f"Failed to locate a version for {projectID}")
+if lock is not None:
+    version = lock["game_version"]
+else:
+    # Get all the minecraft versions (cached) and ask the user which Minecraft version to downloiad
+    versions = {version['version'] for version in downloader.get_meta(f"{MCDownloader.FABRIC_META}/v2/versions/game")}
 
-
-# Get mods 
-if "mods" not in os.listdir():
-    os.mkdir("mods")
+    while True:
+        version = input("Minecraft version: ")
+        if version in versions: break
+        else:
+            print("Try again! Not a valid version!")
 
 # Download optimization mods
 MODS = [
@@ -53,7 +41,11 @@ MODS = [
     "servercore", # Some optimizations like PaperMC mainly for SMPs
 ]
 
-for mod in MODS:
-    downloadMod(mod)
+# All mods are looked up and downloaded at the same time
+with downloader:
+    if update:
+        downloader.update_mods(MODS, version, "mods")
+    else:
+        downloader.download_mods(MODS, version, "mods")
 
 print("Files are downloaded!")
\ No newline at end of file
@@ -2,20 +2,192 @@
 Script to create a Minecraft fabric server with ease!
 
 It automatically accepts the EULA, so you must agree to the EULA (https://www.minecraft.net/en-us/eula) before using it.
+
+Run it with --batch <spec.yaml|spec.json> to create many servers at once without any questions. Example spec:
+defaults:
+  version: 1.21.1
+  ram: 2G
+servers:
+  - directory: lobby
+    port: 25565
+    motd: Lobby
+  - directory: survival
+    port: 25567
+    online_mode: false
+    mods: [lithium, fabric-api]
+Every server needs a directory and a version. The port defaults to 25565
 """
 
-import os
-import requests
+import os, sys, time, json
+import MCDownloader, JVMFlags
 from threading import Thread
 from hashlib import sha256
+from functools import cache
+from concurrent.futures import ThreadPoolExecutor
+
+# Download optimization mods
+MODS = [
+    "lithium", # General-purpose optimization mod that minimally affects the vanilla experience
+    "fabric-api", # Library for mods
+    "krypton", # Network optimizations
+    "ferrite-core", # Memory optimizations
+    "noisium", # World generation optimizations
+    "c2me-fabric", # Chunk performance improvements
+    "scalablelux", # Light optimizations
+    "vmp-fabric", # Improvements for higher player counts
+    "alternate-current", # Redstone optimizations
+    "threadtweak", # Reworks scheduling, which COULD be invasive and can be disabled for a more vanilla experience.
+    "servercore", # Some optimizations like PaperMC mainly for SMPs. Can be disabled for a more vanilla experience.
+]
+
+batch = len(sys.argv) > 2 and sys.argv[1] == "--batch"
+
+# Progress is not printed because the configuration questions are asked during the download
+downloader = MCDownloader.Downloader(progress=False, verbose=not batch)
+
+
+def downloadServer(version, directory="."):
+    # Get the fabric loader and installer (both are cached)
+    loader = downloader.get_meta(f"{MCDownloader.FABRIC_META}/v2/versions/loader/{version}")[0]["loader"]["version"]
+    installerVer = downloader.get_meta(f"{MCDownloader.FABRIC_META}/v2/versions/installer")[0]["version"]
+
+    downloader.fetch(f"{MCDownloader.FABRIC_META}/v2/versions/loader/{version}/{loader}/{installerVer}/server/jar", os.path.join(directory, "fabric.jar"), immutable=True)
+    if not batch: print("Downloaded fabric.jar")
+
+def download():
+    # The server jar is downloaded while the mods are
+    server = downloader.submit(downloadServer, version)
+
+    with downloader:
+        downloader.download_mods(MODS, version, "mods")
+        server.result()
+
+    print("Files are downloaded!")
+
+START_FILE = "start.bat" if os.name == 'nt' else "start.sh"
+
+def writeEula(directory="."):
+    if "eula.txt" not in os.listdir(directory):
+        with open(os.path.join(directory, "eula.txt"), "x") as f:
+            f.write("eula=true")
 
-# Get all the minecraft versions and ask the user which Minecraft version to downloiad
-versionsapi = requests.get(f"https://meta.fabricmc.net/v2/versions/game").json()
+def writeProperties(directory, port, motd, onlineMode):
+    with open(os.path.join(directory, "server.properties"), "x") as f:
+        f.write(f"""#Minecraft server properties
+allow-flight=true
+motd={motd}
+online-mode={onlineMode}
+rcon.password={sha256(bytes(str(id(port) * id(motd)), 'utf-8')).hexdigest()}
+rcon.port={port + 1}
+server-port={port}
+enable-rcon=true
+enforce-secure-profile=false""")
 
-# Convert list into dictionary
-versions = []
-for version in versionsapi:
-    versions.append(version['version'])
+# The hardware is only detected once (it runs java -version)
+detectHardware = cache(JVMFlags.detect)
+
+def writeStart(directory, ram=None):
+    """Writes the start file with JVM flags chosen for this machine. ram is chosen automatically if None"""
+    with open(os.path.join(directory, START_FILE), "x") as f:
+        f.write(JVMFlags.start_command(ram, hardware=detectHardware()))
+
+def writeConfig(directory, port, motd, onlineMode, ram):
+    """Writes eula.txt, server.properties and the start file if they do not exist yet"""
+    files = os.listdir(directory)
+    writeEula(directory)
+    if "server.properties" not in files: writeProperties(directory, port, motd, onlineMode)
+    if START_FILE not in files: writeStart(directory, ram)
+
+def provision(server):
+    """Creates one server of a batch spec and returns how long each part took"""
+    directory = server["directory"]
+    os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    writeConfig(directory, server["port"], server.get("motd", "A Minecraft Server"), str(server.get("online_mode", True)).lower(), server.get("ram", "2G"))
+    configured = time.perf_counter()
+
+    jar = downloader.submit(downloadServer, server["version"], directory)
+    mods = downloader.download_mods(server.get("mods", MODS), server["version"], os.path.join(directory, "mods"), lockfile=os.path.join(directory, MCDownloader.LOCKFILE))
+    jar.result()
+
+    failed = [mod for mod, path in mods.items() if path is None]
+    return {
+        "config": configured - start,
+        "download": time.perf_counter() - configured,
+        "mods": len(mods) - len(failed),
+        "failed": failed + MCDownloader.read_lock(os.path.join(directory, MCDownloader.LOCKFILE))["missing"]
+    }
+
+def provisionBatch(specPath):
+    """Creates every server in a YAML or JSON spec at the same time and prints a report"""
+    with open(specPath, "r") as f:
+        if specPath.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                return print("PyYAML is required for YAML specs (pip install pyyaml). Use a JSON spec instead")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    defaults = spec.get("defaults", {})
+    servers = [{"port": 25565} | defaults | server for server in spec["servers"]]
+    for i, server in enumerate(servers, 1):
+        missing = [key for key in ("directory", "version") if key not in server]
+        if missing:
+            return print(f"Server #{i} in {specPath} has no {' or '.join(missing)}")
+
+    # Every server uses its port and the next one (RCON)
+    used = {}
+    for server in servers:
+        for port in (server["port"], server["port"] + 1):
+            if port in used:
+                return print(f"Port {port} of {server['directory']} is already used by {used[port]}")
+            used[port] = server["directory"]
+
+    start = time.perf_counter()
+    results = {}
+    with downloader, ThreadPoolExecutor(8) as pool:
+        # Servers with the same version and mods share one resolution (written to each lockfile)
+        groups = {}
+        for server in servers:
+            groups.setdefault((server["version"], tuple(server.get("mods", MODS))), []).append(server)
+
+        locks = {key: pool.submit(downloader.resolve_mods, list(key[1]), key[0]) for key in groups}
+        for key, group in groups.items():
+            lock = locks[key].result()
+            for server in group:
+                os.makedirs(server["directory"], exist_ok=True)
+                MCDownloader.write_lock(lock, os.path.join(server["directory"], MCDownloader.LOCKFILE))
+
+        # The first server of each group downloads the files. The others only link them from the cache
+        for wave in ([group[0] for group in groups.values()], [server for group in groups.values() for server in group[1:]]):
+            futures = {server["directory"]: pool.submit(provision, server) for server in wave}
+            for directory, future in futures.items():
+                try:
+                    results[directory] = future.result()
+                except Exception as e:
+                    results[directory] = {"error": str(e)}
+    total = time.perf_counter() - start
+
+    print(f"{'Server':<24}{'Config':>8}{'Download':>10}{'Mods':>6}  Status")
+    for server in servers:
+        result = results[server["directory"]]
+        if "error" in result:
+            print(f"{server['directory']:<24}{'':>8}{'':>10}{'':>6}  Failed: {result['error']}")
+        else:
+            status = f"Missing: {', '.join(result['failed'])}" if result["failed"] else "OK"
+            print(f"{server['directory']:<24}{result['config']:>7.2f}s{result['download']:>9.2f}s{result['mods']:>6}  {status}")
+    print(f"Created {sum('error' not in result for result in results.values())}/{len(servers)} servers in {total:.2f}s")
+
+
+if batch:
+    provisionBatch(sys.argv[2])
+    sys.exit()
+
+# Get all the minecraft versions (cached) and ask the user which Minecraft version to downloiad
+versions = {version['version'] for version in downloader.get_meta(f"{MCDownloader.FABRIC_META}/v2/versions/game")}
 
 while True:
     version = input("Minecraft version: ")
@@ -23,82 +195,20 @@ while True:
     else:
         print("Try again! Not a valid version!")
 
-
-def downloadMod(projectID: str):
-    versions = requests.get(f"https://api.modrinth.com/v2/project/{projectID}/version").json()
-    for v in versions:
-        if version in v["game_versions"] and "fabric" in v["loaders"]:
-            downloadLink = v["files"][0]
-            with requests.get(downloadLink["url"], stream=True) as r:
-                with open(os.path.join("mods", downloadLink["filename"]), 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192): 
-                        f.write(chunk)
-            return
-
-def download():
-    # Get the fabric loader 
-    loaders = requests.get(f"https://meta.fabricmc.net//v2/versions/loader/{version}").json()
-    loader = loaders[0]["loader"]["version"]
-
-    # Get installer loader
-    installerVer = requests.get("https://meta.fabricmc.net/v2/versions/installer").json()[0]["version"]
-
-    with requests.get(f"https://meta.fabricmc.net/v2/versions/loader/{version}/{loader}/{installerVer}/server/jar", stream=True) as r:
-        with open("fabric.jar", 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192): 
-                f.write(chunk)
-
-    # Get mods 
-    if "mods" not in os.listdir():
-        os.mkdir("mods")
-
-    # Download optimization mods
-    MODS = [
-        "lithium", # General-purpose optimization mod that minimally affects the vanilla experience 
-        "fabric-api", # Library for mods
-        "krypton", # Network optimizations
-        "ferrite-core", # Memory optimizations
-        "noisium", # World generation optimizations
-        "c2me-fabric", # Chunk performance improvements
-        "scalablelux", # Light optimizations
-        "vmp-fabric", # Improvements for higher player counts
-        "alternate-current", # Redstone optimizations
-        "threadtweak", # Reworks scheduling, which COULD be invasive and can be disabled for a more vanilla experience.
-        "servercore", # Some optimizations like PaperMC mainly for SMPs. Can be disabled for a more vanilla experience.
-    ]
-
-    for mod in MODS:
-        downloadMod(mod)
-
-    print("Files are downloaded!")
-
 # Start the downloads in a new thread so the config can continue
 Thread(target = download).start()
 print("Server files are now being downloaded... Asking for configuration if required now.")
 
-if "eula.txt" not in os.listdir():
-    with open("eula.txt", "x") as f:
-        f.write("eula=true")
+writeEula()
 
 if "server.properties" not in os.listdir():
     port = int(input("Server port: "))
     motd = input("MOTD: ")
+    writeProperties(".", port, motd, input("Online mode? (true or false): "))
 
-    with open("server.properties", "x") as f:
-        f.write(f"""#Minecraft server properties
-allow-flight=true
-motd={motd}
-online-mode={input("Online mode? (true or false): ")}
-rcon.password={sha256(bytes(str(id(port) * id(motd)), 'utf-8')).hexdigest()}
-rcon.port={port + 1}
-server-port={port}
-enable-rcon=true
-enforce-secure-profile=false""")
+if START_FILE not in os.listdir():
+    writeStart(".", input("Amount of RAM (e.g. 1024M or 1G, empty to choose automatically): ") or None)
 
-if "start.sh" not in os.listdir():
-    ram = input("Amount of RAM (e.g. 1024M or 1G): ")
-    with open("start.bat" if os.name == 'nt' else "start.sh", "x") as f:
-        f.write(f"java -Xmx{ram} -Xms{ram} -server -jar fabric.jar nogui")
-        
 
 print("Configuration options are set! Run the start file to start the server!")
+print("Run AppCDS.py once the downloads are done to make the server start faster")
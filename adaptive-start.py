@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-VERSION = '2.1.1'
+VERSION = '2.1.4'
 
 """
 Minecraft Adaptive Server Starter (MASS)!
@@ -21,6 +21,9 @@ Version updates:
 2.1:
 - Adds IP listing - whitelist/blacklist options
 - Fixed no response not working + default * blacklist (2.11)
+- ram_required is set from the -Xmx of the start command, and JVMFlags.py is used for the start command if it is there (2.12)
+- Outdated AppCDS archives (made by AppCDS.py) are removed before the server starts (2.13)
+- World pre-generation over RCON while the server is awake but empty (2.14)
 
 2.0:
 - Improved killing process: now has RCON and PID killing systems and better auto stop stability
@@ -41,12 +44,19 @@ import fnmatch
 import os
 import json
 import logging
+import math
+import re
 import requests
 import struct
 import time
 from pathlib import Path
 import psutil
 
+try:
+    import AppCDS # From MCTools, if it is next to this file
+except ImportError:
+    AppCDS = None
+
 
 log = logging.getLogger("ServerStarter")
 
@@ -57,6 +67,8 @@ VERIFIED_IPS_FILE = "verified_ips.json"
 STARTUP_TIMES_FILE = "startup_times.json"
 MAX_STORED_TIMES = 5
 
+PREGEN_FILE = "pregen.json"
+
 """
 DEFAULT CONFIG
 
@@ -77,6 +89,7 @@ DEFAULT_CONFIG = {
 
     # Amount of RAM/SWAP required (in GB) to start the program - if it is too low then the server won't start
     # If set to None/null/0 then this is ignored
+    # AutoConfig sets it to the -Xmx of the start command plus JVM overhead (see jvm_memory_required)
     "ram_required": 4.5,
     "swap_required": None,
     # Message to kick if no memory
@@ -136,7 +149,24 @@ DEFAULT_CONFIG = {
     # However, if the user already exists in usercache.json or in whitelist.json then VPNs and Proxies are allowed
     # It also allows any IP in the whitelist
     # Note: This uses an external API fetch.
-    "ip_listing_smartmode": True
+    "ip_listing_smartmode": True,
+
+    ## World pre-generation (needs RCON)
+    # While the server is awake but empty, chunks within pregen_radius blocks of pregen_center are generated
+    # before the auto-stop countdown starts. It pauses when a player joins and continues when the server is empty again.
+    # If set to None/null/0 then this is disabled
+    "pregen_radius": None,
+    "pregen_center": [0, 0],
+    "pregen_world": "minecraft:overworld",
+    # "chunky" uses the Chunky mod. "forceload" works on vanilla servers but is slower
+    "pregen_method": "chunky",
+    # Chunks forceloaded at a time (at most 256)
+    "pregen_batch": 64,
+    # Generation waits while the average tick time (/tick query, 1.20.3+) is above this
+    "pregen_max_mspt": 40,
+    # Pre-generation stops until the next start after this many polls in a row without progress
+    # (RCON or Chunky not answering, or the server staying above pregen_max_mspt). The countdown runs meanwhile
+    "pregen_max_stalls": 10
 }
 
 
@@ -193,6 +223,15 @@ def updater(config: dict[str, list[str]]):
     else:
         log.info("The updater did not update the file")
 
+def jvm_memory_required(command: str) -> float | None:
+    """RAM (GB) a java command needs: its -Xmx heap plus metaspace, threads and GC overhead.
+    Same rule as memory_required in JVMFlags.py, so both agree on what a heap costs"""
+    match = re.search(r"-Xmx(\d+)([kKmMgG]?)", command)
+    if match is None:
+        return None
+    heap = int(match.group(1)) / {"": 1024 ** 3, "k": 1024 ** 2, "m": 1024, "g": 1}[match.group(2).lower()]
+    return round(heap + max(0.5, heap * 0.125), 2)
+
 def create_config(config_path: str = CONFIG_FILENAME):
     config = DEFAULT_CONFIG.copy()
 
@@ -220,6 +259,22 @@ def create_config(config_path: str = CONFIG_FILENAME):
     # bash start.sh
     if Path("start.sh").exists():
         config["start_command"] = "bash start.sh"
+        with open("start.sh", 'r') as f:
+            command = f.read()
+    else:
+        # Flags chosen for this machine if JVMFlags.py (from MCTools) is next to this file
+        try:
+            import JVMFlags
+            config["start_command"] = JVMFlags.start_command(jar="server.jar")
+            log.info("The start command is generated by JVMFlags (run python JVMFlags.py --explain to see why)")
+        except ImportError:
+            pass
+        command = config["start_command"]
+
+    ram = jvm_memory_required(command)
+    if ram is not None:
+        config["ram_required"] = ram
+        log.info(f"ram_required is set to {ram} GB from the heap of the start command")
 
 
     with open(config_path, "w") as f:
@@ -484,6 +539,172 @@ def find_pid_by_port(port: int) -> int | None:
             return conn.pid
     return None
 
+class Pregenerator:
+    """Generates the world around pregen_center over RCON. Progress is kept in pregen.json"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.path = Path(config["server_dir"]) / PREGEN_FILE
+        self.running = False
+        self._tiles = None
+        self._reported = -1
+        # Polls in a row without progress, and why the last one made none
+        self.stalls = 0
+        self.stalled = None
+
+        # Changing the area starts again
+        self.key = f"{config['pregen_method']}:{config['pregen_world']}:{config['pregen_center']}:{config['pregen_radius']}"
+        # batch is the forceloaded square, kept so it is removed even if the server stopped while it was loaded
+        self.state = {"key": self.key, "index": 0, "percent": 0.0, "started": False, "done": False, "batch": None}
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+                if state.get("key") == self.key:
+                    self.state = state
+            except json.JSONDecodeError:
+                pass
+
+    @property
+    def done(self) -> bool:
+        return self.state["done"]
+
+    @property
+    def active(self) -> bool:
+        """False once it is done or has given up until the next start"""
+        return not self.done and self.stalls < self.config.get("pregen_max_stalls", 10)
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.state, f)
+
+    async def rcon(self, command: str) -> str | None:
+        return await rcon_send("127.0.0.1", self.config["_rcon_port"], self.config["_rcon_password"], command)
+
+    async def mspt(self) -> float | None:
+        """Average tick time in ms, or None if the server does not have /tick query"""
+        reply = await self.rcon("tick query")
+        match = re.search(r"Average time per tick: ([\d.]+) ?ms", reply or "")
+        return float(match.group(1)) if match else None
+
+    def tiles(self) -> list[tuple[int, int, int, int]]:
+        """Squares of chunks (x1, z1, x2, z2) covering the radius, nearest to the center first"""
+        if self._tiles is not None:
+            return self._tiles
+        side = max(1, math.isqrt(min(self.config["pregen_batch"], 256)))
+        radius = math.ceil(self.config["pregen_radius"] / 16)
+        cx, cz = (int(c) // 16 for c in self.config["pregen_center"])
+        count = math.ceil((radius + 1) / side)
+        tiles = sorted(((tx, tz) for tx in range(-count, count) for tz in range(-count, count)), key=lambda t: max(abs(t[0] + 0.5), abs(t[1] + 0.5)))
+        self._tiles = [(cx + tx * side, cz + tz * side, cx + tx * side + side - 1, cz + tz * side + side - 1) for tx, tz in tiles]
+        return self._tiles
+
+    def report(self, percent: float):
+        self.state["percent"] = percent
+        if int(percent) != self._reported:
+            self._reported = int(percent)
+            log.info(f"Pre-generation: {percent:.1f}% of a {self.config['pregen_radius']} block radius in {self.config['pregen_world']}")
+
+    async def step(self) -> bool:
+        """Called while the server is empty. Starts, continues or throttles the generation. Returns False if it made no progress"""
+        if not self.active:
+            return False
+        mspt = await self.mspt()
+        if mspt is not None and mspt > self.config["pregen_max_mspt"]:
+            if self.running:
+                log.info(f"Pre-generation: waiting for the server to catch up ({mspt:.1f} mspt)")
+                await self.pause()
+            return self._stall(f"the server stayed above {self.config['pregen_max_mspt']} mspt")
+
+        if self.config["pregen_method"] == "chunky":
+            progressed = await self._step_chunky()
+        else:
+            progressed = await self._step_forceload()
+        self.save()
+        if not progressed:
+            # rcon_send returns None for a wrong password or a closed port
+            return self._stall("RCON did not answer (check enable-rcon and rcon.password)")
+        self.stalls = 0
+        return True
+
+    def _stall(self, reason: str) -> bool:
+        self.stalls += 1
+        self.stalled = reason
+        if not self.active:
+            log.warning(f"Pre-generation: stopped until the next start because {reason} for {self.stalls} polls in a row")
+        return False
+
+    async def _step_chunky(self) -> bool:
+        if not self.running:
+            reply = await self.rcon("chunky continue") if self.state["started"] else None
+            if reply is None or "No task" in reply:
+                # No task to continue: it finished while the server was stopped, or it was never started
+                if self.state["started"] and self.state["percent"] >= 99.9:
+                    self._finish()
+                    return True
+                world, (x, z), radius = self.config["pregen_world"], self.config["pregen_center"], self.config["pregen_radius"]
+                for command in (f"chunky world {world}", f"chunky center {x} {z}", f"chunky radius {radius}", "chunky start"):
+                    reply = await self.rcon(command)
+                if reply is None:
+                    log.warning("Pre-generation: Chunky did not respond. Is it installed?")
+                    return False
+                self.state["started"] = True
+            self.running = True
+            log.info("Pre-generation: Chunky is generating")
+            return True
+
+        reply = await self.rcon("chunky progress")
+        match = re.search(r"\(([\d.]+)%\)", reply or "")
+        if match:
+            self.report(float(match.group(1)))
+        elif reply is not None:
+            # No task is running any more
+            self._finish()
+        return reply is not None
+
+    async def _step_forceload(self) -> bool:
+        tiles = self.tiles()
+        world = self.config["pregen_world"]
+
+        # The last batch had a poll interval to generate
+        if self.state["batch"] is not None:
+            await self.rcon(f"execute in {world} run forceload remove {' '.join(str(c * 16) for c in self.state['batch'])}")
+            self.state["batch"] = None
+            self.state["index"] += 1
+            self.report(100 * self.state["index"] / len(tiles))
+
+        if self.state["index"] >= len(tiles):
+            self._finish()
+            return True
+
+        batch = tiles[self.state["index"]]
+        reply = await self.rcon(f"execute in {world} run forceload add {' '.join(str(c * 16) for c in batch)}")
+        if reply is None:
+            return False
+        self.state["batch"] = batch
+        self.running = True
+        return True
+
+    async def pause(self):
+        """Stops generating until step is called again"""
+        if not self.running:
+            return
+        if self.config["pregen_method"] == "chunky":
+            await self.rcon("chunky pause")
+        elif self.state["batch"] is not None:
+            await self.rcon(f"execute in {self.config['pregen_world']} run forceload remove {' '.join(str(c * 16) for c in self.state['batch'])}")
+            self.state["batch"] = None
+            self.state["index"] += 1
+        self.running = False
+        self.save()
+
+    def _finish(self):
+        self.state.update(done=True, percent=100.0)
+        self.running = False
+        self.save()
+        log.info("Pre-generation is done")
+
+
 class ServerManager:
     def __init__(self, config: dict):
         self.config = config
@@ -543,6 +764,15 @@ class ServerManager:
             self._starting = True
             self._start_time = time.monotonic()
             self._ready_event.clear()
+
+            # A class data sharing archive made from other mods/jars would be ignored (or made again on Java 19+)
+            if AppCDS is not None:
+                try:
+                    if await asyncio.to_thread(AppCDS.invalidate, self.config["server_dir"], self.config["start_command"]):
+                        log.info("The AppCDS archive is outdated and was removed (run AppCDS.py again if the Java version is older than 19)")
+                except Exception as e:
+                    log.warning(f"Unable to check the AppCDS archive: {e}")
+
             log.info(f"Starting server: {self.config['start_command']}")
             self._process = await asyncio.create_subprocess_shell(
                 self.config["start_command"],
@@ -688,6 +918,13 @@ class ServerManager:
         poll_interval = self.config.get("auto_stop_poll_interval", 30)
         empty_since: float | None = None
 
+        pregen = None
+        if self.config.get("pregen_radius"):
+            if self.config.get("_rcon_enabled"):
+                pregen = Pregenerator(self.config)
+            else:
+                log.warning("Pre-generation needs RCON (enable-rcon in server.properties)")
+
         log.info(f"Auto-stop monitor active: will stop after {empty_minutes}m")
 
         while True:
@@ -699,11 +936,19 @@ class ServerManager:
                 log.info("Auto-stop monitor: server no longer reachable, retrying in 30s.")
                 self._ready_event.clear()
                 self._process = None
+                if pregen is not None:
+                    pregen.running = False # Continued from pregen.json once the server is back
                 
                 await asyncio.sleep(30)
                 continue
 
             if count == 0:
+                # The empty server generates chunks instead of stopping. A poll without progress counts towards the countdown
+                if pregen is not None and pregen.active:
+                    if await pregen.step() and pregen.active:
+                        empty_since = None
+                        continue
+
                 if empty_since is None:
                     empty_since = time.monotonic()
                     log.info("Auto-stop monitor: server is empty, starting countdown.")
@@ -713,6 +958,9 @@ class ServerManager:
                     await self.stop_server()
                     return
             else:
+                if pregen is not None and pregen.running:
+                    log.info(f"Pre-generation: paused because {count} player(s) joined")
+                    await pregen.pause()
                 if empty_since is not None:
                     log.info(f"Auto-stop monitor: {count} player(s) online, resetting countdown.")
                 empty_since = None
@@ -1057,6 +1305,8 @@ async def main():
     log.info(f"Server (redirect) port: {config['server_port']}")
     log.info(f"Start command: {config['start_command']}")
     log.info(f"Auto-stop: after {config['auto_stop_empty_minutes']}m empty")
+    if config.get("pregen_radius"):
+        log.info(f"Pre-generation: {config['pregen_radius']} block radius with {config['pregen_method']} while the server is empty")
 
     asyncio.create_task(watch_config(config))
 
@@ -8,7 +8,7 @@ ONLY works on bukkit
 CONFIG is DIRECTLY rewritten to this file 
 """
 
-version = 2.4
+version = 2.8
 versionUpdates = """
 V.2 features:
 - Fixes linux terminal error (still doesn't work on some)
@@ -22,11 +22,14 @@ V.2 features:
 - Checks if AutoConfig and Config have conflicts (2.2)
 - Adds .autodelay command and fixes 2 CMDs being ran at once (2.3)
 - Every . will use the last CMD ran (e.g. .. = 2nd last cmd ran, V.2.3)
+- Log is followed by one reader thread that prints every new line in order and handles log rotation (2.5)
+- ".log <amount> <regex>" filters lines, reads from the end of the file and continues into rotated logs (2.6)
+- .autodelay sizes the refresh delay from the log write rate and read cost instead of CPU%, and can be turned off with .delay (2.7)
+- Built-in RCON client: ;new; batches run on one connection (in one round-trip with pipeline = True), the connection reconnects after a restart and "@all <cmd>" runs on every server in servers.mcr (2.8)
 """
 
-import os, sys, threading # required
+import os, sys, time, threading, select, socket, struct # required
 import re, traceback # KMCL
-from mcrcon import MCRcon # required
 print(f"""
 {"":=>{os.get_terminal_size()[0]}}
 MCRcon CMD
@@ -39,33 +42,275 @@ A basic interface to run commands as RCON as well as displaying updating log
 
 delay = 0.1
 
+# Send a ;new; batch in one write. Only for servers that accept several RCON packets at once (vanilla and Fabric do not)
+pipeline = False
+
+# .autodelay bounds. With inotify the log thread is woken up on changes and the delay is only a fallback
+autoDelay = False
+minDelay = 0.05
+maxDelay = 2.0
+
 # New Last CMD to run the last CMD
 lastCMDs = []
 
 CMDHELP = {
     ".exit": "Exits MCRcon CMD safely",
-    ".delay <value>": "Changes the delay of fetching the log file",
-    ".log <amount>": "Prints the last <amount> lines of the log file. If <amount> is invaild (e.g. not specified), then amount is set to -1 (entire log file)",
+    ".delay <value>": "Changes the delay of fetching the log file (turns .autodelay off)",
+    ".log <amount> <regex>": "Prints the last <amount> lines of the log file (continuing into rotated logs), only counting lines matching <regex> if it is given. If <amount> is invaild (e.g. not specified), then amount is set to -1 (entire log file)",
     ".clear": "Clears the terminal screen",
-    ".autodelay": "EXPERIMENTAL: Automatically adjusts the delay of log refresh rate based on the amount of CPU% the current program is using. Once enabled, you cannot go back and .delay stops working",
+    ".autodelay": "Automatically adjusts the delay of log refresh rate based on how fast the log is written and how long reading it takes. Use .delay to go back",
+    "@<server> <cmd>": "Runs <cmd> on a server from servers.mcr (one \"<name> <host>:<port> <password>\" per line). @all runs it on every server at once",
     ".help": "Shows this command"
 }
 
-# EXPERIMENTAL: Auto adjust delay depending on the CPU usage of the process
-def adjustDelay():
-    threading.Timer(1, adjustDelay).start()
-
-    global delay 
-
-    currentCpu = process.cpu_percent(1)
-
-    if currentCpu < 0.1:
-        delay = round(delay/2, 2)
-    elif currentCpu > 0.1:
-        delay = round(delay*2, 2)
-
-
+class DelayController:
+    """
+    Sizes the log refresh delay for .autodelay.
+    Write rate and read cost are smoothed with an EWMA so the delay settles instead of oscillating.
+    @param lineBytes: Poll about as often as a line of this size is written
+    @param budget: Max fraction of time spent reading the log
+    @param alpha: EWMA weight of the newest sample
+    """
+    def __init__(self, lineBytes=128, budget=0.01, alpha=0.2):
+        self.lineBytes = lineBytes
+        self.budget = budget
+        self.alpha = alpha
+        self.rate = 0.0 # bytes/s
+        self.cost = 0.0 # s per poll
+
+    def update(self, written, elapsed, cost):
+        """Adds one poll (<written> bytes in <elapsed> seconds, taking <cost> seconds to read) and returns the new delay"""
+        if elapsed > 0:
+            self.rate += self.alpha * (written / elapsed - self.rate)
+        self.cost += self.alpha * (cost - self.cost)
+
+        wanted = self.lineBytes / self.rate if self.rate > 0 else maxDelay
+        return min(maxDelay, max(minDelay, wanted, self.cost / self.budget))
+
+
+
+
+# Pipelined RCON client (from KMCEv3's RCONConnection)
+class RCON:
+    """
+    An RCON connection that runs batches of commands and matches the responses by request ID.
+    The vanilla server reads one packet at a time and closes the connection otherwise, so commands are sent one by one
+    unless <pipeline> is set, which sends the whole batch in one write.
+    Reconnects automatically if the server was restarted since the last batch.
+    """
+    MAX_PAYLOAD = 1446 # Vanilla reads a request with a single 1460 byte read
+    SPLIT = 4096 # and splits responses into packets of 4096 characters
+
+    def __init__(self, host, port, password, timeout=5, pipeline=False):
+        self.HOST = host
+        self.PORT = int(port)
+        self.PASSWORD = password
+        self.TIMEOUT = timeout
+        self.PIPELINE = pipeline
+
+        self.sock = None
+        self.requestID = 0
+
+    def _pack(self, packetType, payload):
+        self.requestID = self.requestID % 0x7FFFFFFF + 1
+        body = struct.pack('<ii', self.requestID, packetType) + payload.encode('utf-8') + b'\x00\x00'
+        return self.requestID, struct.pack('<i', len(body)) + body
+
+    def _read(self, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk: raise ConnectionError("RCON connection was closed by the server")
+            data += chunk
+        return bytes(data)
+
+    def _readPacket(self):
+        data = self._read(struct.unpack('<i', self._read(4))[0])
+        requestID, packetType = struct.unpack('<ii', data[:8])
+        return requestID, packetType, data[8:-2].decode('utf-8', errors='replace')
+
+    def connect(self):
+        self.close()
+        self.sock = socket.create_connection((self.HOST, self.PORT), self.TIMEOUT)
+        try:
+            self.sock.sendall(self._pack(3, self.PASSWORD)[1])
+
+            # Some servers send an empty response value before the auth response
+            while True:
+                requestID, packetType, _ = self._readPacket()
+                if packetType == 2: break
+        except OSError:
+            self.close()
+            raise
+        if requestID == -1:
+            self.close()
+            raise ConnectionError("RCON authentication failed (wrong password)")
+
+    def alive(self):
+        """The socket is open and the server has not closed it"""
+        if self.sock is None: return False
+        try:
+            if select.select([self.sock], [], [], 0)[0]:
+                return self.sock.recv(1, socket.MSG_PEEK) != b''
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def command(self, command):
+        return self.commands([command])[0]
+
+    def _readUntil(self, endID, requestIDs, responses):
+        # The server answers an unknown packet type with the same ID,
+        # so it marks the end of responses that were split into several packets
+        while True:
+            requestID, _, body = self._readPacket()
+            if requestID == endID: return
+            if requestID in requestIDs:
+                responses[requestIDs[requestID]].append(body)
+
+    def commands(self, commands):
+        """Runs <commands> in order and returns their responses. With pipeline, the whole batch costs one round-trip"""
+        for command in commands:
+            if len(command.encode('utf-8')) > self.MAX_PAYLOAD:
+                raise ValueError(f"Command is longer than {self.MAX_PAYLOAD} bytes, which RCON does not accept")
+        if not self.alive():
+            self.connect()
 
+        try:
+            responses = [[] for _ in commands]
+            if self.PIPELINE:
+                requestIDs = {}
+                data = bytearray()
+                for i, command in enumerate(commands):
+                    requestID, packet = self._pack(2, command)
+                    requestIDs[requestID] = i
+                    data += packet
+
+                endID, packet = self._pack(0, '')
+                self.sock.sendall(data + packet)
+                self._readUntil(endID, requestIDs, responses)
+            else:
+                for i, command in enumerate(commands):
+                    requestID, packet = self._pack(2, command)
+                    self.sock.sendall(packet)
+                    while True:
+                        responseID, _, body = self._readPacket()
+                        if responseID == requestID: break
+                    responses[i].append(body)
+
+                    # A full packet may be followed by the rest of the response. The command has already run,
+                    # so the end marker can be sent on its own now
+                    if len(body.encode('utf-16-le')) // 2 >= self.SPLIT:
+                        endID, packet = self._pack(0, '')
+                        self.sock.sendall(packet)
+                        self._readUntil(endID, {requestID: i}, responses)
+        except OSError:
+            # The commands may already have run, so they are not sent again
+            self.close()
+            raise
+        return ["".join(response) for response in responses]
+
+    def close(self):
+        if self.sock is not None:
+            try: self.sock.close()
+            except OSError: pass
+            self.sock = None
+
+def loadServers():
+    """Reads servers.mcr. Each line is "<name> <host>[:<port>] <password>". The port defaults to 25575"""
+    servers = {"local": mcr}
+    try:
+        with open("servers.mcr", "r") as f:
+            for n, line in enumerate(f, 1):
+                l = line.strip().split(" ", 2)
+                if l[0] == "" or l[0].startswith("#"): continue
+                if len(l) < 3:
+                    print(f"WARNING: servers.mcr line {n} is not \"<name> <host>:<port> <password>\". Skipping it")
+                    continue
+                host, _, p = l[1].rpartition(":")
+                if not host:
+                    host, p = l[1], "25575"
+                if not p.isdigit():
+                    print(f"WARNING: servers.mcr line {n} has an invalid port ({p}). Skipping it")
+                    continue
+                servers[l[0]] = RCON(host, p, l[2], pipeline=pipeline)
+    except FileNotFoundError: pass
+    return servers
+
+def runOn(targets, commands):
+    """Runs a batch on several servers in parallel and prints the responses"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(name):
+        try:
+            return servers[name].commands(commands)
+        except Exception as e:
+            return [f"Error: {e}"]
+
+    with ThreadPoolExecutor(len(targets)) as pool:
+        for name, responses in zip(targets, pool.map(run, targets)):
+            for response in responses:
+                print(f"[{name}] {response}" if len(targets) > 1 else response)
+
+def readBackwards(path, amount, pattern=None, blockSize=65536):
+    """
+    Returns the last <amount> lines of a file matching <pattern> (newest first).
+    Reads fixed-size blocks backwards from the end, so memory depends on <amount> and not on the file size.
+    """
+    lines = []
+    with open(path, "rb") as f:
+        pos = f.seek(0, 2)
+        rest = b""
+        first = True
+
+        while pos > 0 and len(lines) < amount:
+            size = min(blockSize, pos)
+            pos -= size
+            f.seek(pos)
+            parts = (f.read(size) + rest).split(b"\n")
+
+            # The first part may continue in the previous block
+            rest = parts.pop(0) if pos > 0 else b""
+            if first:
+                if parts and parts[-1] == b"": parts.pop() # File ends with a newline
+                first = False
+
+            for line in reversed(parts):
+                line = line.decode(errors="replace").rstrip("\r")
+                if pattern is None or pattern.search(line):
+                    lines.append(line)
+                    if len(lines) >= amount: break
+    return lines
+
+def readArchive(path, amount, pattern=None):
+    """Returns the last <amount> lines of a rotated .log.gz matching <pattern> (newest first). gzip can only be read forwards"""
+    import gzip
+    from collections import deque
+
+    lines = deque(maxlen=amount)
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            line = line.decode(errors="replace").rstrip("\r\n")
+            if pattern is None or pattern.search(line):
+                lines.append(line)
+    return list(reversed(lines))
+
+def lastLines(amount, pattern=None):
+    """Returns the last <amount> lines of the log matching <pattern> (oldest first), continuing into the rotated logs"""
+    lines = readBackwards(logfile, amount, pattern) if os.path.exists(logfile) else []
+
+    # Rotated logs are named YYYY-MM-DD-N.log.gz
+    logs = os.path.dirname(os.path.abspath(logfile))
+    archives = []
+    for name in os.listdir(logs):
+        m = re.fullmatch(r"(\d{4}-\d{2}-\d{2})-(\d+)\.log\.gz", name)
+        if m: archives.append((m.group(1), int(m.group(2)), name))
+
+    for *_, name in sorted(archives, reverse=True):
+        if len(lines) >= amount: break
+        lines += readArchive(os.path.join(logs, name), amount - len(lines), pattern)
+
+    return lines[::-1]
 
 def findLogFile():
     global logfile
@@ -134,7 +379,7 @@ If you do not include "y", the current config will be used
 
     print("Connecting to RCON...")
 
-    mcr = MCRcon("127.0.0.1", password, int(port))
+    mcr = RCON("127.0.0.1", port, password, pipeline=pipeline)
     mcr.connect()
 except Exception as e:
     print(f"Error: {e}. Using Config... CTRL + C to skip")
@@ -183,29 +428,92 @@ except Exception as e:
         except KeyboardInterrupt:
             print("Skipping config...")
 
-lastLine = ""
-
 if logfile == "": findLogFile()
 
-mcr = MCRcon("127.0.0.1", password, int(port))
+mcr = RCON("127.0.0.1", port, password, pipeline=pipeline)
 mcr.connect()
+servers = loadServers()
 
 
-def loop():
-    global lastLine, thread
-    thread = threading.Timer(delay, loop)
-    thread.start()
-    with open(logfile, 'r') as f:
-        line = f.readlines()[-1]
-
-    if line != lastLine:
-        print("[LOG] "+line)
+stopTail = threading.Event()
 
-        lastLine = line
+def makeLogWaiter():
+    """
+    Returns a function that waits (up to a timeout) until the log directory changes, and if it is event driven.
+    Uses inotify on Linux, so new lines are printed right away. Otherwise it just sleeps.
+    """
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+        if fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(fd, os.path.dirname(os.path.abspath(logfile)).encode(), 0x2 | 0x40 | 0x80 | 0x100 | 0x200) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+    except (OSError, AttributeError, TypeError):
+        return stopTail.wait, False
+
+    def wait(timeout):
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if ready:
+            # The events themselves do not matter, only that something changed
+            try:
+                while os.read(fd, 4096): pass
+            except BlockingIOError: pass
+    return wait, True
+
+def tail():
+    """Prints every new line of the log file in order. Runs in one thread until stopTail is set"""
+    global delay
+    wait, evented = makeLogWaiter()
+    controller = DelayController()
+    lastPoll = time.monotonic()
+
+    offset = os.path.getsize(logfile) if os.path.exists(logfile) else 0
+    inode = None
+    partial = b""
+
+    while not stopTail.is_set():
+        try:
+            stat = os.stat(logfile)
+        except FileNotFoundError:
+            wait(delay)
+            continue
+
+        # A new file (rotated) or a rewritten one is read from the start
+        if inode is not None and (stat.st_ino != inode or stat.st_size < offset):
+            offset = 0
+            partial = b""
+        inode = stat.st_ino
+
+        start = time.monotonic()
+        data = b""
+        if stat.st_size > offset:
+            with open(logfile, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            offset += len(data)
+
+            # The last part may be a line that is still being written
+            *lines, partial = (partial + data).split(b"\n")
+            for line in lines:
+                print("[LOG] " + line.decode(errors="replace").rstrip("\r"))
+
+        if autoDelay:
+            now = time.monotonic()
+            delay = controller.update(len(data), now - lastPoll, now - start)
+            lastPoll = now
+
+        # Events wake the thread up anyway, so polling is only a fallback
+        wait(maxDelay if autoDelay and evented else delay)
+
+thread = threading.Thread(target=tail, daemon=True)
 
 useLastCMD = 0
 
-loop()
+thread.start()
 while True:
 
     if useLastCMD > 0:
@@ -261,7 +569,8 @@ while True:
         useLastCMD = len(cmd)
 
     if cmd.lower() in ["exit", ".exit"]:
-        thread.cancel()
+        stopTail.set()
+        thread.join(1)
         sys.exit(), exit()
 
     elif cmd.lower() in [".help"]:
@@ -269,9 +578,7 @@ while True:
             print(f"{key}: {CMDHELP[key]}")
 
     elif cmd.lower() in [".autodelay"]:
-        from psutil import Process
-        process = Process()
-        adjustDelay()
+        autoDelay = True
         print("Current delay: " + str(delay))
 
     elif cmd.lower() in [".clear"]:
@@ -279,30 +586,44 @@ while True:
         elif sys.platform.startswith('linux'):  os.system(f'clear')
         else: print("Your OS is not supported. Alternatively, you may use &os.system(\"<cmd>\")& and replace <cmd> with the OS cmd to clear terminal screens")
     elif cmd.lower().startswith(".log"):
-        # Get log
-        with open(logfile, 'r') as f:
-            log = f.readlines()
+        args = cmd.split(" ", 2)
 
         try:
-            amount = int(cmd.lower().split(" ")[1])
+            amount = int(args[1])
         except Exception as e:
             amount = -1
-        
-        if amount == -1: amount = len(log)
 
-        print("".join(
-            log[(-1*amount):])
-        )
+        try:
+            pattern = re.compile(args[2]) if len(args) > 2 else None
+        except re.error as e:
+            print(f"Invalid regex: {e}")
+            continue
+
+        if amount == -1:
+            # Entire log file, printed as it is read
+            with open(logfile, 'r', errors='replace') as f:
+                for line in f:
+                    if pattern is None or pattern.search(line):
+                        print(line, end="")
+        else:
+            print("\n".join(lastLines(amount, pattern)))
 
     elif cmd.lower().startswith(".delay"):
         try:
             delay = float(cmd.lower().split(" ")[1])
+            autoDelay = False
         except Exception as e:
             print(traceback.format_exc())
     else:
-        
-        if ";new;" not in cmd:
-            print(mcr.command(cmd))
-        else:
-            for c in cmd.split(';new;'):
-                print(mcr.command(c))
+        targets = ["local"]
+        if cmd.startswith("@"):
+            name, _, cmd = cmd[1:].partition(" ")
+            if name == "all":
+                targets = list(servers)
+            elif name in servers:
+                targets = [name]
+            else:
+                print(f"Unknown server {name}. Servers: {', '.join(servers)}")
+                continue
+
+        runOn(targets, cmd.split(';new;'))
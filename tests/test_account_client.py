@@ -0,0 +1,120 @@
+import threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+import json
+import pytest
+
+import KMCEv3
+from KMCEv3 import AccountClient
+
+
+class AccountServer(ThreadingHTTPServer):
+    """Stub of the KCash Account System's /cmd/<command> endpoint"""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), AccountHandler)
+        self.accounts = {"Steve": 100}
+        self.requests = []
+        self.delay = 0
+
+class AccountHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+        server = self.server
+        command = unquote(self.path[len("/cmd/"):]).split()
+        server.requests.append(" ".join(command))
+
+        match command:
+            case ["READ", "bal", "FOR", player]:
+                response = {"success": True, "output": server.accounts.get(player, 0)}
+            case ["ADD", amount, "FOR", player]:
+                server.accounts[player] = server.accounts.get(player, 0) + int(amount)
+                response = {"success": True}
+            case ["TRANSFER", "FOR", player]:
+                response = {"success": True, "output": server.accounts.pop(player, 0)}
+            case _:
+                response = {"success": False, "reason": "unknown command"}
+
+        # The response is made before the delay, like a read that is still on its way back
+        time.sleep(server.delay)
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def server(monkeypatch):
+    server = AccountServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(KMCEv3, "_serverCache", {"address": f"127.0.0.1:{server.server_port}", "expires": float("inf")})
+    yield server
+    server.shutdown()
+
+def reads(server):
+    return [r for r in server.requests if r.startswith("READ")]
+
+
+def test_concurrent_balances_share_one_request(server):
+    server.delay = 0.3
+    client = AccountClient()
+
+    start = threading.Barrier(20)
+    results = []
+    def balance():
+        start.wait()
+        results.append(client.balance("Steve"))
+
+    threads = [threading.Thread(target=balance) for _ in range(20)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    assert results == [100] * 20
+    assert len(reads(server)) == 1
+
+def test_balance_is_cached_until_the_ttl_expires(server):
+    client = AccountClient(balance_ttl=0.2)
+
+    assert client.balance("Steve") == 100
+    server.accounts["Steve"] = 150 # Changed by something else
+    assert client.balance("Steve") == 100
+    assert len(reads(server)) == 1
+
+    time.sleep(0.3)
+    assert client.balance("Steve") == 150
+    assert len(reads(server)) == 2
+
+def test_add_and_transfer_invalidate_the_balance(server):
+    client = AccountClient(balance_ttl=60)
+
+    assert client.balance("Steve") == 100
+    client.add(25, "Steve")
+    assert client.balance("Steve") == 125
+
+    assert client.transfer("Steve")["output"] == 125
+    assert client.balance("Steve") == 0
+    assert len(reads(server)) == 3
+
+def test_a_read_started_before_a_change_is_not_cached(server):
+    server.delay = 0.3
+    client = AccountClient(balance_ttl=60)
+
+    reader = threading.Thread(target=client.balance, args=("Steve",))
+    reader.start()
+    time.sleep(0.1)
+    server.delay = 0
+    client.add(5, "Steve") # Lands while the read is still in flight
+    reader.join()
+
+    assert client.balance("Steve") == 105
+
+def test_failed_read_is_not_cached_as_zero(server):
+    client = AccountClient(balance_ttl=60)
+    address = KMCEv3._serverCache["address"]
+
+    # The account server is down
+    KMCEv3._serverCache["address"] = "127.0.0.1:1"
+    assert client.balance("Steve") is None
+
+    KMCEv3._serverCache["address"] = address
+    assert client.balance("Steve") == 100
@@ -0,0 +1,85 @@
+import threading, time
+
+from KMCEv3 import BotChannel
+
+
+class FakeBot:
+    """Chats into a list and answers like a Mineflayer bot: sets output while holding lock"""
+    def __init__(self, answer=True, delay=0.01):
+        self.lock = threading.Lock()
+        self.output = None
+        self.chatted = []
+        self.answer = answer
+        self.delay = delay
+        self.answers = threading.Lock() # Answers arrive in the order the commands were chatted
+
+    def chat(self, command):
+        self.chatted.append(command)
+        if self.answer:
+            threading.Thread(target=self.respond, args=(f"re:{command}",)).start()
+
+    def respond(self, output):
+        with self.answers:
+            time.sleep(self.delay)
+            with self.lock:
+                self.output = output
+
+
+def test_responses_are_matched_in_order():
+    bot = FakeBot()
+    channel = BotChannel(bot)
+
+    futures = [channel.send(f"cmd{i}") for i in range(10)]
+    assert [channel.wait(future) for future in futures] == [f"re:cmd{i}" for i in range(10)]
+
+def test_timeout_returns_an_empty_string():
+    bot = FakeBot(answer=False)
+    channel = BotChannel(bot)
+
+    start = time.monotonic()
+    assert channel.wait(channel.send("list"), timeout=0.1) == ''
+    assert time.monotonic() - start < 1
+
+def test_late_response_is_dropped():
+    bot = FakeBot(answer=False)
+    channel = BotChannel(bot)
+    assert channel.wait(channel.send("slow"), timeout=0.1) == ''
+
+    # The answer to the timed out command arrives with nothing waiting
+    bot.respond("re:slow")
+
+    bot.answer = True
+    assert channel.wait(channel.send("next")) == "re:next"
+
+def test_output_is_cleared_once_taken():
+    bot = FakeBot()
+    channel = BotChannel(bot)
+
+    assert channel.wait(channel.send("list")) == "re:list"
+    assert bot.output is None
+
+    # Dropped outputs are cleared too
+    bot.respond("unrequested")
+    assert bot.output is None
+
+def test_late_response_is_not_given_to_the_next_command():
+    bot = FakeBot(answer=False)
+    channel = BotChannel(bot)
+    assert channel.wait(channel.send("slow"), timeout=0.1) == ''
+
+    # The next command is waiting when the answer to the timed out one arrives
+    future = channel.send("next")
+    bot.respond("re:slow")
+    bot.respond("re:next")
+    assert channel.wait(future) == "re:next"
+
+def test_lost_response_does_not_shift_later_ones():
+    bot = FakeBot(answer=False)
+    channel = BotChannel(bot, timeout=0.1)
+    assert channel.wait(channel.send("lost")) == ''
+
+    # No answer came within another timeout, so the next output belongs to the next command
+    time.sleep(0.15)
+    future = channel.send("next")
+    bot.respond("re:next")
+    assert channel.wait(future) == "re:next"
@@ -0,0 +1,137 @@
+import hashlib, os, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from MCDownloader import ArtifactCache, Downloader, DownloadError
+
+JAR = os.urandom(300_000)
+
+
+class FileServer(ThreadingHTTPServer):
+    """Serves /files/<name> with Range support and /meta as an ETag'd JSON document"""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.files = {"mod.jar": JAR}
+        self.requests = []      # (path, Range, If-None-Match)
+        self.truncate = 0       # Closes the next responses of files after this many bytes
+        self.meta = b'{"versions": [1, 2]}'
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("Range"), self.headers.get("If-None-Match")))
+
+        if self.path == "/meta":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(server.meta)))
+            self.end_headers()
+            self.wfile.write(server.meta)
+            return
+
+        data = server.files[self.path[len("/files/"):]]
+        start = int(self.headers["Range"][6:-1]) if self.headers.get("Range") else 0
+        body = data[start:]
+        self.send_response(206 if start else 200)
+        if start: self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if server.truncate:
+            server.truncate, body = 0, body[:server.truncate]
+            self.wfile.write(body)
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+@pytest.fixture
+def server():
+    server = FileServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def downloader(tmp_path):
+    with Downloader(retries=2, backoff=0.01, timeout=5, progress=False, verbose=False, cache=ArtifactCache(str(tmp_path / "cache"))) as downloader:
+        yield downloader
+
+def hashes(data):
+    return {"sha1": hashlib.sha1(data).hexdigest(), "sha512": hashlib.sha512(data).hexdigest()}
+
+
+def test_truncated_download_is_resumed(server, downloader, tmp_path):
+    server.truncate = 100_000
+    path = downloader.fetch(f"{server.url}/files/mod.jar", str(tmp_path / "mod.jar"), len(JAR), hashes(JAR))
+
+    with open(path, "rb") as f:
+        assert f.read() == JAR
+    assert not os.path.exists(path + ".part")
+    # The second request only asked for what was not written to the .part file yet
+    ranges = [r for _, r, _ in server.requests]
+    assert len(ranges) == 2 and ranges[0] is None
+    assert 0 < int(ranges[1][6:-1]) <= 100_000
+
+def test_part_file_is_continued(server, downloader, tmp_path):
+    with open(tmp_path / "mod.jar.part", "wb") as f:
+        f.write(JAR[:1234])
+    downloader.fetch(f"{server.url}/files/mod.jar", str(tmp_path / "mod.jar"), len(JAR), hashes(JAR))
+
+    assert server.requests[0][1] == "bytes=1234-"
+    with open(tmp_path / "mod.jar", "rb") as f:
+        assert f.read() == JAR
+
+@pytest.mark.parametrize("algorithm", ["sha1", "sha512"])
+def test_hash_mismatch_removes_the_part_file(server, downloader, tmp_path, algorithm):
+    wrong = hashes(JAR) | {algorithm: hashes(b"something else")[algorithm]}
+
+    with pytest.raises(DownloadError, match=f"{algorithm} mismatch"):
+        downloader.fetch(f"{server.url}/files/mod.jar", str(tmp_path / "mod.jar"), len(JAR), wrong)
+    assert not os.path.exists(tmp_path / "mod.jar")
+    assert not os.path.exists(tmp_path / "mod.jar.part")
+
+def test_cached_file_is_linked_without_a_request(server, downloader, tmp_path):
+    first = downloader.fetch(f"{server.url}/files/mod.jar", str(tmp_path / "a.jar"), len(JAR), hashes(JAR))
+    second = downloader.fetch(f"{server.url}/files/mod.jar", str(tmp_path / "b.jar"), len(JAR), hashes(JAR))
+
+    assert len(server.requests) == 1
+    with open(second, "rb") as f:
+        assert f.read() == JAR
+    # Both are hardlinks of the cached file
+    cached = os.stat(downloader.cache.path(hashes(JAR)["sha512"]))
+    assert os.path.samestat(os.stat(first), cached) and os.path.samestat(os.stat(second), cached)
+
+def test_metadata_is_revalidated_with_its_etag(server, downloader):
+    assert downloader.get_meta(f"{server.url}/meta") == {"versions": [1, 2]}
+    # Young enough copies are used without a request
+    assert downloader.get_meta(f"{server.url}/meta") == {"versions": [1, 2]}
+    assert len(server.requests) == 1
+
+    assert downloader.get_meta(f"{server.url}/meta", ttl=0) == {"versions": [1, 2]}
+    assert server.requests[1] == ("/meta", None, '"v1"')
+
+def test_metadata_falls_back_to_the_cache_offline(server, downloader):
+    url = f"{server.url}/meta"
+    assert downloader.get_meta(url) == {"versions": [1, 2]}
+
+    server.shutdown()
+    server.server_close()
+    assert downloader.get_meta(url, ttl=0) == {"versions": [1, 2]}
+
+    with pytest.raises(DownloadError):
+        downloader.get_meta(url.replace("/meta", "/other"), ttl=0)
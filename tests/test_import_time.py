@@ -0,0 +1,28 @@
+import os, re, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold import of KMCEv3 in a new interpreter (with its bytecode cached), in milliseconds
+IMPORT_TARGET_MS = 50
+# Imported only by the functions that need them
+LAZY_MODULES = ("requests", "yaml", "dns", "asyncio", "gzip", "concurrent.futures", "mcrcon")
+
+
+def run(code, tmp_path, *flags):
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=str(tmp_path / "pycache"))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+def test_cold_import_is_under_the_target(tmp_path):
+    run("import KMCEv3", tmp_path) # Compiles the bytecode once
+
+    times = []
+    for _ in range(3):
+        output = run("import KMCEv3", tmp_path, "-X", "importtime").stderr
+        times.append(int(re.search(r"\|\s*(\d+) \| KMCEv3$", output, re.MULTILINE).group(1)) / 1000)
+
+    assert min(times) < IMPORT_TARGET_MS, f"importing KMCEv3 took {min(times):.1f} ms (target {IMPORT_TARGET_MS} ms)"
+
+def test_optional_dependencies_are_not_imported(tmp_path):
+    output = run(f"import sys, KMCEv3; print([m for m in {LAZY_MODULES!r} if m in sys.modules])", tmp_path).stdout
+    assert output.strip() == "[]"
@@ -0,0 +1,33 @@
+import pytest
+
+import JVMFlags
+from JVMFlags import GB
+
+
+def hardware(total, available, cgroup=None):
+    return {"memory": total * GB, "available": available * GB, "cgroup_memory": cgroup and cgroup * GB,
+            "cpus": 8, "cgroup_cpus": None, "java": 21, "thp": None}
+
+def heap_of(flags):
+    return next(JVMFlags.parse_size(flag[4:]) for flag, _ in flags if flag.startswith("-Xmx"))
+
+@pytest.mark.parametrize("total, available", [(8, 5), (16, 9), (32, 20), (32, 31), (64, 60)])
+def test_generated_heap_passes_the_mass_memory_check(total, available):
+    flags = JVMFlags.generate(None, hardware(total, available))
+    # MASS compares ram_required with the available RAM before it starts the server
+    assert JVMFlags.memory_required(heap_of(flags)) <= available - JVMFlags.HEADROOM / GB
+
+def test_cgroup_limit_bounds_the_heap():
+    flags = JVMFlags.generate(None, hardware(64, 60, cgroup=8))
+    assert JVMFlags.memory_required(heap_of(flags)) <= 8 - JVMFlags.HEADROOM / GB
+
+def test_pretouch_depends_on_available_memory():
+    flags = dict(JVMFlags.generate(8 * GB, hardware(32, 30)))
+    assert "-XX:+AlwaysPreTouch" in flags
+
+    flags = dict(JVMFlags.generate(8 * GB, hardware(32, 9)))
+    assert "-XX:+AlwaysPreTouch" not in flags
+    assert "WARNING" not in flags["-Xmx8G"]
+
+    flags = dict(JVMFlags.generate(8 * GB, hardware(32, 6)))
+    assert "WARNING" in flags["-Xmx8G"]
@@ -0,0 +1,66 @@
+import pytest
+
+import KMCEv3
+from KMCEv3 import KCKMCE, RCON_MAX_PAYLOAD
+
+
+class FakeAccounts:
+    """Stands in for AccountClient, which resolves the account server when it is made"""
+    def __init__(self):
+        self.accounts = {"Steve": 100}
+
+    def balance(self, player):
+        return self.accounts.get(player, 0)
+
+@pytest.fixture
+def kmce(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(KMCEv3, "AccountClient", FakeAccounts)
+    kmce = KCKMCE(str(tmp_path))
+    kmce.sent = []
+
+    def run_many(commands, timeout=None):
+        for command in commands:
+            # RCONConnection refuses requests the server cannot read
+            assert len(command.encode('utf-8')) <= RCON_MAX_PAYLOAD
+        kmce.sent += commands
+        return [''] * len(commands)
+    monkeypatch.setattr(kmce, "run_many", run_many)
+    monkeypatch.setattr(kmce, "run", lambda command, timeout=None: run_many([command])[0])
+    return kmce
+
+
+def test_help_is_split_into_requests_the_server_can_read(kmce):
+    for n in range(20):
+        def func(player, args):
+            """Does something useful with a description long enough to fill a line of the chat"""
+        kmce.chatCommands[f'.command{n}'] = func
+
+    kmce.chatCommands['.help']("Steve", ())
+    assert len(kmce.sent) > 1
+    assert all(command.startswith("tellraw Steve ") for command in kmce.sent)
+    sent = "".join(kmce.sent)
+    assert all(f".command{n}: " in sent for n in range(20))
+
+def test_unreachable_account_server_is_not_shown_as_zero(kmce, monkeypatch):
+    monkeypatch.setattr(kmce.ACCOUNTS, "balance", lambda player: None)
+
+    kmce.chatCommands['.bal']("Steve", ())
+    assert "unavailable" in kmce.sent[-1]
+    assert '"0\\n"' not in kmce.sent[-1]
+
+    with open("shop.yml", "w") as f:
+        f.write("sword:\n  Name: Sword\n  Description: Sharp\n  Cost: 10\n  Stock: 3\n  Command: give @s diamond_sword\n")
+    kmce.chatCommands['.buy']("Steve", ("sword",))
+    assert "unavailable" in kmce.sent[-1]
+    assert not any(command.startswith("execute") for command in kmce.sent)
+
+def test_shop_pages_past_the_end_share_the_last_page(kmce):
+    with open("shop.yml", "w") as f:
+        for n in range(7):
+            f.write(f"item{n}:\n  Name: Item {n}\n  Description: An item\n  Cost: 1\n  Stock: 1\n  Command: say hi\n")
+
+    for page in ("2", "999999", "123456789", "0"):
+        kmce.chatCommands['.shop']("Steve", (page,))
+    assert sorted(name for name in kmce.renderCache if name.startswith("shop")) == ["shop 1", "shop 2"]
+    assert "Pg. 2 out of 2" in "".join(kmce.sent)
@@ -0,0 +1,63 @@
+import gzip, os, subprocess, sys, textwrap
+
+from KMCEv3 import KMCE, LogIndex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_archives(directory):
+    logs = os.path.join(directory, "logs")
+    os.makedirs(logs)
+    for n, player in enumerate(("Alice", "Bob", "Alice"), 1):
+        with gzip.open(os.path.join(logs, f"2026-01-01-{n}.log.gz"), "wt") as f:
+            f.write("[12:00:00] [Server thread/INFO]: Starting minecraft server\n")
+            f.write(f"[12:00:01] [Server thread/INFO]: <{player}> .balance\n")
+
+def test_query_with_threads(tmp_path):
+    write_archives(tmp_path)
+    index = LogIndex(str(tmp_path))
+    assert index.build() == 3
+    assert index.build() == 0
+
+    found = list(index.query(player="Alice"))
+    assert [name for name, _ in found] == ["2026-01-01-1.log.gz", "2026-01-01-3.log.gz"]
+    assert all(line.endswith("<Alice> .balance") for _, line in found)
+
+def test_guarded_script_with_processes(tmp_path):
+    # Worker processes are an opt-in for scripts that only start KMCE under a main guard
+    write_archives(tmp_path)
+    script = tmp_path / "script.py"
+    script.write_text(textwrap.dedent(f"""
+        import multiprocessing, sys
+        sys.path.insert(0, {ROOT!r})
+        from KMCEv3 import LogIndex
+
+        if __name__ == "__main__":
+            multiprocessing.set_start_method("spawn")
+            index = LogIndex({str(tmp_path)!r}, workers=2, processes=True)
+            print("indexed", index.build())
+    """))
+
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "indexed 3"
+
+def test_replay_only_runs_idempotent_handlers(tmp_path):
+    write_archives(tmp_path)
+    kmce = KMCE(str(tmp_path))
+    ran = []
+
+    @kmce.chat_command(".balance", idempotent=True)
+    def stats(player, args):
+        ran.append(("stats", player))
+
+    @kmce.expression(r"\.balance")
+    def charge(player, message):
+        ran.append(("charge", player))
+
+    kmce.replay()
+    assert ran == [("stats", "Alice"), ("stats", "Bob"), ("stats", "Alice")]
+
+    # Live lines still run every handler
+    kmce.run_line("[12:00:01] [Server thread/INFO]: <Bob> .balance", cooldown=False)
+    assert ran[3:] == [("stats", "Bob"), ("charge", "Bob")]
@@ -0,0 +1,95 @@
+import gzip, hashlib, json, os, time, threading
+
+import pytest
+
+from KMCEv3 import KMCE
+
+
+class Stop(Exception):
+    pass
+
+def stamp(secondsAgo: float) -> str:
+    return time.strftime("[%H:%M:%S]", time.localtime(time.time() - secondsAgo))
+
+@pytest.fixture
+def kmce(tmp_path):
+    os.makedirs(tmp_path / "logs")
+    return KMCE(str(tmp_path))
+
+def watch(kmce, handler):
+    @kmce.line()
+    def on_line(line):
+        if line.endswith("stop"):
+            raise Stop
+        handler(line)
+
+    with pytest.raises(Stop):
+        kmce.start(update=False, checkpoint=None)
+
+def test_lag_is_of_the_line_being_handled(kmce):
+    with open(kmce.LOGFILE, "w") as f:
+        f.write(f"{stamp(7200)} [Server thread/INFO]: old\n")
+        f.write(f"{stamp(0)} [Server thread/INFO]: new\n")
+        f.write(f"{stamp(0)} [Server thread/INFO]: stop\n")
+
+    lags = {}
+    watch(kmce, lambda line: lags.setdefault(line.rsplit(" ", 1)[1], kmce.stats()["tail"]["seconds_behind"]))
+
+    assert 7190 <= lags["old"] <= 7210
+    assert lags["new"] <= 5
+
+def test_bytes_behind_is_measured_after_the_handlers(kmce):
+    with open(kmce.LOGFILE, "w") as f:
+        f.write(f"{stamp(0)} [Server thread/INFO]: first\n")
+        f.write(f"{stamp(0)} [Server thread/INFO]: second\n")
+
+    handled = threading.Event()
+    watcher = threading.Thread(target=watch, args=(kmce, lambda line: line.endswith("second") and handled.set()), daemon=True)
+    watcher.start()
+
+    assert handled.wait(5)
+    time.sleep(0.05)
+    # Everything that was read is handled, so the watcher is not behind
+    assert kmce.stats()["tail"]["bytes_behind"] == 0
+
+    with open(kmce.LOGFILE, "a") as f:
+        f.write(f"{stamp(0)} [Server thread/INFO]: stop\n")
+    watcher.join(5)
+    assert not watcher.is_alive()
+
+def test_rotated_log_position_is_saved(tmp_path):
+    logs = tmp_path / "logs"
+    os.makedirs(logs)
+    log = logs / "latest.log"
+    log.write_text("".join(f"{stamp(0)} [Server thread/INFO]: {word}\n" for word in ("a", "b", "c")))
+
+    # Stopped after line a, then the server rotated the log
+    data = log.read_bytes()
+    with open(logs / "test.checkpoint.json", "w") as f:
+        json.dump({"inode": os.stat(log).st_ino, "fingerprint": hashlib.sha1(data).hexdigest(), "size": len(data),
+                   "offset": data.index(b"\n") + 1}, f)
+    with gzip.open(logs / "2026-01-01-1.log.gz", "wb") as f:
+        f.write(data)
+    os.remove(log)
+    log.write_text(f"{stamp(0)} [Server thread/INFO]: d\n{stamp(0)} [Server thread/INFO]: stop\n")
+
+    handled = []
+    def run(crashOn):
+        kmce = KMCE(str(tmp_path))
+
+        @kmce.line(idempotent=False)
+        def on_line(line):
+            word = line.rsplit(" ", 1)[1]
+            if word == "stop": raise Stop
+            handled.append(word)
+            if word == crashOn: raise Stop
+
+        with pytest.raises(Stop):
+            kmce.start(update=False, checkpoint="test")
+        kmce.checkpoint.flush()
+
+    run("b")
+    assert handled == ["b"]
+    # A handler that must not run twice is not run again for the lines of the archive
+    run(None)
+    assert handled == ["b", "c", "d"]
@@ -0,0 +1,184 @@
+import hashlib, json, os, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+import MCDownloader
+from MCDownloader import ArtifactCache, Downloader, read_lock
+
+# alpha requires beta, and gamma requires version 1 of delta
+DEPENDENCIES = {
+    "alpha": [{"project_id": "P-beta", "version_id": None, "dependency_type": "required"}],
+    "gamma": [{"project_id": None, "version_id": "v-delta-1", "dependency_type": "required"},
+              {"project_id": "P-alpha", "version_id": None, "dependency_type": "optional"}],
+}
+FILES = {f"{slug}-{n}.jar": os.urandom(20_000) for slug in ("alpha", "beta", "gamma", "delta") for n in (1, 2)}
+
+
+def version(slug, n):
+    data = FILES[f"{slug}-{n}.jar"]
+    return {
+        "id": f"v-{slug}-{n}", "project_id": f"P-{slug}", "version_number": f"{n}.0",
+        "dependencies": DEPENDENCIES.get(slug, []) if n == 2 else [],
+        "files": [{"url": f"{MCDownloader.MODRINTH_API}/files/{slug}-{n}.jar", "filename": f"{slug}-{n}.jar", "primary": True,
+                   "size": len(data), "hashes": {"sha1": hashlib.sha1(data).hexdigest(), "sha512": hashlib.sha512(data).hexdigest()}}]
+    }
+
+class ModrinthServer(ThreadingHTTPServer):
+    """Stub of the Modrinth API endpoints used by resolve_mods and update_mods"""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ModrinthHandler)
+        self.requests = []
+        self.missing = set()    # Files that answer 404
+
+class ModrinthHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args): pass
+
+    def send(self, body, status=200):
+        body = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: json.loads(v[0]) for k, v in parse_qs(url.query).items()}
+        self.server.requests.append(url.path)
+        parts = url.path.split("/")
+
+        if url.path == "/v2/projects":
+            slugs = [i[2:] if i.startswith("P-") else i for i in query["ids"]]
+            return self.send([{"id": f"P-{slug}", "slug": slug} for slug in slugs if slug in ("alpha", "beta", "gamma", "delta")])
+        if url.path == "/v2/versions":
+            # Version IDs are v-<slug>-<n>
+            return self.send([version(i[2:].rsplit("-", 1)[0], int(i.rsplit("-", 1)[1])) for i in query["ids"]])
+        if parts[2] == "project":
+            return self.send([version(parts[3][2:], 2), version(parts[3][2:], 1)])
+        if parts[1] == "files":
+            if parts[2] in self.server.missing:
+                return self.send(b"not found", 404)
+            return self.send(FILES[parts[2]])
+        self.send(b"not found", 404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(self.path)
+        byHash = {hashlib.sha512(data).hexdigest(): name[:-4].rsplit("-", 1) for name, data in FILES.items()}
+        self.send({h: version(byHash[h][0], int(byHash[h][1])) for h in body["hashes"] if h in byHash})
+
+@pytest.fixture
+def server(monkeypatch):
+    server = ModrinthServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(MCDownloader, "MODRINTH_API", f"http://127.0.0.1:{server.server_port}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with Downloader(retries=0, timeout=5, progress=False, verbose=False, cache=ArtifactCache(str(tmp_path / "cache"))) as downloader:
+        yield downloader
+
+def contents(directory):
+    result = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".jar"):
+            with open(os.path.join(directory, name), "rb") as f:
+                result[name] = f.read()
+    return result
+
+def install_old(downloader):
+    """mods/ with version 1 of alpha and a jar that is not managed"""
+    downloader.download_mods(["alpha"], "1.21.1")
+    # Jars are hardlinks of the cache, so they are replaced instead of written to
+    os.remove("mods/alpha-2.jar")
+    with open("mods/alpha-1.jar", "wb") as f:
+        f.write(FILES["alpha-1.jar"])
+    with open("mods/mine.jar", "wb") as f:
+        f.write(b"not from Modrinth")
+
+
+def test_dependencies_are_resolved_in_bulk(server, downloader):
+    lock = downloader.resolve_mods(["alpha", "gamma"], "1.21.1")
+
+    mods = {mod["project"]: mod for mod in lock["mods"]}
+    assert {name: mod["version_id"] for name, mod in mods.items()} == \
+           {"alpha": "v-alpha-2", "gamma": "v-gamma-2", "beta": "v-beta-2", "delta": "v-delta-1"}
+    assert mods["beta"]["required_by"] == "alpha"
+    assert mods["delta"]["required_by"] == "gamma"
+    assert lock["missing"] == []
+    # One request for the projects, one per project for versions, one for the pinned versions and one for names
+    assert sorted(server.requests) == sorted(["/v2/projects", "/v2/project/P-alpha/version", "/v2/project/P-gamma/version",
+                                              "/v2/project/P-beta/version", "/v2/versions", "/v2/projects"])
+
+def test_lockfile_is_used_instead_of_the_api(server, downloader):
+    paths = downloader.download_mods(["alpha", "gamma"], "1.21.1")
+    assert all(paths.values()) and len(paths) == 4
+    lock = read_lock()
+    assert lock["requested"] == ["alpha", "gamma"]
+
+    server.requests.clear()
+    for name in os.listdir("mods"): os.remove(os.path.join("mods", name))
+    downloader.download_mods(["alpha", "gamma"], "1.21.1")
+    assert not any(path.startswith("/v2/") for path in server.requests)
+    assert read_lock() == lock
+    assert sorted(contents("mods")) == ["alpha-2.jar", "beta-2.jar", "delta-1.jar", "gamma-2.jar"]
+
+def test_update_replaces_old_versions(server, downloader):
+    install_old(downloader)
+
+    assert downloader.update_mods(["alpha", "gamma"], "1.21.1")
+    assert contents("mods") == {name: FILES.get(name, b"not from Modrinth") for name in ("alpha-2.jar", "beta-2.jar", "delta-1.jar", "gamma-2.jar", "mine.jar")}
+    assert read_lock()["requested"] == ["alpha", "gamma"]
+    assert not os.path.exists("mods.update") and not os.path.exists("mods.rollback")
+
+def test_failed_download_leaves_mods_unchanged(server, downloader):
+    install_old(downloader)
+    before, lock = contents("mods"), read_lock()
+
+    server.missing.add("gamma-2.jar")
+    assert not downloader.update_mods(["alpha", "gamma"], "1.21.1")
+    assert contents("mods") == before
+    assert read_lock() == lock
+    assert not os.path.exists("mods.update") and not os.path.exists("mods.rollback")
+
+def test_failed_swap_is_rolled_back(server, downloader, monkeypatch):
+    install_old(downloader)
+    before, lock = contents("mods"), read_lock()
+
+    replace = os.replace
+    def broken(src, dst):
+        if src == os.path.join("mods.update", "gamma-2.jar"):
+            raise OSError("disk full")
+        return replace(src, dst)
+    monkeypatch.setattr(MCDownloader.os, "replace", broken)
+
+    assert not downloader.update_mods(["alpha", "gamma"], "1.21.1")
+    assert contents("mods") == before
+    assert read_lock() == lock
+    assert not os.path.exists("mods.rollback")
+
+def test_backup_is_kept_until_it_is_restored(server, downloader, monkeypatch):
+    install_old(downloader)
+    before = contents("mods")
+
+    replace = os.replace
+    def broken(src, dst):
+        # Placing the new jars fails, and so does restoring the old ones
+        if os.path.dirname(dst) == "mods" and ("mods.update" in src or "mods.rollback" in src):
+            raise OSError("disk full")
+        return replace(src, dst)
+    monkeypatch.setattr(MCDownloader.os, "replace", broken)
+    assert not downloader.update_mods(["alpha", "gamma"], "1.21.1")
+    assert sorted(os.listdir("mods.rollback")) == ["alpha-1.jar"]
+
+    # The next update restores the backup before it asks Modrinth (which is unreachable now)
+    monkeypatch.setattr(MCDownloader.os, "replace", replace)
+    monkeypatch.setattr(MCDownloader, "MODRINTH_API", "http://127.0.0.1:1")
+    assert not downloader.update_mods(["alpha", "gamma"], "1.21.1")
+    assert contents("mods") == before
+    assert not os.path.exists("mods.rollback")
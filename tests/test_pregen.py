@@ -0,0 +1,72 @@
+import asyncio, importlib.util, logging, os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def mass(tmp_path, monkeypatch):
+    # adaptive-start.py has a dash in its name and writes verified_ips.json to the working directory when imported
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("adaptive_start", os.path.join(ROOT, "adaptive-start.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_manager(mass, tmp_path, monkeypatch, rcon):
+    config = mass.DEFAULT_CONFIG | {
+        "server_dir": str(tmp_path), "pregen_radius": 512, "pregen_max_stalls": 3,
+        "auto_stop_empty_minutes": 0.0005, "auto_stop_poll_interval": 0.001,
+        "_rcon_enabled": True, "_rcon_port": 25575, "_rcon_password": "pw"
+    }
+    manager = mass.ServerManager(config)
+    manager.stopped = False
+
+    async def online():
+        return 0
+    async def stop():
+        manager.stopped = True
+    monkeypatch.setattr(manager, "get_online_count", online)
+    monkeypatch.setattr(manager, "stop_server", stop)
+    monkeypatch.setattr(mass, "rcon_send", rcon)
+    return manager
+
+@pytest.mark.parametrize("method", ["chunky", "forceload"])
+def test_empty_server_stops_when_rcon_does_not_answer(mass, tmp_path, monkeypatch, caplog, method):
+    async def rcon(host, port, password, command):
+        return None
+    manager = make_manager(mass, tmp_path, monkeypatch, rcon)
+    manager.config["pregen_method"] = method
+
+    with caplog.at_level(logging.WARNING, "ServerStarter"):
+        asyncio.run(asyncio.wait_for(manager.auto_stop_monitor(), 5))
+    assert manager.stopped
+    assert "RCON did not answer" in caplog.text
+
+def test_empty_server_stops_when_the_server_stays_slow(mass, tmp_path, monkeypatch, caplog):
+    commands = []
+    async def rcon(host, port, password, command):
+        commands.append(command)
+        return "Average time per tick: 80.0ms" if command == "tick query" else ""
+    manager = make_manager(mass, tmp_path, monkeypatch, rcon)
+
+    with caplog.at_level(logging.WARNING, "ServerStarter"):
+        asyncio.run(asyncio.wait_for(manager.auto_stop_monitor(), 5))
+    assert manager.stopped
+    assert "above 40 mspt" in caplog.text
+    assert set(commands) == {"tick query"}
+
+def test_generation_keeps_the_server_awake(mass, tmp_path, monkeypatch):
+    polls = []
+    async def rcon(host, port, password, command):
+        polls.append(command)
+        if command == "chunky progress" and polls.count(command) > 20:
+            return "No tasks running"
+        return "Task running for minecraft:overworld. Processed: 10 chunks (1.50%)"
+    manager = make_manager(mass, tmp_path, monkeypatch, rcon)
+
+    asyncio.run(asyncio.wait_for(manager.auto_stop_monitor(), 5))
+    assert manager.stopped
+    # It only stopped once the generation was done
+    assert polls.count("chunky progress") == 21
@@ -0,0 +1,51 @@
+import threading, time
+
+from KMCEv3 import RateLimiter
+
+PLAYERS = 100_000
+RATE = 0.5 # Buckets are full again 1/RATE seconds after a call, which is longer than the 100k calls take
+
+
+def test_single_thread_100k_players():
+    limiter = RateLimiter()
+
+    start = time.perf_counter()
+    allowed = [limiter.allow(("buy", f"player{i}"), RATE) for i in range(PLAYERS)]
+    blocked = [limiter.allow(("buy", f"player{i}"), RATE) for i in range(PLAYERS)]
+    took = time.perf_counter() - start
+    print(f"\n{2 * PLAYERS} calls on one thread: {took:.2f}s")
+
+    assert all(allowed)
+    assert not any(blocked)
+    assert len(limiter) == PLAYERS
+    assert took < 10
+
+    time.sleep(2 / RATE)
+    assert len(limiter) == 0
+
+def test_threads_share_100k_players():
+    limiter = RateLimiter()
+    threads = 4
+    allowed = [0] * threads
+
+    def run(n):
+        # Every thread calls for every player, so each player is allowed exactly once in total
+        for i in range(PLAYERS):
+            allowed[n] += limiter.allow(("buy", f"player{i}"), RATE)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    took = time.perf_counter() - start
+    print(f"\n{threads * PLAYERS} calls on {threads} threads: {took:.2f}s")
+
+    assert sum(allowed) == PLAYERS
+    assert len(limiter) == PLAYERS
+    assert took < 20
+
+def test_burst_and_refill():
+    limiter = RateLimiter()
+    assert [limiter.allow("key", RATE * 40, burst=3) for _ in range(4)] == [True, True, True, False]
+    time.sleep(1.5 / (RATE * 40))
+    assert limiter.allow("key", RATE * 40, burst=3)
@@ -0,0 +1,39 @@
+import os, threading
+import yaml
+
+from KMCEv3 import ShopCatalog
+
+
+def test_parallel_buys_of_a_single_stock_item(tmp_path):
+    path = tmp_path / "shop.yml"
+    path.write_text(yaml.safe_dump({"sword": {"Name": "Sword", "Cost": 10, "Stock": 1, "Command": "give {player} diamond_sword"}}))
+    shop = ShopCatalog(str(path), flush_delay=60)
+
+    start = threading.Barrier(200)
+    results = []
+    def buy():
+        start.wait()
+        results.append(shop.take("sword"))
+
+    threads = [threading.Thread(target=buy) for _ in range(200)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    assert results.count(True) == 1
+    assert shop.get("sword")["Stock"] == 0
+
+    shop.flush()
+    assert yaml.safe_load(path.read_text())["sword"]["Stock"] == 0
+    assert not os.path.exists(shop.JOURNAL) or os.path.getsize(shop.JOURNAL) == 0
+
+    # A fresh catalog sees the same stock
+    assert ShopCatalog(str(path)).get("sword")["Stock"] == 0
+
+def test_journal_is_replayed_after_a_crash(tmp_path):
+    path = tmp_path / "shop.yml"
+    path.write_text(yaml.safe_dump({"apple": {"Name": "Apple", "Cost": 1, "Stock": 5, "Command": ""}}))
+    shop = ShopCatalog(str(path), flush_delay=60)
+    assert shop.take("apple", 2)
+    shop.timer.cancel() # The process "crashes" before the write-behind flush
+
+    assert ShopCatalog(str(path)).get("apple")["Stock"] == 3